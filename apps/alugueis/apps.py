@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AlugueisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.alugueis'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,104 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from apps.core.cache import ALUGUEIS, invalidar
+from apps.veiculos.models import HistoricoStatusCarro
+from .models import Aluguel
+
+
+logger = logging.getLogger(__name__)
+
+# Aluguéis marcados por transação: limita a memória e o tempo de cada bloqueio
+LOTE = 1000
+
+_varredor = None
+_lock = threading.Lock()
+
+
+def marcar_atrasados(hoje=None, lote=LOTE):
+    """Passa a 'atrasado' os aluguéis ativos cujo fim previsto já passou.
+
+    Cada lote é lido pelo índice (status, data_fim_prevista), atualizado com
+    um único UPDATE e registado no histórico dos carros com bulk_create.
+    Devolve {'alugueis': marcados, 'duracao': segundos}.
+    """
+    inicio = time.perf_counter()
+    hoje = hoje or timezone.localdate()
+    agora = timezone.now()
+    total = 0
+    while True:
+        with transaction.atomic():
+            vencidos = list(
+                Aluguel.objects.select_for_update()
+                .filter(status='ativo', data_fim_prevista__lt=hoje)
+                .order_by('data_fim_prevista', 'id')
+                .values_list('id', 'carro_id', 'funcionario_id', 'data_fim_prevista')[:lote]
+            )
+            if not vencidos:
+                break
+            Aluguel.objects.filter(pk__in=[linha[0] for linha in vencidos], status='ativo').update(status='atrasado')
+            HistoricoStatusCarro.objects.bulk_create([
+                HistoricoStatusCarro(
+                    carro_id=carro_id, funcionario_id=funcionario_id,
+                    status_anterior='ativo', status_novo='atrasado', data_alteracao=agora,
+                    motivo=f'Aluguel #{aluguel_id} não devolvido até {fim:%d/%m/%Y}',
+                )
+                for aluguel_id, carro_id, funcionario_id, fim in vencidos
+            ])
+        total += len(vencidos)
+
+    if total:
+        # update() não dispara os sinais de Aluguel: o calendário de disponibilidade é invalidado aqui
+        invalidar(ALUGUEIS)
+    return {'alugueis': total, 'duracao': time.perf_counter() - inicio}
+
+
+class VarredorAtrasos(threading.Thread):
+    """Thread que chama marcar_atrasados de `intervalo` em `intervalo` segundos"""
+
+    def __init__(self, intervalo):
+        super().__init__(name='varredor-atrasos', daemon=True)
+        self.intervalo = intervalo
+        self.parar = threading.Event()
+
+    def run(self):
+        while not self.parar.wait(self.intervalo):
+            try:
+                resultado = marcar_atrasados()
+                if resultado['alugueis']:
+                    logger.info(
+                        '%d aluguéis marcados como atrasados em %.3fs',
+                        resultado['alugueis'], resultado['duracao'],
+                    )
+            except Exception:
+                logger.exception('Falha ao marcar os aluguéis atrasados')
+            finally:
+                # A thread não passa pelo ciclo de pedidos, que fecha as ligações antigas
+                close_old_connections()
+
+
+def iniciar_varredor(intervalo):
+    """Arranca o varredor periódico deste processo (uma vez só)"""
+    global _varredor
+    with _lock:
+        if _varredor is None or not _varredor.is_alive():
+            _varredor = VarredorAtrasos(intervalo)
+            _varredor.start()
+        return _varredor
+
+
+def iniciar_no_servidor():
+    """Arranca o varredor se VARREDURA_ATRASOS_INTERVALO > 0.
+
+    Chamado só por wsgi.py e asgi.py, e não no ready() da app: os comandos de
+    gestão (migrate, gerar_dados, testes...) carregam as apps mas não servem
+    pedidos e não devem varrer nada.
+    """
+    if settings.VARREDURA_ATRASOS_INTERVALO > 0:
+        return iniciar_varredor(settings.VARREDURA_ATRASOS_INTERVALO)
+    return None
@@ -0,0 +1,110 @@
+import threading
+import time
+from bisect import bisect_right
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.core.cache import ALUGUEIS, versao
+from .models import Aluguel
+
+
+# Disponibilidade dos carros de aluguel por datas.
+#
+# Um aluguel ativo ocupa o carro de data_inicio a data_fim_prevista (dias
+# inclusivos); um atrasado ocupa-o pelo menos até hoje, porque o carro ainda
+# não voltou. Finalizados e cancelados não ocupam.
+#
+# O calendário guarda, por carro, os intervalos ocupados ordenados e fundidos
+# (sem sobreposições), lidos numa consulta. Saber se um carro está livre num
+# intervalo é uma busca binária na sua lista, e a frota inteira é respondida
+# numa passagem pelos carros com aluguéis. Fica na memória do processo, ligado
+# à versão do namespace ALUGUEIS (incrementada pelos sinais de Aluguel) e ao
+# dia de hoje; DISPONIBILIDADE_VALIDADE limita o tempo em que outro processo,
+# com cache em memória local, pode servir um calendário desatualizado.
+#
+# A validação de um aluguel novo (Aluguel.clean e Aluguel.save, ver servicos.py)
+# não usa o calendário: consulta o banco, para nunca aceitar uma sobreposição
+# por causa de dados em memória.
+
+_memoria = {}
+_lock = threading.Lock()
+
+
+def _ultimo_dia(data_fim_prevista, status, hoje):
+    return max(data_fim_prevista, hoje) if status == 'atrasado' else data_fim_prevista
+
+
+class CalendarioDisponibilidade:
+    """Intervalos ocupados de cada carro, ordenados e sem sobreposições"""
+
+    def __init__(self, hoje=None):
+        self.hoje = hoje or timezone.localdate()
+        self._inicios, self._fins = {}, {}
+        for carro_id, inicio, fim, status in (
+            Aluguel.objects.filter(status__in=Aluguel.STATUS_OCUPAM)
+            .order_by('carro_id', 'data_inicio')
+            .values_list('carro_id', 'data_inicio', 'data_fim_prevista', 'status')
+        ):
+            fim = _ultimo_dia(fim, status, self.hoje)
+            inicios = self._inicios.setdefault(carro_id, [])
+            fins = self._fins.setdefault(carro_id, [])
+            # Sobrepostos ou encostados (fim + 1 dia) formam um único intervalo
+            if fins and inicio <= fins[-1] + timedelta(days=1):
+                fins[-1] = max(fins[-1], fim)
+            else:
+                inicios.append(inicio)
+                fins.append(fim)
+
+    def intervalos(self, carro_id):
+        """[(início, fim), ...] ocupados do carro, por ordem"""
+        return list(zip(self._inicios.get(carro_id, ()), self._fins.get(carro_id, ())))
+
+    def ocupado(self, carro_id, inicio, fim):
+        """O carro tem algum dia de [inicio, fim] ocupado?"""
+        inicios = self._inicios.get(carro_id)
+        if not inicios:
+            return False
+        # O último intervalo que começa até `fim` é, por estarem fundidos, o que acaba mais tarde
+        posicao = bisect_right(inicios, fim) - 1
+        return posicao >= 0 and self._fins[carro_id][posicao] >= inicio
+
+    def ocupados(self, inicio, fim):
+        """Ids dos carros com algum dia de [inicio, fim] ocupado"""
+        return {carro_id for carro_id in self._inicios if self.ocupado(carro_id, inicio, fim)}
+
+
+def calendario():
+    """Calendário deste processo, recarregado quando os aluguéis mudam ou o dia vira"""
+    chave = (versao(ALUGUEIS), timezone.localdate())
+    agora = time.monotonic()
+    entrada = _memoria.get('calendario')
+    if entrada is not None and entrada[0] == chave and agora < entrada[1]:
+        return entrada[2]
+
+    valor = CalendarioDisponibilidade(hoje=chave[1])
+    with _lock:
+        _memoria['calendario'] = (chave, agora + settings.DISPONIBILIDADE_VALIDADE, valor)
+    return valor
+
+
+def limpar():
+    """Descarta o calendário deste processo"""
+    with _lock:
+        _memoria.clear()
+
+
+def conflitos(carro_id, inicio, fim, excluir=None):
+    """Aluguéis que ocupam o carro em algum dia de [inicio, fim], lidos do banco"""
+    ate_ao_fim = Q(data_fim_prevista__gte=inicio)
+    if timezone.localdate() >= inicio:
+        # O atrasado ainda ocupa o carro hoje, seja qual for o fim previsto
+        ate_ao_fim |= Q(status='atrasado')
+    alugueis = Aluguel.objects.filter(
+        ate_ao_fim, carro_id=carro_id, status__in=Aluguel.STATUS_OCUPAM, data_inicio__lte=fim
+    )
+    if excluir is not None:
+        alugueis = alugueis.exclude(pk=excluir)
+    return alugueis.order_by('data_inicio')
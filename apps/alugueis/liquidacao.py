@@ -0,0 +1,143 @@
+import heapq
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from apps.vendas.periodos import CENTAVO, em_kwanzas, soma_centavos
+from .models import Aluguel
+
+
+# Liquidação de aluguéis e contas a receber.
+#
+# valor final = valor previsto
+#             + dias de atraso x valor diário x FATOR_ATRASO
+#             + km acima da franquia x VALOR_KM_EXCEDENTE
+# saldo       = valor final - pagamentos - caução
+#
+# Saldo positivo é o que o cliente ainda deve; negativo, o que a
+# concessionária lhe devolve da caução. Os pagamentos de todos os aluguéis
+# são somados numa única consulta agrupada (em centavos, exata) e as contas de
+# cada aluguel feitas em Python sobre essas linhas, sem consultas por aluguel.
+# Para um aluguel ainda não devolvido, o atraso conta até hoje.
+
+# Cada dia além do fim previsto custa o valor diário com este acréscimo
+FATOR_ATRASO = Decimal('1.5')
+
+# Quilómetros incluídos por dia de aluguel e preço de cada km acima da franquia (Kz)
+KM_POR_DIA = 250
+VALOR_KM_EXCEDENTE = Decimal('150.00')
+
+CAMPOS = (
+    'id', 'carro_id', 'carro__matricula', 'cliente_id', 'cliente__nome', 'status',
+    'data_inicio', 'data_fim_prevista', 'data_fim_real',
+    'valor_diario', 'valor_total_previsto', 'deposito_caucao',
+    'quilometragem_inicial', 'quilometragem_final',
+)
+
+# Linhas lidas de cada vez do cursor no relatório
+LOTE_LEITURA = 2000
+
+
+def com_pagamentos(alugueis):
+    """Valores dos aluguéis com o total pago (em centavos), numa consulta agrupada"""
+    return alugueis.values(*CAMPOS).annotate(
+        pago_centavos=Coalesce(soma_centavos('pagamentos__valor'), 0)
+    ).order_by('id')
+
+
+def calcular(linha, hoje=None):
+    """Valor final e saldo de um aluguel, a partir de uma linha de com_pagamentos"""
+    hoje = hoje or timezone.localdate()
+    devolucao = linha['data_fim_real'] or max(hoje, linha['data_inicio'])
+    dias_atraso = max((devolucao - linha['data_fim_prevista']).days, 0)
+    dias_uso = max((devolucao - linha['data_inicio']).days, 1)
+
+    km_excedente = 0
+    if linha['quilometragem_inicial'] is not None and linha['quilometragem_final'] is not None:
+        rodados = linha['quilometragem_final'] - linha['quilometragem_inicial']
+        km_excedente = max(rodados - KM_POR_DIA * dias_uso, 0)
+
+    valor_atraso = (linha['valor_diario'] * dias_atraso * FATOR_ATRASO).quantize(CENTAVO)
+    valor_km = VALOR_KM_EXCEDENTE * km_excedente
+    valor_final = linha['valor_total_previsto'] + valor_atraso + valor_km
+    pago = em_kwanzas(linha['pago_centavos'])
+    return {
+        **linha,
+        'dias_atraso': dias_atraso,
+        'km_excedente': km_excedente,
+        'valor_atraso': valor_atraso,
+        'valor_km_excedente': valor_km,
+        'valor_final': valor_final,
+        'valor_pago': pago,
+        'saldo': valor_final - pago - linha['deposito_caucao'],
+    }
+
+
+def saldos(alugueis=None, hoje=None):
+    """Gera o cálculo de cada aluguel (por omissão, os ainda não devolvidos), lido em lotes"""
+    if alugueis is None:
+        alugueis = Aluguel.objects.filter(status__in=Aluguel.STATUS_OCUPAM)
+    hoje = hoje or timezone.localdate()
+    for linha in com_pagamentos(alugueis).iterator(chunk_size=LOTE_LEITURA):
+        yield calcular(linha, hoje)
+
+
+def contas_a_receber(hoje=None, maiores=20):
+    """Totais dos aluguéis em curso e os `maiores` saldos devedores.
+
+    A memória usada não depende do número de contratos: as linhas são
+    acumuladas à medida que saem do cursor.
+    """
+    totais = {
+        'contratos': 0, 'atrasados': 0,
+        'valor_final': Decimal('0.00'), 'valor_pago': Decimal('0.00'),
+        'caucao': Decimal('0.00'), 'a_receber': Decimal('0.00'), 'a_devolver': Decimal('0.00'),
+    }
+    devedores = []
+    for linha in saldos(hoje=hoje):
+        totais['contratos'] += 1
+        totais['atrasados'] += linha['dias_atraso'] > 0
+        totais['valor_final'] += linha['valor_final']
+        totais['valor_pago'] += linha['valor_pago']
+        totais['caucao'] += linha['deposito_caucao']
+        if linha['saldo'] > 0:
+            totais['a_receber'] += linha['saldo']
+            # Heap com os `maiores` saldos: não cresce com o número de contratos
+            item = (linha['saldo'], -linha['id'], linha)
+            if len(devedores) < maiores:
+                heapq.heappush(devedores, item)
+            elif maiores:
+                heapq.heappushpop(devedores, item)
+        else:
+            totais['a_devolver'] -= linha['saldo']
+    totais['maiores_devedores'] = [linha for _, _, linha in sorted(devedores, reverse=True)]
+    return totais
+
+
+def liquidar(aluguel_id, data_devolucao=None, quilometragem_final=None):
+    """Finaliza o aluguel na devolução do carro, gravando o valor final; devolve o cálculo"""
+    with transaction.atomic():
+        aluguel = Aluguel.objects.select_for_update().get(pk=aluguel_id)
+        if aluguel.status not in Aluguel.STATUS_OCUPAM:
+            raise ValidationError(f'O aluguel #{aluguel.pk} já está {aluguel.get_status_display().lower()}.')
+        data_devolucao = data_devolucao or timezone.localdate()
+        if data_devolucao < aluguel.data_inicio:
+            raise ValidationError({'data_fim_real': 'A devolução não pode ser anterior ao início do aluguel.'})
+        if quilometragem_final is not None and quilometragem_final < (aluguel.quilometragem_inicial or 0):
+            raise ValidationError({'quilometragem_final': 'A quilometragem final é inferior à inicial.'})
+
+        aluguel.data_fim_real = data_devolucao
+        if quilometragem_final is not None:
+            aluguel.quilometragem_final = quilometragem_final
+        linha = com_pagamentos(Aluguel.objects.filter(pk=aluguel.pk)).get()
+        linha.update(data_fim_real=aluguel.data_fim_real, quilometragem_final=aluguel.quilometragem_final)
+        resultado = calcular(linha)
+        resultado['status'] = 'finalizado'
+
+        aluguel.valor_total_final = resultado['valor_final']
+        aluguel.status = 'finalizado'
+        aluguel.save(update_fields=['data_fim_real', 'quilometragem_final', 'valor_total_final', 'status'])
+    return resultado
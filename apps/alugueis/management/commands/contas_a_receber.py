@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from apps.alugueis import liquidacao
+
+
+class Command(BaseCommand):
+    help = 'Relatório de contas a receber dos aluguéis em curso (valor final, pago, caução e saldo)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--maiores', type=int, default=20, help='Quantos maiores devedores listar')
+
+    def handle(self, *args, **options):
+        totais = liquidacao.contas_a_receber(maiores=max(options['maiores'], 0))
+        self.stdout.write(
+            f'{totais["contratos"]} contratos em curso ({totais["atrasados"]} atrasados)\n'
+            f'Valor final: {totais["valor_final"]} Kz | Pago: {totais["valor_pago"]} Kz | '
+            f'Caução: {totais["caucao"]} Kz'
+        )
+        for linha in totais['maiores_devedores']:
+            self.stdout.write(
+                f'  #{linha["id"]} {linha["cliente__nome"]} ({linha["carro__matricula"]}): '
+                f'{linha["saldo"]} Kz, {linha["dias_atraso"]} dias de atraso'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'A receber: {totais["a_receber"]} Kz | A devolver: {totais["a_devolver"]} Kz'
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.alugueis import atrasos
+
+
+class Command(BaseCommand):
+    help = 'Marca como atrasados os aluguéis ativos cujo fim previsto já passou (para correr num cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=atrasos.LOTE, help='Aluguéis por transação')
+
+    def handle(self, *args, **options):
+        if options['lote'] < 1:
+            raise CommandError('--lote tem de ser positivo.')
+        resultado = atrasos.marcar_atrasados(lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{resultado["alugueis"]} aluguéis marcados como atrasados em {resultado["duracao"]:.3f}s.'
+        ))
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.5 on 2026-10-17 00:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alugueis', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='aluguel',
+            index=models.Index(fields=['carro', 'status'], name='aluguel_carro_status_idx'),
+        ),
+    ]
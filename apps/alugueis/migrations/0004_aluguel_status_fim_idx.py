@@ -0,0 +1,17 @@
+# Generated by Django 5.1.5 on 2026-10-17 03:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alugueis', '0003_aluguel_carro_status_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='aluguel',
+            index=models.Index(fields=['status', 'data_fim_prevista'], name='aluguel_status_fim_idx'),
+        ),
+    ]
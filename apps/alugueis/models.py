@@ -1,4 +1,5 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from apps.usuarios.models import Cliente, Funcionario
 
 class Aluguel(models.Model):
@@ -11,6 +12,9 @@ class Aluguel(models.Model):
         ('atrasado', 'Atrasado'),
     )
     
+    # Estados em que o carro está (ou vai estar) com o cliente
+    STATUS_OCUPAM = ('ativo', 'atrasado')
+    
     carro = models.ForeignKey(
         'veiculos.Carro', # string para referência para evitar o erro da importacao circular
         on_delete=models.CASCADE,
@@ -95,9 +99,45 @@ class Aluguel(models.Model):
         verbose_name = 'Aluguel'
         verbose_name_plural = 'Aluguéis'
         ordering = ['-data_criacao']
+        indexes = [
+            models.Index(fields=['carro', 'status'], name='aluguel_carro_status_idx'),
+            # Varredura dos atrasados: ativos com o fim previsto já passado
+            models.Index(fields=['status', 'data_fim_prevista'], name='aluguel_status_fim_idx'),
+        ]
     
     def __str__(self):
         return f"Aluguel #{self.id} - {self.carro} - {self.cliente.nome}"
+    
+    def clean(self):
+        super().clean()
+        if not (self.data_inicio and self.data_fim_prevista):
+            return
+        if self.data_fim_prevista < self.data_inicio:
+            raise ValidationError({
+                'data_fim_prevista': 'A data de fim prevista não pode ser anterior à data de início.'
+            })
+        self.verificar_sobreposicao()
+
+    def verificar_sobreposicao(self):
+        """Levanta ValidationError se outro aluguel ocupar o carro em algum destes dias"""
+        if not (self.carro_id and self.status in self.STATUS_OCUPAM):
+            return
+        # Import local: disponibilidade importa este módulo
+        from .disponibilidade import conflitos
+        conflito = conflitos(self.carro_id, self.data_inicio, self.data_fim_prevista, excluir=self.pk).first()
+        if conflito is not None:
+            raise ValidationError(
+                f'O carro já está alugado de {conflito.data_inicio:%d/%m/%Y} a '
+                f'{conflito.data_fim_prevista:%d/%m/%Y} (aluguel #{conflito.pk}).'
+            )
+
+    def save(self, *args, **kwargs):
+        # clean() só corre com full_clean(); aqui a verificação vale para qualquer
+        # caminho (create(), save(), admin, comandos), com o carro bloqueado
+        from .servicos import reservar_carro
+        with transaction.atomic():
+            reservar_carro(self)
+            super().save(*args, **kwargs)
 
 
 class PagamentoAluguel(models.Model):
@@ -0,0 +1,25 @@
+from apps.veiculos.models import Carro
+from .models import Aluguel
+
+
+# Gravação de um aluguel sem reservas sobrepostas.
+#
+# Aluguel.clean() recusa um aluguel que se sobreponha a outro, mas só corre
+# com full_clean() e não impede que dois pedidos simultâneos passem ambos a
+# verificação antes de gravar. Por isso Aluguel.save() repete-a numa
+# transação, com a linha do carro bloqueada (SELECT ... FOR UPDATE): o
+# segundo pedido espera pelo commit do primeiro e já vê o aluguel dele.
+# Aluguéis que não ocupam o carro (finalizados, cancelados) gravam-se sem
+# bloqueio.
+
+
+def reservar_carro(aluguel):
+    """Bloqueia o carro do aluguel até ao fim da transação e confirma que está livre nas datas pedidas.
+
+    Tem de correr dentro de transaction.atomic(). Levanta ValidationError se
+    outro aluguel já ocupar o carro em algum desses dias.
+    """
+    if not (aluguel.carro_id and aluguel.status in Aluguel.STATUS_OCUPAM):
+        return
+    list(Carro.objects.select_for_update().filter(pk=aluguel.carro_id).values_list('pk'))
+    aluguel.verificar_sobreposicao()
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.core.cache import ALUGUEIS, invalidar
+from .models import Aluguel
+
+
+@receiver(post_save, sender=Aluguel)
+@receiver(post_delete, sender=Aluguel)
+def invalidar_calendario(sender, instance, **kwargs):
+    """Calendário de disponibilidade e páginas da loja filtradas por datas"""
+    invalidar(ALUGUEIS)
@@ -1,3 +1,292 @@
-from django.test import TestCase
+import random
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.apps import apps
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from io import StringIO
+
+from apps.core.cache import ALUGUEIS, invalidar, versao
+from apps.usuarios.models import Cliente, Funcionario
+from apps.veiculos.models import Carro, Cor, Marca, Modelo, HistoricoStatusCarro
+from . import atrasos, disponibilidade, liquidacao
+from .models import Aluguel, PagamentoAluguel
+
+
+class DisponibilidadeTests(TestCase):
+    """Calendário de aluguéis: intervalos por carro, sobreposições e filtro da loja"""
+
+    @classmethod
+    def setUpTestData(cls):
+        modelo = Modelo.objects.create(marca=Marca.objects.create(nome='Suzuki'), nome='Jimny', categoria='suv')
+        cor = Cor.objects.create(nome='Verde')
+        cls.carros = [
+            Carro.objects.create(
+                modelo=modelo, cor=cor, ano_fabricacao=2023, ano_modelo=2023, condicao='novo',
+                combustivel='gasolina', transmissao='manual', chassi=f'A{i:016d}', matricula=f'LD-AL-{i:02d}',
+                disponivel_venda=False, disponivel_aluguel=True, preco_aluguel_diario=Decimal('30000.00'),
+            )
+            for i in range(4)
+        ]
+        cls.cliente = Cliente.objects.create(nome='Cliente Aluguer', bilhete_identidade='777777777LA777')
+        cls.funcionario = Funcionario.objects.create(nome='Balcão', bilhete_identidade='888888888LA888')
+        cls.hoje = timezone.localdate()
+
+    def setUp(self):
+        cache.clear()
+        disponibilidade.limpar()
+
+    def alugar(self, carro, inicio, fim, status='ativo', verificar=True):
+        aluguel = Aluguel(
+            carro=self.carros[carro], cliente=self.cliente, funcionario=self.funcionario,
+            data_inicio=inicio, data_fim_prevista=fim, status=status,
+            valor_diario=Decimal('30000.00'), valor_total_previsto=Decimal('30000.00'),
+        )
+        if verificar:
+            aluguel.save()
+            return aluguel
+        # Dados antigos com sobreposições, gravados sem a verificação (como os de gerar_dados)
+        Aluguel.objects.bulk_create([aluguel])
+        invalidar(ALUGUEIS)
+        return aluguel
+
+    def dia(self, n):
+        return self.hoje + timedelta(days=n)
+
+    def test_intervalos_fundidos_e_limites(self):
+        self.alugar(0, self.dia(10), self.dia(15))
+        self.alugar(0, self.dia(14), self.dia(20), verificar=False)
+        self.alugar(0, self.dia(22), self.dia(25))
+        self.alugar(0, self.dia(1), self.dia(30), status='cancelado')
+        # Atrasado: continua ocupado até hoje, mesmo com o fim previsto no passado
+        self.alugar(1, self.dia(-10), self.dia(-3), status='atrasado')
+
+        calendario = disponibilidade.calendario()
+        self.assertEqual(calendario.intervalos(self.carros[0].pk), [(self.dia(10), self.dia(20)), (self.dia(22), self.dia(25))])
+        self.assertFalse(calendario.ocupado(self.carros[0].pk, self.dia(21), self.dia(21)))
+        self.assertTrue(calendario.ocupado(self.carros[0].pk, self.dia(20), self.dia(21)))
+        self.assertTrue(calendario.ocupado(self.carros[0].pk, self.dia(1), self.dia(40)))
+        self.assertFalse(calendario.ocupado(self.carros[0].pk, self.dia(26), self.dia(40)))
+        self.assertEqual(calendario.ocupados(self.dia(0), self.dia(0)), {self.carros[1].pk})
+
+    def test_calendario_igual_a_consulta_ao_banco(self):
+        rng = random.Random(7)
+        for _ in range(80):
+            inicio = self.dia(rng.randrange(-30, 60))
+            self.alugar(
+                rng.randrange(len(self.carros)), inicio, inicio + timedelta(days=rng.randrange(0, 8)),
+                status=rng.choice(('ativo', 'ativo', 'atrasado', 'finalizado', 'cancelado')), verificar=False,
+            )
+        calendario = disponibilidade.calendario()
+        for _ in range(200):
+            inicio = self.dia(rng.randrange(-40, 70))
+            fim = inicio + timedelta(days=rng.randrange(0, 10))
+            esperado = {
+                carro.pk for carro in self.carros
+                if disponibilidade.conflitos(carro.pk, inicio, fim).exists()
+            }
+            self.assertEqual(calendario.ocupados(inicio, fim), esperado, (inicio, fim))
+
+    def test_clean_recusa_sobreposicao(self):
+        existente = self.alugar(0, self.dia(5), self.dia(9))
+        novo = Aluguel(
+            carro=self.carros[0], cliente=self.cliente, funcionario=self.funcionario,
+            data_inicio=self.dia(9), data_fim_prevista=self.dia(12),
+            valor_diario=Decimal('30000.00'), valor_total_previsto=Decimal('120000.00'),
+        )
+        with self.assertRaisesMessage(ValidationError, f'aluguel #{existente.pk}'):
+            novo.full_clean()
+
+        # Encostado (começa no dia seguinte) é permitido, e editar o próprio aluguel também
+        novo.data_inicio = self.dia(10)
+        novo.full_clean()
+        existente.data_fim_prevista = self.dia(10)
+        existente.full_clean()
+
+        novo.data_fim_prevista = self.dia(8)
+        with self.assertRaises(ValidationError) as erro:
+            novo.full_clean()
+        self.assertIn('data_fim_prevista', erro.exception.message_dict)
+
+    def test_save_recusa_sobreposicao(self):
+        # Sem full_clean(): create() e save() diretos também verificam, com o carro bloqueado
+        existente = self.alugar(0, self.dia(5), self.dia(9))
+        with self.assertRaisesMessage(ValidationError, f'aluguel #{existente.pk}'):
+            self.alugar(0, self.dia(8), self.dia(12))
+        novo = self.alugar(0, self.dia(10), self.dia(12))
+        novo.data_inicio = self.dia(9)
+        with self.assertRaises(ValidationError):
+            novo.save()
+        self.assertEqual(Aluguel.objects.filter(carro=self.carros[0]).count(), 2)
+
+        # Com o carro atrasado, um aluguel a começar hoje também é recusado
+        self.alugar(1, self.dia(-10), self.dia(-3), status='atrasado')
+        with self.assertRaises(ValidationError):
+            self.alugar(1, self.dia(0), self.dia(2))
+
+        # Um aluguel que não ocupa o carro grava-se, e o existente pode ser finalizado
+        self.alugar(0, self.dia(5), self.dia(9), status='cancelado')
+        existente.status = 'finalizado'
+        existente.save()
+        self.alugar(0, self.dia(6), self.dia(7))
+
+    def test_loja_filtra_por_datas_de_aluguel(self):
+        self.alugar(0, self.dia(3), self.dia(6))
+        self.alugar(2, self.dia(6), self.dia(8))
+        url = reverse('website:loja')
+
+        resposta = self.client.get(url, {'aluguel_inicio': self.dia(4).isoformat(), 'aluguel_fim': self.dia(6).isoformat()})
+        self.assertEqual({carro.pk for carro in resposta.context['carros']}, {self.carros[1].pk, self.carros[3].pk})
+
+        # Um aluguel novo invalida o calendário e as páginas em cache
+        self.alugar(1, self.dia(1), self.dia(4))
+        resposta = self.client.get(url, {'aluguel_inicio': self.dia(4).isoformat(), 'aluguel_fim': self.dia(6).isoformat()})
+        self.assertEqual({carro.pk for carro in resposta.context['carros']}, {self.carros[3].pk})
+
+        # Datas inválidas ou trocadas são ignoradas: volta o catálogo de venda (vazio aqui)
+        resposta = self.client.get(url, {'aluguel_inicio': self.dia(6).isoformat(), 'aluguel_fim': self.dia(4).isoformat()})
+        self.assertEqual(list(resposta.context['carros']), [])
+
+
+class AtrasosTests(TestCase):
+    """Varredura dos aluguéis atrasados"""
+
+    @classmethod
+    def setUpTestData(cls):
+        modelo = Modelo.objects.create(marca=Marca.objects.create(nome='Mazda'), nome='CX-5', categoria='suv')
+        cls.carro = Carro.objects.create(
+            modelo=modelo, cor=Cor.objects.create(nome='Vermelho'), ano_fabricacao=2021, ano_modelo=2021,
+            condicao='usado', combustivel='gasolina', transmissao='automatica',
+            chassi='T0000000000000001', matricula='LD-AT-01', disponivel_aluguel=True,
+        )
+        cls.cliente = Cliente.objects.create(nome='Cliente Atrasado', bilhete_identidade='999999999LA999')
+        cls.funcionario = Funcionario.objects.create(nome='Frota', bilhete_identidade='101010101LA101')
+        cls.hoje = timezone.localdate()
+
+    def alugar(self, fim_em_dias, status='ativo'):
+        fim = self.hoje + timedelta(days=fim_em_dias)
+        return Aluguel.objects.create(
+            carro=self.carro, cliente=self.cliente, funcionario=self.funcionario,
+            # Um dia cada, para não se sobreporem no mesmo carro
+            data_inicio=fim, data_fim_prevista=fim, status=status,
+            valor_diario=Decimal('20000.00'), valor_total_previsto=Decimal('20000.00'),
+        )
+
+    def test_marca_so_os_ativos_vencidos_e_regista_historico(self):
+        vencidos = [self.alugar(-dias) for dias in range(1, 6)]
+        hoje = self.alugar(0)
+        finalizado = self.alugar(-2, status='finalizado')
+        versao_antes = versao(ALUGUEIS)
+
+        resultado = atrasos.marcar_atrasados(lote=2)
+        self.assertEqual(resultado['alugueis'], 5)
+        self.assertGreaterEqual(resultado['duracao'], 0)
+        self.assertEqual(
+            set(Aluguel.objects.filter(status='atrasado').values_list('id', flat=True)),
+            {aluguel.pk for aluguel in vencidos},
+        )
+        hoje.refresh_from_db()
+        finalizado.refresh_from_db()
+        self.assertEqual((hoje.status, finalizado.status), ('ativo', 'finalizado'))
+
+        historico = HistoricoStatusCarro.objects.filter(carro=self.carro)
+        self.assertEqual(historico.count(), 5)
+        self.assertEqual(
+            historico.filter(motivo__startswith=f'Aluguel #{vencidos[0].pk} ').values_list('status_anterior', 'status_novo').get(),
+            ('ativo', 'atrasado'),
+        )
+        # update() não dispara sinais: o calendário de disponibilidade foi invalidado à mão
+        self.assertNotEqual(versao(ALUGUEIS), versao_antes)
+
+        self.assertEqual(atrasos.marcar_atrasados()['alugueis'], 0)
+        self.assertEqual(historico.count(), 5)
+
+    def test_comando(self):
+        self.alugar(-1)
+        saida = StringIO()
+        call_command('marcar_atrasados', stdout=saida)
+        self.assertIn('1 aluguéis marcados como atrasados', saida.getvalue())
+
+
+    def test_varredor_so_no_servidor(self):
+        anterior = atrasos._varredor
+        atrasos._varredor = None
+        self.addCleanup(setattr, atrasos, '_varredor', anterior)
+        with override_settings(VARREDURA_ATRASOS_INTERVALO=3600):
+            # Carregar as apps (o que fazem todos os comandos de gestão) não arranca nada
+            apps.get_app_config('alugueis').ready()
+            self.assertIsNone(atrasos._varredor)
+
+            varredor = atrasos.iniciar_no_servidor()
+            self.addCleanup(varredor.join)
+            self.addCleanup(varredor.parar.set)
+            self.assertTrue(varredor.is_alive())
+            self.assertIs(atrasos.iniciar_no_servidor(), varredor)
+
+        with override_settings(VARREDURA_ATRASOS_INTERVALO=0):
+            atrasos._varredor = None
+            self.assertIsNone(atrasos.iniciar_no_servidor())
+
+class LiquidacaoTests(TestCase):
+    """Valor final, saldos e contas a receber dos aluguéis"""
+
+    @classmethod
+    def setUpTestData(cls):
+        modelo = Modelo.objects.create(marca=Marca.objects.create(nome='Nissan'), nome='X-Trail', categoria='suv')
+        cor = Cor.objects.create(nome='Prata')
+        cls.carros = [
+            Carro.objects.create(
+                modelo=modelo, cor=cor, ano_fabricacao=2022, ano_modelo=2022, condicao='usado',
+                combustivel='diesel', transmissao='automatica', chassi=f'L{i:016d}', matricula=f'LD-LQ-{i:02d}',
+                disponivel_aluguel=True,
+            )
+            for i in range(3)
+        ]
+        cls.cliente = Cliente.objects.create(nome='Cliente Liquidação', bilhete_identidade='121212121LA121')
+        cls.funcionario = Funcionario.objects.create(nome='Caixa', bilhete_identidade='131313131LA131')
+        cls.hoje = timezone.localdate()
+
+    def alugar(self, carro, inicio, fim, pagamentos=(), caucao='0.00', km_inicial=None):
+        aluguel = Aluguel.objects.create(
+            carro=self.carros[carro], cliente=self.cliente, funcionario=self.funcionario,
+            data_inicio=self.hoje + timedelta(days=inicio), data_fim_prevista=self.hoje + timedelta(days=fim),
+            valor_diario=Decimal('20000.00'), valor_total_previsto=Decimal(20000 * (fim - inicio)),
+            deposito_caucao=Decimal(caucao), quilometragem_inicial=km_inicial,
+        )
+        PagamentoAluguel.objects.bulk_create([PagamentoAluguel(aluguel=aluguel, valor=Decimal(valor)) for valor in pagamentos])
+        return aluguel
+
+    def test_liquidar_com_atraso_km_e_caucao(self):
+        aluguel = self.alugar(0, -10, -4, pagamentos=['30000.00', '20000.00'], caucao='50000.00', km_inicial=1000)
+        # 8 dias de uso: 2000 km de franquia, 100 km a mais
+        resultado = liquidacao.liquidar(aluguel.pk, self.hoje - timedelta(days=2), quilometragem_final=3100)
+
+        self.assertEqual((resultado['dias_atraso'], resultado['km_excedente']), (2, 100))
+        self.assertEqual(resultado['valor_atraso'], Decimal('60000.00'))
+        self.assertEqual(resultado['valor_km_excedente'], Decimal('15000.00'))
+        self.assertEqual(resultado['valor_final'], Decimal('195000.00'))
+        self.assertEqual(resultado['saldo'], Decimal('95000.00'))
+        aluguel.refresh_from_db()
+        self.assertEqual((aluguel.status, aluguel.valor_total_final), ('finalizado', Decimal('195000.00')))
+
+        with self.assertRaises(ValidationError):
+            liquidacao.liquidar(aluguel.pk)
+
+    def test_contas_a_receber_numa_consulta(self):
+        self.alugar(0, -5, -2, pagamentos=['10000.00'])
+        self.alugar(1, -1, 3, pagamentos=['80000.00'], caucao='30000.00')
+        self.alugar(2, -3, 1, pagamentos=['20000.00', '20000.00'])
+        Aluguel.objects.filter(carro=self.carros[0]).update(status='atrasado')
+
+        with self.assertNumQueries(1):
+            totais = liquidacao.contas_a_receber(maiores=1)
+        self.assertEqual((totais['contratos'], totais['atrasados']), (3, 1))
+        # 60000 previstos + 2 dias de atraso a 30000 - 10000 pagos
+        self.assertEqual(totais['a_receber'], Decimal('110000.00') + Decimal('40000.00'))
+        self.assertEqual(totais['a_devolver'], Decimal('30000.00'))
+        self.assertEqual([linha['carro_id'] for linha in totais['maiores_devedores']], [self.carros[0].pk])
@@ -4,5 +4,6 @@ from . import views
 app_name = 'alugueis'
 
 urlpatterns = [
-    
+    path('exportar/', views.exportar_alugueis, name='exportar'),
+    path('pagamentos/exportar/', views.exportar_pagamentos, name='exportar_pagamentos'),
 ]
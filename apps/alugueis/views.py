@@ -1,3 +1,54 @@
-from django.shortcuts import render
+from django.contrib.admin.views.decorators import staff_member_required
 
-# Create your views here.
+from apps.core.exportacao import Exportacao, filtrar
+from .models import Aluguel, PagamentoAluguel
+
+
+EXPORTACAO_ALUGUEIS = Exportacao('alugueis', (
+    ('id', 'id'),
+    ('status', 'status'),
+    ('carro_id', 'carro_id'),
+    ('matricula', 'carro__matricula'),
+    ('cliente', 'cliente__nome'),
+    ('cliente_bi', 'cliente__bilhete_identidade'),
+    ('funcionario', 'funcionario__nome'),
+    ('data_inicio', 'data_inicio'),
+    ('data_fim_prevista', 'data_fim_prevista'),
+    ('data_fim_real', 'data_fim_real'),
+    ('valor_diario', 'valor_diario'),
+    ('valor_total_previsto', 'valor_total_previsto'),
+    ('valor_total_final', 'valor_total_final'),
+    ('deposito_caucao', 'deposito_caucao'),
+    ('quilometragem_inicial', 'quilometragem_inicial'),
+    ('quilometragem_final', 'quilometragem_final'),
+))
+
+EXPORTACAO_PAGAMENTOS = Exportacao('pagamentos_alugueis', (
+    ('id', 'id'),
+    ('data', 'data_pagamento'),
+    ('aluguel_id', 'aluguel_id'),
+    ('cliente', 'aluguel__cliente__nome'),
+    ('funcionario', 'aluguel__funcionario__nome'),
+    ('valor', 'valor'),
+    ('tipo_pagamento', 'tipo_pagamento'),
+    ('forma_pagamento', 'forma_pagamento'),
+))
+
+
+@staff_member_required
+def exportar_alugueis(request):
+    """Aluguéis pela data de início; filtros ?de=, ?ate=, ?status=, ?funcionario=; ?formato=csv|jsonl"""
+    alugueis = filtrar(
+        Aluguel.objects.all(), request.GET, 'data_inicio', status='status', funcionario='funcionario_id',
+    )
+    return EXPORTACAO_ALUGUEIS.resposta(alugueis, request.GET.get('formato', 'csv'))
+
+
+@staff_member_required
+def exportar_pagamentos(request):
+    """Pagamentos de aluguéis; filtros ?de=, ?ate=, ?aluguel=, ?funcionario=; ?formato=csv|jsonl"""
+    pagamentos = filtrar(
+        PagamentoAluguel.objects.all(), request.GET, 'data_pagamento',
+        aluguel='aluguel_id', funcionario='aluguel__funcionario_id',
+    )
+    return EXPORTACAO_PAGAMENTOS.resposta(pagamentos, request.GET.get('formato', 'csv'))
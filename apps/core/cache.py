@@ -0,0 +1,142 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages.storage.session import SessionStorage
+from django.core.cache import cache
+
+
+# Namespaces de versão: cada um invalida de uma vez todas as chaves que o usam
+ESTOQUE = 'estoque'
+PAGINAS = 'paginas'
+REFERENCIAS = 'referencias'
+ALUGUEIS = 'alugueis'
+
+# Contadores do cache de páginas expostos em core:estatisticas_cache
+CONTADORES_PAGINA = ('hit', 'miss', 'ignorado')
+
+
+def _chave_versao(namespace):
+    return f'versao:{namespace}'
+
+
+def versao(namespace):
+    """Versão atual de um namespace de cache.
+
+    A versão inicial deriva do relógio, para que uma chave de versão expulsa do
+    cache nunca volte a um número já usado por entradas antigas.
+    """
+    chave = _chave_versao(namespace)
+    atual = cache.get(chave)
+    if atual is None:
+        cache.add(chave, time.time_ns() // 1000, None)
+        atual = cache.get(chave)
+    return atual
+
+
+def invalidar(namespace):
+    """Incrementa a versão do namespace, tornando obsoletas as chaves derivadas dela"""
+    chave = _chave_versao(namespace)
+    try:
+        return cache.incr(chave)
+    except ValueError:
+        # Chave ausente (expirada ou nunca criada): recomeça numa versão nova
+        return versao(namespace)
+
+
+def chave_versionada(namespace, *partes):
+    """Monta uma chave de cache ligada à versão atual do namespace"""
+    return ':'.join([namespace, str(versao(namespace))] + [str(parte) for parte in partes])
+
+
+def registrar(contador):
+    """Incrementa um contador partilhado do cache de páginas"""
+    chave = f'estatisticas:pagina:{contador}'
+    if not cache.add(chave, 1, None):
+        try:
+            cache.incr(chave)
+        except ValueError:
+            cache.set(chave, 1, None)
+
+
+def estatisticas_cache():
+    """Contadores de hit/miss do cache de páginas e versões atuais dos namespaces"""
+    contadores = {
+        contador: cache.get(f'estatisticas:pagina:{contador}', 0)
+        for contador in CONTADORES_PAGINA
+    }
+    consultas = contadores['hit'] + contadores['miss']
+    return {
+        **contadores,
+        'taxa_acerto': round(contadores['hit'] / consultas, 4) if consultas else None,
+        'versoes': {namespace: versao(namespace) for namespace in (ESTOQUE, PAGINAS, REFERENCIAS, ALUGUEIS)},
+    }
+
+
+def chave_pagina(request, namespaces):
+    """Chave da página: caminho + parâmetros GET normalizados (ordenados, sem valores vazios)"""
+    parametros = sorted(
+        (nome, valor)
+        for nome, valores in request.GET.lists()
+        for valor in valores
+        if valor != ''
+    )
+    assinatura = hashlib.md5(
+        repr((request.path, parametros)).encode(), usedforsecurity=False
+    ).hexdigest()
+    versoes = '.'.join(str(versao(namespace)) for namespace in (PAGINAS, *namespaces))
+    return f'pagina:{versoes}:{assinatura}'
+
+
+def _pode_usar_cache(request):
+    """Só visitantes anónimos, em GET/HEAD e sem mensagens pendentes para exibir"""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    return not request.session.get(SessionStorage.session_key)
+
+
+def _pode_guardar(request, response):
+    """Respostas que definem cookies ou usam o token CSRF são específicas do visitante"""
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    )
+
+
+def cache_pagina_anonima(namespaces=(ESTOQUE,), timeout=None):
+    """Cache de página inteira para visitantes anónimos.
+
+    Utilizadores autenticados (e o staff, que vê dados internos) recebem
+    sempre a página renderizada na hora. A chave inclui as versões dos
+    namespaces indicados, por isso uma alteração no estoque invalida todas
+    as páginas do catálogo de uma vez.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _view(request, *args, **kwargs):
+            if not _pode_usar_cache(request):
+                registrar('ignorado')
+                return view_func(request, *args, **kwargs)
+
+            chave = chave_pagina(request, namespaces)
+            response = cache.get(chave)
+            if response is not None:
+                registrar('hit')
+                response['X-Cache'] = 'HIT'
+                return response
+
+            registrar('miss')
+            response = view_func(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()
+            if _pode_guardar(request, response):
+                cache.set(chave, response, timeout or settings.PAGINA_CACHE_TIMEOUT)
+            response['X-Cache'] = 'MISS'
+            return response
+        return _view
+    return decorator
@@ -0,0 +1,369 @@
+import math
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from apps.alugueis.models import Aluguel, PagamentoAluguel
+from apps.usuarios.models import Cliente, Funcionario
+from apps.vendas import relatorios
+from apps.vendas.models import Venda
+from apps.veiculos import busca, semelhantes
+from apps.veiculos.fotos import atualizar_foto_capa
+from apps.veiculos.models import Marca, Modelo, Cor, Opcional, Carro, FotoCarro, MovimentacaoEstoque
+from .cache import ESTOQUE, invalidar
+
+
+# Marcas comuns no mercado angolano, da mais para a menos popular, com os seus modelos
+MARCAS = (
+    ('Toyota', 'Japão', [('Hilux', 'pickup'), ('Corolla', 'sedan'), ('RAV4', 'suv'), ('Land Cruiser', 'suv'), ('Yaris', 'hatch'), ('Fortuner', 'suv')]),
+    ('Hyundai', 'Coreia do Sul', [('Tucson', 'suv'), ('Elantra', 'sedan'), ('i10', 'hatch'), ('Santa Fe', 'suv'), ('Accent', 'sedan')]),
+    ('Kia', 'Coreia do Sul', [('Sportage', 'suv'), ('Picanto', 'hatch'), ('Rio', 'hatch'), ('Sorento', 'suv')]),
+    ('Nissan', 'Japão', [('Navara', 'pickup'), ('X-Trail', 'suv'), ('Sunny', 'sedan'), ('Patrol', 'suv')]),
+    ('Mitsubishi', 'Japão', [('L200', 'pickup'), ('Pajero', 'suv'), ('ASX', 'suv')]),
+    ('Suzuki', 'Japão', [('Swift', 'hatch'), ('Vitara', 'suv'), ('Jimny', 'suv'), ('Ertiga', 'minivan')]),
+    ('Volkswagen', 'Alemanha', [('Polo', 'hatch'), ('Golf', 'hatch'), ('Tiguan', 'suv'), ('Amarok', 'pickup')]),
+    ('Ford', 'Estados Unidos', [('Ranger', 'pickup'), ('EcoSport', 'suv'), ('Everest', 'suv')]),
+    ('Mercedes-Benz', 'Alemanha', [('Classe C', 'sedan'), ('GLE', 'suv'), ('Classe E', 'sedan'), ('Sprinter', 'minivan')]),
+    ('BMW', 'Alemanha', [('Série 3', 'sedan'), ('X5', 'suv'), ('X3', 'suv')]),
+    ('Chevrolet', 'Estados Unidos', [('Spark', 'hatch'), ('Captiva', 'suv'), ('S10', 'pickup')]),
+    ('Renault', 'França', [('Duster', 'suv'), ('Sandero', 'hatch'), ('Logan', 'sedan')]),
+    ('Peugeot', 'França', [('208', 'hatch'), ('3008', 'suv'), ('508', 'sedan')]),
+    ('Jeep', 'Estados Unidos', [('Wrangler', 'suv'), ('Compass', 'suv')]),
+    ('Porsche', 'Alemanha', [('Cayenne', 'suv'), ('911', 'coupe')]),
+)
+
+CORES = (
+    ('Branco', '#FFFFFF'), ('Preto', '#000000'), ('Prata', '#C0C0C0'), ('Cinza', '#808080'),
+    ('Azul', '#1F4E9E'), ('Vermelho', '#B22222'), ('Castanho', '#7B4B2A'), ('Verde', '#2E7D32'),
+    ('Bege', '#D8C8A8'), ('Laranja', '#E67E22'),
+)
+PESOS_CORES = (30, 22, 16, 10, 7, 5, 4, 3, 2, 1)
+
+OPCIONAIS = (
+    ('Ar condicionado', 'Conforto'), ('Vidros elétricos', 'Conforto'), ('Bancos em couro', 'Conforto'),
+    ('Teto solar', 'Conforto'), ('Airbags frontais', 'Segurança'), ('Airbags laterais', 'Segurança'),
+    ('ABS', 'Segurança'), ('Câmara de marcha-atrás', 'Segurança'), ('Sensores de estacionamento', 'Segurança'),
+    ('GPS', 'Tecnologia'), ('Bluetooth', 'Tecnologia'), ('Apple CarPlay / Android Auto', 'Tecnologia'),
+    ('Cruise control', 'Tecnologia'), ('Tração 4x4', 'Desempenho'), ('Jantes de liga leve', 'Estética'),
+)
+
+COMBUSTIVEIS = (('gasolina', 55), ('diesel', 35), ('hibrido', 5), ('flex', 2), ('etanol', 1), ('eletrico', 2))
+TRANSMISSOES = (('manual', 55), ('automatico', 35), ('cvt', 6), ('automatizado', 4))
+MOTORES = ('1.0', '1.2', '1.4', '1.6', '2.0', '2.4', '2.8', '3.0', '4.0')
+NOMES = ('Ana', 'João', 'Maria', 'Pedro', 'Isabel', 'António', 'Luísa', 'Manuel', 'Teresa', 'Carlos', 'Rosa', 'Domingos')
+APELIDOS = ('Silva', 'Santos', 'Fernandes', 'Neto', 'Costa', 'Lopes', 'Cardoso', 'Mendes', 'Tavares', 'Sebastião')
+FORMAS_PAGAMENTO = ('Transferência', 'Multicaixa', 'Dinheiro', 'Cheque')
+
+# Preço base (Kz) por categoria, para um carro novo
+PRECO_CATEGORIA = {
+    'hatch': 9_000_000, 'sedan': 14_000_000, 'suv': 24_000_000, 'pickup': 22_000_000,
+    'coupe': 45_000_000, 'conversivel': 40_000_000, 'minivan': 18_000_000, 'outro': 12_000_000,
+}
+MARCAS_PREMIUM = {'Mercedes-Benz', 'BMW', 'Porsche'}
+
+DIAS_HISTORICO = 3 * 365
+
+
+def _inicio_do_dia(data):
+    return timezone.make_aware(datetime.combine(data, time.min))
+
+
+# Campos auto_now_add que recebem datas do passado nos dados gerados
+CAMPOS_DATA = (
+    (Carro, 'data_entrada'),
+    (Venda, 'data_venda'),
+    (Aluguel, 'data_criacao'),
+    (PagamentoAluguel, 'data_pagamento'),
+    (MovimentacaoEstoque, 'data_movimentacao'),
+)
+
+
+@contextmanager
+def datas_historicas():
+    """Desliga o auto_now_add durante a geração, para o bulk_create gravar as datas sorteadas.
+
+    Evita um bulk_update por tabela (UPDATE ... CASE com milhares de ramos),
+    que custava mais que a própria inserção. Em troca, altera os campos do
+    modelo para todo o processo, não só para a thread atual: qualquer outro
+    pedido que grave um Carro, Venda, etc. ao mesmo tempo ficaria sem data.
+    Por isso só os comandos de gestão (gerar_dados, benchmark_comissoes) o
+    usam, num processo próprio; nunca numa view nem no GeradorDados em si.
+    """
+    campos = [modelo._meta.get_field(nome) for modelo, nome in CAMPOS_DATA]
+    for campo in campos:
+        campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        for campo in campos:
+            campo.auto_now_add = True
+
+
+class GeradorDados:
+    """Gera um estoque sintético (carros, fotos, vendas, aluguéis) para testes de carga.
+
+    Os dados saem sempre iguais para a mesma semente. Cada lote de carros é
+    criado, com todos os registos dependentes, numa transação própria com
+    bulk_create; só o lote atual fica em memória, pelo que o consumo não
+    cresce com a escala. Os identificadores únicos (chassi, matrícula, BI)
+    levam o prefixo da semente, permitindo várias gerações no mesmo banco.
+
+    As datas sorteadas só são gravadas dentro de datas_historicas(), que o
+    comando gerar_dados abre à volta de gerar(); fora dele ficam as do dia.
+    """
+
+    def __init__(self, semente=42, lote=1000, saida=None):
+        self.semente = semente
+        self.lote = lote
+        self.prefixo = f'SN{semente:03d}'
+        self.rng = random.Random(semente)
+        self.saida = saida or (lambda mensagem: None)
+        self.agora = timezone.now()
+
+    def ja_gerado(self):
+        return Carro.objects.filter(chassi__startswith=self.prefixo).exists()
+
+    # Dados de referência (poucos registos, reaproveitados se já existirem)
+
+    def criar_referencias(self):
+        self.modelos = []
+        for posicao, (nome_marca, pais, modelos) in enumerate(MARCAS):
+            marca, _ = Marca.objects.get_or_create(nome=nome_marca, defaults={'pais_origem': pais})
+            # Popularidade tipo Zipf: a primeira marca vende muito mais que a última
+            peso_marca = 1 / (posicao + 1)
+            for indice, (nome_modelo, categoria) in enumerate(modelos):
+                modelo, _ = Modelo.objects.get_or_create(
+                    marca=marca, nome=nome_modelo, defaults={'categoria': categoria}
+                )
+                self.modelos.append((modelo, peso_marca / (indice + 1), nome_marca))
+
+        self.cores = [Cor.objects.get_or_create(nome=nome, defaults={'codigo_hex': hexa})[0] for nome, hexa in CORES]
+        self.opcionais = [
+            Opcional.objects.get_or_create(nome=nome, defaults={'categoria': categoria})[0]
+            for nome, categoria in OPCIONAIS
+        ]
+        self.pesos_modelos = [peso for _, peso, _ in self.modelos]
+
+    def criar_pessoas(self, total_clientes, total_funcionarios):
+        funcionarios = Funcionario.objects.bulk_create([
+            Funcionario(
+                nome=self._nome(), bilhete_identidade=f'{self.prefixo}F{i:010d}',
+                cargo=self.rng.choice(('Vendedor', 'Vendedor', 'Gestor de Frota', 'Atendimento')),
+                comissao_venda=Decimal(self.rng.choice((1, 1.5, 2, 2.5, 3))),
+            )
+            for i in range(total_funcionarios)
+        ])
+        self.funcionario_ids = [f.pk for f in funcionarios]
+
+        self.cliente_ids = []
+        for inicio in range(0, total_clientes, self.lote):
+            with transaction.atomic():
+                clientes = Cliente.objects.bulk_create([
+                    Cliente(
+                        nome=self._nome(), bilhete_identidade=f'{self.prefixo}C{i:010d}',
+                        tipo_pessoa='juridica' if self.rng.random() < 0.08 else 'fisica',
+                        telefone=f'9{self.rng.randint(10000000, 99999999)}',
+                    )
+                    for i in range(inicio, min(inicio + self.lote, total_clientes))
+                ])
+            self.cliente_ids.extend(c.pk for c in clientes)
+
+    # Carros e registos dependentes
+
+    def gerar(self, total_carros, total_clientes=None, total_funcionarios=20):
+        self.criar_referencias()
+        self.criar_pessoas(total_clientes or max(total_carros // 4, 1), total_funcionarios)
+
+        for inicio in range(0, total_carros, self.lote):
+            fim = min(inicio + self.lote, total_carros)
+            with transaction.atomic():
+                self._gerar_lote(inicio, fim)
+            self.saida(f'{fim}/{total_carros} carros')
+
+        # Os novos carros entram nas listas de semelhantes de todo o estoque
+        semelhantes.recalcular_todos()
+        # bulk_create não dispara os sinais dos relatórios materializados
+        relatorios.reconstruir()
+        invalidar(ESTOQUE)
+
+    def _gerar_lote(self, inicio, fim):
+        carros, vendas, alugueis, pagamentos = [], [], [], []
+        fotos, opcionais, movimentacoes = [], [], []
+        for i in range(inicio, fim):
+            # Um gerador por carro: o resultado não depende do tamanho do lote
+            self.rng = random.Random(f'{self.semente}:{i}')
+            carro = self._novo_carro(i)
+            carros.append(carro)
+            movimentacoes.append(self._movimentacao(carro, 'entrada', carro.data_entrada))
+
+            for ordem in range(1, self.rng.choice((1, 2, 3, 3, 4, 5, 6)) + 1):
+                fotos.append(FotoCarro(
+                    carro=carro, ordem=ordem, foto_principal=ordem == 1,
+                    foto=f'carros/fotos/sinteticas/{self.prefixo}-{i}-{ordem}.jpg',
+                ))
+            for opcional in self.rng.sample(self.opcionais, self.rng.randint(2, 9)):
+                opcionais.append(Carro.opcionais.through(carro=carro, opcional=opcional))
+
+            # A venda decide a disponibilidade do carro, por isso é sorteada antes dos aluguéis
+            venda = self._venda(carro)
+            if venda is not None:
+                vendas.append(venda)
+                if venda.status == 'finalizada':
+                    movimentacoes.append(self._movimentacao(carro, 'saida_venda', venda.data_venda, venda=venda))
+
+            for aluguel in self._alugueis(carro):
+                alugueis.append(aluguel)
+                pagamentos.extend(self._pagamentos(aluguel))
+                movimentacoes.append(self._movimentacao(
+                    carro, 'saida_aluguel', _inicio_do_dia(aluguel.data_inicio), aluguel=aluguel
+                ))
+                if aluguel.data_fim_real:
+                    movimentacoes.append(self._movimentacao(
+                        carro, 'retorno_aluguel', _inicio_do_dia(aluguel.data_fim_real), aluguel=aluguel
+                    ))
+
+        # Ordem das inserções segue as chaves estrangeiras; o bulk_create preenche os ids
+        Carro.objects.bulk_create(carros)
+        FotoCarro.objects.bulk_create(fotos)
+        Carro.opcionais.through.objects.bulk_create(opcionais)
+        Venda.objects.bulk_create(vendas)
+        Aluguel.objects.bulk_create(alugueis)
+        PagamentoAluguel.objects.bulk_create(pagamentos)
+        MovimentacaoEstoque.objects.bulk_create(movimentacoes)
+
+        # Sinais não correm no bulk_create: capa e índice de busca do lote de uma vez
+        ids = [carro.pk for carro in carros]
+        atualizar_foto_capa(ids)
+        busca.indexar_carros(ids)
+
+    def _novo_carro(self, i):
+        rng = self.rng
+        modelo, _, nome_marca = rng.choices(self.modelos, weights=self.pesos_modelos)[0]
+        ano_atual = self.agora.year
+        # Frota angolana envelhecida: idade média perto de 6 anos
+        idade = min(int(rng.expovariate(1 / 6)), 25)
+        ano_modelo = ano_atual - idade + (1 if idade == 0 and rng.random() < 0.3 else 0)
+        novo = idade == 0 and rng.random() < 0.7
+
+        quilometragem = 0 if novo else int(max(idade, 0.5) * rng.gauss(18000, 6000))
+        preco = PRECO_CATEGORIA[modelo.categoria] * (2.2 if nome_marca in MARCAS_PREMIUM else 1)
+        preco *= 0.85 ** idade * math.exp(rng.gauss(0, 0.18))
+        preco = Decimal(max(round(preco, -4), 500_000))
+
+        alugavel = rng.random() < 0.2
+        carro = Carro(
+            modelo=modelo,
+            cor=rng.choices(self.cores, weights=PESOS_CORES)[0],
+            ano_fabricacao=ano_modelo if rng.random() < 0.7 else ano_modelo - 1,
+            ano_modelo=ano_modelo,
+            condicao='novo' if novo else 'usado',
+            preco_venda=preco,
+            preco_aluguel_diario=Decimal(int(round(preco / 400, -3))) if alugavel else None,
+            quilometragem=max(quilometragem, 0),
+            combustivel=self._escolha_ponderada(COMBUSTIVEIS),
+            transmissao=self._escolha_ponderada(TRANSMISSOES),
+            motor=rng.choice(MOTORES),
+            numero_portas=2 if modelo.categoria in ('coupe', 'conversivel') else rng.choice((4, 4, 5)),
+            chassi=f'{self.prefixo}{i:012d}',
+            matricula=f'{self.prefixo}-{i:08d}',
+            descricao=f'{modelo.nome} {ano_modelo} em {"estado de novo" if novo else "bom estado"}, '
+                      f'{"revisões na marca" if rng.random() < 0.5 else "documentação em dia"}.',
+            disponivel_venda=True,
+            disponivel_aluguel=alugavel,
+            data_entrada=self.agora - timedelta(days=rng.random() * DIAS_HISTORICO),
+        )
+        return carro
+
+    def _venda(self, carro):
+        """Cerca de 30% dos carros já foram vendidos, alguns com venda pendente ou cancelada"""
+        sorteio = self.rng.random()
+        if sorteio >= 0.30:
+            return None
+        status = 'finalizada' if sorteio < 0.24 else ('pendente' if sorteio < 0.28 else 'cancelada')
+        if status == 'finalizada':
+            carro.disponivel_venda = False
+            carro.disponivel_aluguel = False
+        dias_em_stock = self.rng.expovariate(1 / 60)
+        data_venda = min(carro.data_entrada + timedelta(days=dias_em_stock), self.agora)
+        valor = (carro.preco_venda * Decimal(self.rng.uniform(0.92, 1.0))).quantize(Decimal('1'))
+        tipo = self.rng.choices(('a_vista', 'financiado', 'misto'), weights=(60, 25, 15))[0]
+        entrada = valor if tipo == 'a_vista' else (valor * Decimal('0.3')).quantize(Decimal('1'))
+        venda = Venda(
+            carro=carro, cliente_id=self.rng.choice(self.cliente_ids),
+            funcionario_id=self.rng.choice(self.funcionario_ids),
+            valor_venda=valor, valor_entrada=entrada, valor_financiado=valor - entrada,
+            tipo_pagamento=tipo, forma_pagamento=self.rng.choice(FORMAS_PAGAMENTO),
+            numero_parcelas=self.rng.choice((12, 24, 36, 48)) if tipo != 'a_vista' else None,
+            status=status,
+        )
+        venda.data_venda = data_venda
+        return venda
+
+    def _alugueis(self, carro):
+        if not carro.disponivel_aluguel:
+            return []
+        alugueis = []
+        inicio = (carro.data_entrada + timedelta(days=self.rng.randint(1, 20))).date()
+        hoje = self.agora.date()
+        while inicio < hoje and len(alugueis) < 12:
+            dias = self.rng.choice((1, 2, 3, 5, 7, 7, 14, 30))
+            fim_previsto = inicio + timedelta(days=dias)
+            atraso = self.rng.choice((0, 0, 0, 0, 1, 2))
+            if fim_previsto + timedelta(days=atraso) >= hoje:
+                status, fim_real, total = ('atrasado' if fim_previsto < hoje else 'ativo'), None, None
+            else:
+                status = 'cancelado' if self.rng.random() < 0.05 else 'finalizado'
+                fim_real = fim_previsto + timedelta(days=atraso)
+                total = carro.preco_aluguel_diario * (dias + atraso)
+            aluguel = Aluguel(
+                carro=carro, cliente_id=self.rng.choice(self.cliente_ids),
+                funcionario_id=self.rng.choice(self.funcionario_ids),
+                data_inicio=inicio, data_fim_prevista=fim_previsto, data_fim_real=fim_real,
+                valor_diario=carro.preco_aluguel_diario,
+                valor_total_previsto=carro.preco_aluguel_diario * dias,
+                valor_total_final=total,
+                quilometragem_inicial=carro.quilometragem,
+                deposito_caucao=carro.preco_aluguel_diario * 2,
+                status=status,
+            )
+            aluguel.data_criacao = _inicio_do_dia(inicio) - timedelta(hours=self.rng.randint(1, 72))
+            alugueis.append(aluguel)
+            if status in ('ativo', 'atrasado'):
+                break
+            inicio = fim_real + timedelta(days=int(self.rng.expovariate(1 / 10)) + 1)
+        return alugueis
+
+    def _pagamentos(self, aluguel):
+        if aluguel.status == 'cancelado':
+            return []
+        total = aluguel.valor_total_final or aluguel.valor_total_previsto
+        partes = 1 if self.rng.random() < 0.7 else 2
+        pagamentos = []
+        for parte in range(partes):
+            pagamento = PagamentoAluguel(
+                aluguel=aluguel, valor=(total / partes).quantize(Decimal('0.01')),
+                tipo_pagamento='Total' if partes == 1 else 'Parcial',
+                forma_pagamento=self.rng.choice(FORMAS_PAGAMENTO),
+            )
+            pagamento.data_pagamento = aluguel.data_criacao + timedelta(days=parte * 3)
+            pagamentos.append(pagamento)
+        return pagamentos
+
+    def _movimentacao(self, carro, tipo, data, **relacionados):
+        movimentacao = MovimentacaoEstoque(
+            carro=carro, tipo_movimentacao=tipo,
+            funcionario_id=self.rng.choice(self.funcionario_ids), **relacionados
+        )
+        movimentacao.data_movimentacao = data
+        return movimentacao
+
+    def _escolha_ponderada(self, opcoes):
+        valores, pesos = zip(*opcoes)
+        return self.rng.choices(valores, weights=pesos)[0]
+
+    def _nome(self):
+        return f'{self.rng.choice(NOMES)} {self.rng.choice(APELIDOS)} {self.rng.choice(APELIDOS)}'
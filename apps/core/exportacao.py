@@ -0,0 +1,164 @@
+import csv
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+
+from apps.vendas.periodos import intervalo
+
+
+# Exportações em CSV e JSON Lines para a contabilidade, sem limite de linhas.
+#
+# As linhas saem do banco com values_list().iterator(): só os valores das
+# colunas pedidas, lidos do cursor em blocos de LOTE (cursor no servidor em
+# PostgreSQL; no SQLite o próprio cursor avança por passos). Cada bloco é
+# formatado num único texto e enviado pela StreamingHttpResponse, por isso a
+# memória usada não depende do número de linhas exportadas.
+
+LOTE = 2000
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# Maior inteiro que o banco aceita num id (BigAutoField: 64 bits com sinal);
+# um filtro acima disto rebentaria só a meio do streaming, já com o 200 enviado
+ID_MAXIMO = 2 ** 63 - 1
+
+# Um texto começado por estes caracteres seria lido como fórmula pelo Excel
+# (lista da OWASP para injeção em CSV, incluindo tabulação e retorno de carro)
+INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+class _Eco:
+    """Destino do csv.writer que devolve a linha formatada em vez de a gravar"""
+
+    def write(self, valor):
+        return valor
+
+
+def _data_hora(valor):
+    return timezone.localtime(valor) if timezone.is_aware(valor) else valor
+
+
+def _valor_csv(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, bool):
+        return 'sim' if valor else 'não'
+    if isinstance(valor, datetime):
+        return _data_hora(valor).strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(valor, str) and valor.startswith(INICIO_FORMULA):
+        return "'" + valor
+    return valor
+
+
+def _valor_json(valor):
+    # Decimais como texto: o valor exato, sem passar por float
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, datetime):
+        return _data_hora(valor).isoformat()
+    if isinstance(valor, date):
+        return valor.isoformat()
+    return valor
+
+
+def filtrar(queryset, parametros, campo_data, **campos):
+    """Filtros comuns das exportações.
+
+    ?de= e ?ate= (AAAA-MM-DD, inclusivos) limitam `campo_data`; cada
+    parâmetro em `campos` filtra pelo caminho indicado, por exemplo
+    filtrar(vendas, request.GET, 'data_venda', status='status').
+    Valores inválidos (incluindo ids fora do alcance de um inteiro do
+    banco) são ignorados, como nos filtros da listagem.
+    """
+    inicio, fim = _dia(parametros.get('de')), _dia(parametros.get('ate'))
+    if isinstance(queryset.model._meta.get_field(campo_data), models.DateTimeField):
+        queryset = queryset.filter(**intervalo(campo_data, inicio, fim))
+    else:
+        if inicio is not None:
+            queryset = queryset.filter(**{f'{campo_data}__gte': inicio})
+        if fim is not None:
+            queryset = queryset.filter(**{f'{campo_data}__lte': fim})
+
+    for parametro, caminho in campos.items():
+        valor = parametros.get(parametro, '')
+        if valor:
+            campo = _campo_final(queryset.model, caminho)
+            try:
+                valor = campo.to_python(valor)
+            except ValidationError:
+                continue
+            if isinstance(campo, models.IntegerField) and abs(valor) > ID_MAXIMO:
+                continue
+            queryset = queryset.filter(**{caminho: valor})
+    return queryset
+
+
+def _dia(valor):
+    try:
+        return date.fromisoformat(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _campo_final(modelo, caminho):
+    campo = None
+    for nome in caminho.split('__'):
+        campo = modelo._meta.get_field(nome)
+        modelo = campo.related_model or modelo
+    return campo.target_field if campo.is_relation else campo
+
+
+class Exportacao:
+    """Colunas exportadas de um modelo: (nome da coluna, caminho no ORM)"""
+
+    def __init__(self, nome, colunas):
+        self.nome = nome
+        self.nomes = [nome_coluna for nome_coluna, _ in colunas]
+        self.caminhos = [caminho for _, caminho in colunas]
+
+    def linhas(self, queryset):
+        return queryset.order_by('pk').values_list(*self.caminhos).iterator(chunk_size=LOTE)
+
+    def _blocos(self, queryset):
+        linhas = self.linhas(queryset)
+        while True:
+            bloco = list(islice(linhas, LOTE))
+            if not bloco:
+                return
+            yield bloco
+
+    def csv(self, queryset):
+        escritor = csv.writer(_Eco(), delimiter=';')
+        # BOM para o Excel reconhecer o UTF-8
+        yield '\ufeff' + escritor.writerow(self.nomes)
+        for bloco in self._blocos(queryset):
+            yield ''.join(escritor.writerow([_valor_csv(valor) for valor in linha]) for linha in bloco)
+
+    def jsonl(self, queryset):
+        for bloco in self._blocos(queryset):
+            yield ''.join(
+                json.dumps(
+                    {nome: _valor_json(valor) for nome, valor in zip(self.nomes, linha)},
+                    ensure_ascii=False,
+                ) + '\n'
+                for linha in bloco
+            )
+
+    def resposta(self, queryset, formato):
+        """StreamingHttpResponse com o ficheiro; 400 para um formato desconhecido"""
+        if formato not in FORMATOS:
+            return HttpResponseBadRequest(f'Formato inválido: use {" ou ".join(FORMATOS)}.')
+        response = StreamingHttpResponse(getattr(self, formato)(queryset), content_type=FORMATOS[formato])
+        response['Content-Disposition'] = (
+            f'attachment; filename="{self.nome}-{timezone.localdate():%Y%m%d}.{formato}"'
+        )
+        return response
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.core.dados_sinteticos import GeradorDados, datas_historicas
+
+
+class Command(BaseCommand):
+    help = 'Gera dados sintéticos (carros, fotos, vendas, aluguéis) para testes de carga e escala'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carros', type=int, default=10000, help='Número de carros a gerar')
+        parser.add_argument('--clientes', type=int, help='Número de clientes (padrão: um por cada 4 carros)')
+        parser.add_argument('--funcionarios', type=int, default=20, help='Número de funcionários')
+        parser.add_argument('--semente', type=int, default=42, help='Semente do gerador (mesma semente, mesmos dados)')
+        parser.add_argument('--lote', type=int, default=1000, help='Carros por transação/bulk_create')
+
+    def handle(self, *args, **options):
+        if options['carros'] < 1 or options['lote'] < 1:
+            raise CommandError('--carros e --lote têm de ser positivos.')
+        if not 0 <= options['semente'] <= 999:
+            raise CommandError('--semente tem de estar entre 0 e 999 (faz parte do chassi gerado).')
+
+        gerador = GeradorDados(
+            semente=options['semente'], lote=options['lote'], saida=self.stdout.write
+        )
+        if gerador.ja_gerado():
+            raise CommandError(
+                f'Já existem dados gerados com a semente {options["semente"]}; use outra semente.'
+            )
+
+        inicio = time.perf_counter()
+        # Datas do passado nos registos gerados; ver o custo em datas_historicas()
+        with datas_historicas():
+            gerador.gerar(options['carros'], options['clientes'], options['funcionarios'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{options["carros"]} carros gerados em {time.perf_counter() - inicio:.1f}s.'
+        ))
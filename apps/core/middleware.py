@@ -0,0 +1,52 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import perfilamento
+
+
+logger = logging.getLogger(__name__)
+
+
+class PerfilamentoMiddleware:
+    """Mede tempo total, SQL (com consultas repetidas), templates e cache de cada pedido.
+
+    Ativado com PERFILAMENTO = True. Desligado, o Django remove-o da cadeia
+    no arranque (MiddlewareNotUsed) e não há custo nenhum por pedido. Os
+    resultados vão no cabeçalho Server-Timing e no agregado em
+    core:perfilamento (staff).
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PERFILAMENTO', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.ignorados = tuple(filter(None, (settings.STATIC_URL, settings.MEDIA_URL)))
+        perfilamento.instrumentar()
+
+    def __call__(self, request):
+        if request.path.startswith(self.ignorados):
+            return self.get_response(request)
+
+        medicao = perfilamento.iniciar()
+        try:
+            with ExitStack() as pilha:
+                for conexao in connections.all():
+                    pilha.enter_context(conexao.execute_wrapper(perfilamento.executar_sql))
+                response = self.get_response(request)
+        finally:
+            perfilamento.terminar()
+        duracao = time.perf_counter() - medicao.inicio
+
+        response['Server-Timing'] = perfilamento.server_timing(medicao, duracao)
+        match = request.resolver_match
+        rota = match.view_name if match else request.path
+        perfilamento.agregador.adicionar(rota, medicao, duracao, response.status_code)
+
+        for sql, total in medicao.suspeitas_n_mais_1.items():
+            logger.warning('Possível N+1 em %s: consulta executada %s vezes: %s', request.path, total, sql)
+        return response
@@ -0,0 +1,156 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class CursorInvalido(Exception):
+    pass
+
+
+def _codificar(valores):
+    texto = json.dumps(valores, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+def _decodificar(cursor):
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        return json.loads(texto)
+    except (ValueError, UnicodeDecodeError):
+        raise CursorInvalido(cursor)
+
+
+class PaginaCursor:
+    """Página obtida por keyset: WHERE (campo, id) depois do último item visto, sem OFFSET nem COUNT.
+
+    A ordenação é sempre (campo, id) na mesma direção, o que torna a posição de
+    cada carro única e estável mesmo com inserções concorrentes. Em SQLite os
+    NULL ordenam como os menores valores, e as condições abaixo seguem essa regra.
+    """
+
+    def __init__(self, queryset, campo, tamanho, cursor=None):
+        self.descendente = campo.startswith('-')
+        self.campo = campo.lstrip('-')
+        self.tamanho = tamanho
+        self.field = queryset.model._meta.get_field(self.campo)
+
+        direcao, valor, pk = self._ler_cursor(cursor)
+        self.recuando = direcao == 'a'
+
+        # Para voltar, percorre a ordem inversa e depois reverte a página
+        descendente = self.descendente != self.recuando
+        ordem = [f'-{self.campo}', '-pk'] if descendente else [self.campo, 'pk']
+        queryset = queryset.order_by(*ordem)
+        if pk is not None:
+            queryset = queryset.filter(self._depois(valor, pk, descendente))
+
+        itens = list(queryset[:tamanho + 1])
+        ha_mais = len(itens) > tamanho
+        itens = itens[:tamanho]
+        if self.recuando:
+            itens.reverse()
+
+        self.object_list = itens
+        if self.recuando:
+            self.tem_anterior, self.tem_proxima = ha_mais, True
+        else:
+            self.tem_anterior, self.tem_proxima = pk is not None, ha_mais
+
+    def _ler_cursor(self, cursor):
+        if not cursor:
+            return 'p', None, None
+        try:
+            direcao, valor, pk = _decodificar(cursor)
+            if direcao not in ('p', 'a'):
+                raise CursorInvalido(cursor)
+            valor = None if valor is None else self.field.to_python(valor)
+            return direcao, valor, int(pk)
+        except (TypeError, ValueError, ValidationError):
+            raise CursorInvalido(cursor)
+
+    def _depois(self, valor, pk, descendente):
+        """Itens estritamente depois de (valor, pk) na ordem (campo, pk) indicada"""
+        campo = self.campo
+        if not descendente:
+            if valor is None:
+                return Q(**{f'{campo}__isnull': True, 'pk__gt': pk}) | Q(**{f'{campo}__isnull': False})
+            # O primeiro termo é um intervalo simples, aproveitável pelo índice do campo
+            return Q(**{f'{campo}__gte': valor}) & (Q(**{f'{campo}__gt': valor}) | Q(pk__gt=pk))
+        if valor is None:
+            return Q(**{f'{campo}__isnull': True, 'pk__lt': pk})
+        condicao = Q(**{f'{campo}__lte': valor}) & (Q(**{f'{campo}__lt': valor}) | Q(pk__lt=pk))
+        if self.field.null:
+            condicao |= Q(**{f'{campo}__isnull': True})
+        return condicao
+
+    def _cursor(self, direcao, item):
+        return _codificar([direcao, self.field.value_to_string(item) if getattr(item, self.campo) is not None else None, item.pk])
+
+    @property
+    def cursor_proximo(self):
+        if self.tem_proxima and self.object_list:
+            return self._cursor('p', self.object_list[-1])
+        return None
+
+    @property
+    def cursor_anterior(self):
+        if self.tem_anterior and self.object_list:
+            return self._cursor('a', self.object_list[0])
+        return None
+
+
+class PaginacaoCursorMixin:
+    """Mixin para ListView com paginação por cursor (keyset) opcional.
+
+    Ativada com paginacao_cursor = True na view ou com ?paginacao=cursor. Só se
+    aplica às ordenações listadas em campos_cursor; as restantes (ex.: relevância
+    da busca) continuam com o Paginator normal.
+    """
+    paginacao_cursor = False
+    campos_cursor = (
+        '-data_entrada', 'data_entrada',
+        'preco_venda', '-preco_venda',
+        'ano_modelo', '-ano_modelo',
+        'quilometragem', '-quilometragem',
+    )
+
+    def get_campo_cursor(self, queryset):
+        ordem = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        if len(ordem) == 1 and ordem[0] in self.campos_cursor:
+            return ordem[0]
+        return None
+
+    def usar_paginacao_cursor(self):
+        return self.paginacao_cursor or self.request.GET.get('paginacao') == 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        campo = self.get_campo_cursor(queryset) if self.usar_paginacao_cursor() else None
+        if campo is None:
+            self.pagina_cursor = None
+            return super().paginate_queryset(queryset, page_size)
+
+        try:
+            pagina = PaginaCursor(queryset, campo, page_size, self.request.GET.get('cursor'))
+        except CursorInvalido:
+            pagina = PaginaCursor(queryset, campo, page_size)
+        self.pagina_cursor = pagina
+        return (None, pagina, pagina.object_list, False)
+
+    def _url_cursor(self, cursor):
+        parametros = self.request.GET.copy()
+        parametros['cursor'] = cursor
+        if not self.paginacao_cursor:
+            parametros['paginacao'] = 'cursor'
+        return f'?{parametros.urlencode()}'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        pagina = getattr(self, 'pagina_cursor', None)
+        if pagina is not None:
+            context['paginacao_cursor'] = {
+                'url_anterior': self._url_cursor(pagina.cursor_anterior) if pagina.cursor_anterior else None,
+                'url_proxima': self._url_cursor(pagina.cursor_proximo) if pagina.cursor_proximo else None,
+            }
+        return context
@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from django.core.cache import caches
+from django.template.base import Template
+
+
+# Uma mesma consulta repetida este número de vezes num pedido é sinalizada como N+1
+LIMITE_REPETICOES = 3
+
+_local = threading.local()
+_instrumentado = set()
+
+
+class Medicao:
+    """Métricas de um único pedido"""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.consultas = Counter()
+        self.tempo_sql = 0.0
+        self.total_sql = 0
+        self.tempo_template = 0.0
+        self.profundidade_template = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def registrar_sql(self, sql, duracao):
+        self.total_sql += 1
+        self.tempo_sql += duracao
+        self.consultas[sql] += 1
+
+    @property
+    def repetidas(self):
+        """Consultas executadas mais de uma vez, com o número de execuções"""
+        return {sql: total for sql, total in self.consultas.items() if total > 1}
+
+    @property
+    def suspeitas_n_mais_1(self):
+        return {sql: total for sql, total in self.consultas.items() if total >= LIMITE_REPETICOES}
+
+
+def medicao_atual():
+    return getattr(_local, 'medicao', None)
+
+
+def iniciar():
+    _local.medicao = Medicao()
+    return _local.medicao
+
+
+def terminar():
+    _local.medicao = None
+
+
+def executar_sql(execute, sql, params, many, context):
+    """execute_wrapper do banco: cronometra cada consulta do pedido em curso"""
+    medicao = medicao_atual()
+    if medicao is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicao.registrar_sql(sql, time.perf_counter() - inicio)
+
+
+def instrumentar():
+    """Envolve a renderização de templates e as leituras do cache (uma vez por processo).
+
+    Fora de um pedido perfilado, os wrappers só consultam uma variável local
+    da thread e delegam na função original.
+    """
+    if 'template' not in _instrumentado:
+        Template.render = _medir_template(Template.render)
+        _instrumentado.add('template')
+
+    classe_cache = type(caches['default'])
+    if classe_cache not in _instrumentado:
+        classe_cache.get = _medir_cache(classe_cache.get)
+        _instrumentado.add(classe_cache)
+
+
+def _medir_template(render):
+    @wraps(render)
+    def _render(self, context):
+        medicao = medicao_atual()
+        if medicao is None:
+            return render(self, context)
+        # Só a renderização mais externa conta; includes e extends estão dentro dela
+        medicao.profundidade_template += 1
+        inicio = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            medicao.profundidade_template -= 1
+            if medicao.profundidade_template == 0:
+                medicao.tempo_template += time.perf_counter() - inicio
+    return _render
+
+
+_AUSENTE = object()
+
+
+def _medir_cache(get):
+    @wraps(get)
+    def _get(self, key, default=None, version=None):
+        medicao = medicao_atual()
+        if medicao is None:
+            return get(self, key, default, version)
+        valor = get(self, key, _AUSENTE, version)
+        if valor is _AUSENTE:
+            medicao.cache_misses += 1
+            return default
+        medicao.cache_hits += 1
+        return valor
+    return _get
+
+
+class Agregador:
+    """Totais por rota, acumulados no processo desde o arranque (ou o último reinício)"""
+
+    def __init__(self, mais_lentos=20):
+        self.lock = threading.Lock()
+        self.rotas = {}
+        self.mais_lentos = mais_lentos
+        self.lentos = []
+
+    def adicionar(self, rota, medicao, duracao, status):
+        with self.lock:
+            dados = self.rotas.setdefault(rota, {
+                'pedidos': 0, 'tempo_total_ms': 0.0, 'tempo_max_ms': 0.0,
+                'sql_total': 0, 'sql_tempo_ms': 0.0, 'sql_repetidas': 0,
+                'template_ms': 0.0, 'cache_hits': 0, 'cache_misses': 0,
+                'pedidos_n_mais_1': 0,
+            })
+            dados['pedidos'] += 1
+            dados['tempo_total_ms'] += duracao * 1000
+            dados['tempo_max_ms'] = max(dados['tempo_max_ms'], duracao * 1000)
+            dados['sql_total'] += medicao.total_sql
+            dados['sql_tempo_ms'] += medicao.tempo_sql * 1000
+            dados['sql_repetidas'] += sum(total - 1 for total in medicao.repetidas.values())
+            dados['template_ms'] += medicao.tempo_template * 1000
+            dados['cache_hits'] += medicao.cache_hits
+            dados['cache_misses'] += medicao.cache_misses
+            suspeitas = medicao.suspeitas_n_mais_1
+            if suspeitas:
+                dados['pedidos_n_mais_1'] += 1
+
+            self.lentos.append({
+                'rota': rota,
+                'status': status,
+                'tempo_ms': round(duracao * 1000, 2),
+                'sql_total': medicao.total_sql,
+                'n_mais_1': [
+                    {'sql': sql, 'execucoes': total}
+                    for sql, total in sorted(suspeitas.items(), key=lambda item: -item[1])[:5]
+                ],
+            })
+            self.lentos.sort(key=lambda pedido: -pedido['tempo_ms'])
+            del self.lentos[self.mais_lentos:]
+
+    def resumo(self):
+        with self.lock:
+            rotas = {}
+            for rota, dados in self.rotas.items():
+                pedidos = dados['pedidos']
+                rotas[rota] = {
+                    **{chave: round(valor, 2) for chave, valor in dados.items()},
+                    'tempo_medio_ms': round(dados['tempo_total_ms'] / pedidos, 2),
+                    'sql_media': round(dados['sql_total'] / pedidos, 2),
+                }
+            return {
+                'rotas': dict(sorted(rotas.items(), key=lambda item: -item[1]['tempo_total_ms'])),
+                'mais_lentos': list(self.lentos),
+            }
+
+    def reiniciar(self):
+        with self.lock:
+            self.rotas.clear()
+            self.lentos.clear()
+
+
+agregador = Agregador()
+
+
+def server_timing(medicao, duracao):
+    """Valor do cabeçalho Server-Timing (visível no separador Network do navegador)"""
+    repetidas = sum(total - 1 for total in medicao.repetidas.values())
+    return ', '.join([
+        f'total;dur={duracao * 1000:.1f}',
+        f'sql;dur={medicao.tempo_sql * 1000:.1f};desc="{medicao.total_sql} consultas, {repetidas} repetidas"',
+        f'template;dur={medicao.tempo_template * 1000:.1f}',
+        f'cache;desc="{medicao.cache_hits} hits, {medicao.cache_misses} misses"',
+    ])
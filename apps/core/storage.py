@@ -0,0 +1,48 @@
+import hashlib
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ArmazenamentoConteudo(FileSystemStorage):
+    """Storage local endereçado por conteúdo.
+
+    O nome final de cada ficheiro é o hash SHA-256 do conteúdo, dentro de
+    subpastas de dois níveis (ab/cd/) para não acumular milhares de ficheiros
+    numa só pasta. A pasta devolvida pelo upload_to (ex.: carros/fotos/) e a
+    extensão são mantidas; o nome aleatório gerado pelo upload_to é descartado.
+
+    Dois uploads com o mesmo conteúdo apontam para o mesmo ficheiro, que só é
+    gravado uma vez. Por isso apagar um ficheiro pode afetar outros registos.
+    """
+
+    # Caracteres do hash usados no nome (128 bits), para caber no max_length=100 dos FileField
+    TAMANHO_HASH = 32
+    deduplica = True
+
+    def calcular_hash(self, content):
+        sha = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for bloco in content.chunks():
+            sha.update(bloco)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        return sha.hexdigest()
+
+    def nome_por_conteudo(self, name, digest):
+        diretorio, arquivo = posixpath.split(name.replace('\\', '/'))
+        extensao = posixpath.splitext(arquivo)[1].lower()
+        return posixpath.join(
+            diretorio, digest[:2], digest[2:4], f'{digest[:self.TAMANHO_HASH]}{extensao}'
+        )
+
+    def _save(self, name, content):
+        name = self.nome_por_conteudo(name, self.calcular_hash(content))
+        if self.exists(name):
+            return name
+        # Numa corrida entre dois uploads iguais, o segundo recebe um nome
+        # alternativo do FileSystemStorage: perde-se a deduplicação, não o ficheiro
+        return super()._save(name, content)
@@ -1,3 +1,547 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+import time
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages import constants
+from django.contrib.messages.storage.base import Message
+from django.contrib.messages.storage.cookie import MessageEncoder
+from django.contrib.messages.storage.session import SessionStorage
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from io import StringIO
+from urllib.parse import parse_qs
+
+from apps.usuarios.models import Cliente, Usuario, Funcionario
+from apps.vendas.models import Venda
+from apps.veiculos import busca, semelhantes
+from apps.veiculos.fotos import atualizar_foto_capa
+from apps.veiculos.models import Carro, Marca, Modelo, Cor, Opcional, FotoCarro, MovimentacaoEstoque
+from . import paginacao, perfilamento
+from .cache import ALUGUEIS, ESTOQUE, cache_pagina_anonima, estatisticas_cache, invalidar
+from .exportacao import _valor_csv
+from .paginacao import PaginaCursor, PaginacaoCursorMixin
+from .storage import ArmazenamentoConteudo
+
+
+class ArmazenamentoConteudoTests(SimpleTestCase):
+    """Storage local com nomes pelo hash do conteúdo"""
+
+    def setUp(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta, ignore_errors=True)
+        self.storage = ArmazenamentoConteudo(location=pasta, base_url='/media/')
+
+    def test_mantem_pasta_do_upload_to_e_extensao(self):
+        nome = self.storage.save('carros/fotos/0f3a.JPG', ContentFile(b'foto'))
+        digest = self.storage.calcular_hash(ContentFile(b'foto'))
+        self.assertEqual(nome, f'carros/fotos/{digest[:2]}/{digest[2:4]}/{digest[:32]}.jpg')
+        with self.storage.open(nome) as arquivo:
+            self.assertEqual(arquivo.read(), b'foto')
+
+    def test_conteudo_igual_e_gravado_uma_vez(self):
+        primeiro = self.storage.save('carros/fotos/a.jpg', ContentFile(b'mesmo conteudo'))
+        segundo = self.storage.save('carros/fotos/b.jpg', ContentFile(b'mesmo conteudo'))
+        terceiro = self.storage.save('carros/fotos/c.jpg', ContentFile(b'outro conteudo'))
+        self.assertEqual(primeiro, segundo)
+        self.assertNotEqual(primeiro, terceiro)
+        _, arquivos = self.storage.listdir(primeiro.rsplit('/', 1)[0])
+        self.assertEqual(len(arquivos), 1)
+
+    def test_nome_cabe_no_max_length_dos_campos(self):
+        nome = self.storage.save(
+            'projectos/django/concessionaria/media/vendas/documentos/' + 'f' * 32 + '.pdf',
+            ContentFile(b'%PDF'),
+            max_length=100,
+        )
+        self.assertLessEqual(len(nome), 100)
+
+
+class OrcamentoConsultasTests(TestCase):
+    """Orçamento de consultas SQL e de tempo por view, com um estoque realista.
+
+    O número de consultas de cada página não pode crescer com o número de
+    carros nem de fotos: um N+1 num template ou numa view faz o teste falhar
+    e lista as consultas executadas. Ao alterar uma view de propósito,
+    ajuste o orçamento correspondente.
+    """
+
+    TOTAL_CARROS = 2000
+    FOTOS_POR_CARRO = 3
+    # Teto de tempo por pedido (s); folgado para não falhar em máquinas lentas
+    TEMPO_MAXIMO = 2.0
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = Usuario.objects.create_user('gestor', password='senha-teste', is_staff=True)
+        funcionario = Funcionario.objects.create(
+            usuario=cls.usuario, nome='Gestor de Estoque', bilhete_identidade='000000000LA000'
+        )
+
+        marcas = Marca.objects.bulk_create([Marca(nome=f'Marca {i}') for i in range(8)])
+        modelos = Modelo.objects.bulk_create([
+            Modelo(marca=marca, nome=f'Modelo {marca.pk}-{j}', categoria='suv')
+            for marca in marcas for j in range(5)
+        ])
+        cores = Cor.objects.bulk_create([Cor(nome=f'Cor {i}') for i in range(10)])
+        opcionais = Opcional.objects.bulk_create([
+            Opcional(nome=f'Opcional {i}', categoria='Conforto') for i in range(15)
+        ])
+
+        combustiveis = [valor for valor, _ in Carro.COMBUSTIVEL_CHOICES]
+        transmissoes = [valor for valor, _ in Carro.TRANSMISSAO_CHOICES]
+        carros = Carro.objects.bulk_create([
+            Carro(
+                modelo=modelos[i % len(modelos)], cor=cores[i % len(cores)],
+                ano_fabricacao=2010 + i % 15, ano_modelo=2010 + i % 15,
+                condicao='novo' if i % 3 == 0 else 'usado',
+                combustivel=combustiveis[i % len(combustiveis)],
+                transmissao=transmissoes[i % len(transmissoes)],
+                preco_venda=Decimal(2000000 + (i * 37131) % 60000000),
+                preco_aluguel_diario=Decimal(15000 + i % 50 * 1000) if i % 4 == 0 else None,
+                quilometragem=(i * 7919) % 250000,
+                disponivel_venda=i % 10 != 0, disponivel_aluguel=i % 4 == 0,
+                chassi=f'{i:017d}', matricula=f'LD-{i:05d}',
+                descricao=f'Viatura {i} em bom estado, revisões em dia',
+            )
+            for i in range(cls.TOTAL_CARROS)
+        ], batch_size=500)
+
+        FotoCarro.objects.bulk_create([
+            FotoCarro(carro=carro, foto=f'carros/fotos/{carro.pk}-{ordem}.jpg', ordem=ordem, foto_principal=ordem == 1)
+            for carro in carros for ordem in range(1, cls.FOTOS_POR_CARRO + 1)
+        ], batch_size=1000)
+        Carro.opcionais.through.objects.bulk_create([
+            Carro.opcionais.through(carro_id=carro.pk, opcional_id=opcionais[(carro.pk + k) % len(opcionais)].pk)
+            for carro in carros for k in range(3)
+        ], batch_size=1000)
+        MovimentacaoEstoque.objects.bulk_create([
+            MovimentacaoEstoque(carro=carro, tipo_movimentacao='entrada', funcionario=funcionario)
+            for carro in carros
+        ], batch_size=1000)
+
+        # bulk_create não dispara sinais: capa e índice de busca calculados de uma vez
+        atualizar_foto_capa([carro.pk for carro in carros])
+        busca.reconstruir_indice()
+        semelhantes.recalcular_todos()
+        cls.carro = carros[1]
+        cls.marca = marcas[0]
+
+    def setUp(self):
+        # Sem cache de páginas nem de dados: mede-se sempre o caminho completo
+        cache.clear()
+
+    def medir(self, url, orcamento, autenticado=False):
+        if autenticado:
+            self.client.force_login(self.usuario)
+        else:
+            self.client.logout()
+        with CaptureQueriesContext(connection) as consultas:
+            inicio = time.perf_counter()
+            resposta = self.client.get(url)
+            duracao = time.perf_counter() - inicio
+
+        self.assertEqual(resposta.status_code, 200, url)
+        if len(consultas) > orcamento:
+            sql = '\n'.join(f'{n}. {c["sql"]}' for n, c in enumerate(consultas.captured_queries, 1))
+            self.fail(f'{url}: {len(consultas)} consultas (orçamento {orcamento})\n{sql}')
+        self.assertLess(duracao, self.TEMPO_MAXIMO, f'{url} demorou {duracao:.2f}s')
+        return resposta
+
+    def test_home(self):
+        self.medir(reverse('website:home'), 4)
+
+    def test_loja_com_cada_filtro(self):
+        url = reverse('website:loja')
+        filtros = {
+            'sem filtros': '',
+            'busca': 'search=modelo',
+            'marca': f'marca={self.marca.pk}',
+            'cor': f'cor={self.carro.cor_id}',
+            'condicao': 'condicao=novo',
+            'combustivel': 'combustivel=diesel',
+            'transmissao': 'transmissao=manual',
+            'ano': 'ano_min=2015&ano_max=2020',
+            'preco': 'preco_min=5000000&preco_max=20000000',
+            'ordem': 'ordem=preco_asc',
+            'pagina': 'page=5',
+            'cursor': 'paginacao=cursor&ordem=km_desc',
+            'aluguel': 'aluguel_inicio=2030-01-01&aluguel_fim=2030-01-05',
+            'combinados': f'marca={self.marca.pk}&condicao=usado&ano_min=2012&ordem=ano_desc',
+        }
+        for nome, parametros in filtros.items():
+            with self.subTest(filtro=nome):
+                cache.clear()
+                # Com datas de aluguel, mais a leitura do calendário (uma consulta por versão)
+                self.medir(f'{url}?{parametros}', 6 if nome == 'aluguel' else 5)
+
+    def test_detalhe_publico(self):
+        # Fotos e capa saem do prefetch ordenado, sem consultas à parte
+        resposta = self.medir(reverse('website:carro_detailhe', args=[self.carro.pk]), 5)
+        fotos = resposta.context['fotos']
+        self.assertEqual(len(fotos), self.FOTOS_POR_CARRO)
+        self.assertIs(resposta.context['foto_principal'], fotos[0])
+        self.assertTrue(fotos[0].foto_principal)
+
+    def test_lista_administracao(self):
+        url = reverse('administracao:lista_veiculos')
+        for parametros in ('', 'search=LD-0001', 'condicao=novo&combustivel=diesel', 'page=3'):
+            with self.subTest(parametros=parametros):
+                self.medir(f'{url}?{parametros}', 7, autenticado=True)
+
+    def test_detalhe_administracao(self):
+        self.medir(reverse('administracao:detalhes_veiculo', args=[self.carro.pk]), 8, autenticado=True)
+
+    def test_gerenciamento(self):
+        self.medir(reverse('administracao:gerenciamento'), 13, autenticado=True)
+
+
+class GerarDadosTests(TestCase):
+    """Comando gerar_dados"""
+
+    def gerar(self, **opcoes):
+        saida = StringIO()
+        call_command('gerar_dados', stdout=saida, **opcoes)
+        return saida.getvalue()
+
+    def test_gera_estoque_completo_e_deterministico(self):
+        carros = Carro.objects.filter(chassi__startswith='SN003').order_by('chassi')
+        with transaction.atomic():
+            self.gerar(carros=60, lote=60, semente=3)
+            primeira = list(carros.values_list('preco_venda', 'modelo__nome', 'data_entrada__date'))
+            transaction.set_rollback(True)
+
+        saida = self.gerar(carros=60, lote=25, semente=3)
+        # Progresso a cada lote
+        for progresso in ('25/60', '50/60', '60/60'):
+            self.assertIn(f'{progresso} carros', saida)
+        self.assertEqual(list(carros.values_list('preco_venda', 'modelo__nome', 'data_entrada__date')), primeira)
+        self.assertFalse(carros.filter(foto_capa__isnull=True).exists())
+        self.assertEqual(
+            MovimentacaoEstoque.objects.filter(carro__in=carros, tipo_movimentacao='entrada').count(), 60
+        )
+        # Datas de entrada espalhadas pelo histórico, não a hora da geração
+        self.assertGreater(len({data for _, _, data in primeira}), 30)
+        modelo = carros.first().modelo.nome
+        self.assertEqual(busca.buscar(carros, modelo).count(), carros.filter(modelo__nome=modelo).count())
+
+    def test_recusa_semente_repetida(self):
+        self.gerar(carros=5, semente=9)
+        with self.assertRaises(CommandError):
+            self.gerar(carros=5, semente=9)
+
+
+class CachePaginaAnonimaTests(TestCase):
+    """Cache de página inteira para visitantes anónimos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = Usuario.objects.create_user('cliente', password='senha-teste')
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('website:loja')
+
+    def test_miss_depois_hit_sem_consultas(self):
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            resposta = self.client.get(self.url)
+        self.assertEqual(resposta['X-Cache'], 'HIT')
+        self.assertEqual(estatisticas_cache()['hit'], 1)
+        self.assertEqual(estatisticas_cache()['miss'], 1)
+        self.assertEqual(estatisticas_cache()['taxa_acerto'], 0.5)
+
+    def test_parametros_normalizados_na_chave(self):
+        self.client.get(f'{self.url}?ordem=preco_asc&condicao=novo&search=')
+        self.assertEqual(self.client.get(f'{self.url}?condicao=novo&ordem=preco_asc')['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(f'{self.url}?condicao=usado&ordem=preco_asc')['X-Cache'], 'MISS')
+
+    def test_ignora_autenticados_e_mensagens_pendentes(self):
+        self.client.get(self.url)
+
+        self.client.force_login(self.usuario)
+        self.assertNotIn('X-Cache', self.client.get(self.url))
+        self.client.logout()
+
+        sessao = self.client.session
+        sessao[SessionStorage.session_key] = MessageEncoder().encode([Message(constants.SUCCESS, 'Pedido enviado.')])
+        sessao.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = sessao.session_key
+        resposta = self.client.get(self.url)
+        self.assertNotIn('X-Cache', resposta)
+        self.assertContains(resposta, 'Pedido enviado.')
+        self.assertEqual(estatisticas_cache()['ignorado'], 2)
+
+    def test_nao_guarda_respostas_com_token_csrf(self):
+        @cache_pagina_anonima(namespaces=())
+        def formulario(request):
+            return HttpResponse(get_token(request))
+
+        fabrica = RequestFactory()
+        for _ in range(2):
+            pedido = fabrica.get('/formulario/')
+            pedido.user = AnonymousUser()
+            pedido.session = {}
+            self.assertEqual(formulario(pedido)['X-Cache'], 'MISS')
+
+    def test_invalidado_pelo_estoque_e_pelos_alugueis(self):
+        self.client.get(self.url)
+        for namespace in (ESTOQUE, ALUGUEIS):
+            with self.subTest(namespace=namespace):
+                invalidar(namespace)
+                self.assertEqual(self.client.get(self.url)['X-Cache'], 'MISS')
+                self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+        # A página "sobre" não depende do estoque
+        sobre = reverse('website:sobre')
+        self.client.get(sobre)
+        invalidar(ESTOQUE)
+        self.assertEqual(self.client.get(sobre)['X-Cache'], 'HIT')
+
+
+class PaginacaoCursorTests(TestCase):
+    """Paginação por keyset: mesma ordem que o OFFSET, nos dois sentidos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        modelo = Modelo.objects.create(marca=Marca.objects.create(nome='Toyota'), nome='Yaris', categoria='hatch')
+        cor = Cor.objects.create(nome='Azul')
+        # Valores repetidos (empates no campo) e preços em falta
+        Carro.objects.bulk_create([
+            Carro(
+                modelo=modelo, cor=cor, ano_fabricacao=2015 + i % 3, ano_modelo=2015 + i % 3,
+                condicao='usado', combustivel='gasolina', transmissao='manual',
+                preco_venda=None if i % 5 == 0 else Decimal(1000000 * (i % 4)),
+                quilometragem=1000 * (i % 6), disponivel_venda=True,
+                chassi=f'{i:017d}', matricula=f'LD-{i:05d}',
+            )
+            for i in range(23)
+        ])
+        busca.reconstruir_indice()
+
+    def setUp(self):
+        cache.clear()
+
+    def ordem_offset(self, campo):
+        ordem = [campo, '-pk'] if campo.startswith('-') else [campo, 'pk']
+        return list(Carro.objects.order_by(*ordem).values_list('pk', flat=True))
+
+    def test_percorre_nos_dois_sentidos_como_o_offset(self):
+        for campo in PaginacaoCursorMixin.campos_cursor:
+            with self.subTest(campo=campo):
+                paginas, cursor = [], None
+                while True:
+                    pagina = PaginaCursor(Carro.objects.all(), campo, 5, cursor)
+                    paginas.append([carro.pk for carro in pagina.object_list])
+                    cursor = pagina.cursor_proximo
+                    if cursor is None:
+                        break
+                self.assertEqual(sum(paginas, []), self.ordem_offset(campo))
+                self.assertEqual(len(paginas), 5)
+
+                # De volta a partir da última página
+                recuadas, cursor = [], pagina.cursor_anterior
+                while cursor is not None:
+                    pagina = PaginaCursor(Carro.objects.all(), campo, 5, cursor)
+                    recuadas.insert(0, [carro.pk for carro in pagina.object_list])
+                    cursor = pagina.cursor_anterior
+                self.assertEqual(recuadas, paginas[:-1])
+                self.assertFalse(pagina.tem_anterior)
+
+    def test_cursor_invalido(self):
+        codificar = paginacao._codificar
+        for cursor in ('lixo!', codificar(['x', '1', 1]), codificar(['p', 'abc', 1]), codificar(['p', '1']), codificar({})):
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(paginacao.CursorInvalido):
+                    PaginaCursor(Carro.objects.all(), 'preco_venda', 5, cursor)
+
+        # Na loja, um cursor adulterado volta à primeira página
+        resposta = self.client.get(reverse('website:loja'), {
+            'paginacao': 'cursor', 'ordem': 'preco_asc', 'cursor': 'lixo!',
+        })
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(
+            [carro.pk for carro in resposta.context['carros']],
+            self.ordem_offset('preco_venda')[:12],
+        )
+
+    def test_relevancia_usa_paginador_normal(self):
+        url = reverse('website:loja')
+        resposta = self.client.get(url, {'paginacao': 'cursor', 'ordem': 'preco_asc'})
+        self.assertIsNone(resposta.context['paginator'])
+        self.assertEqual(resposta.context['total_carros'], 23)
+
+        resposta = self.client.get(url, {'paginacao': 'cursor', 'search': 'yaris'})
+        self.assertEqual(resposta.context['paginator'].count, 23)
+        self.assertNotIn('paginacao_cursor', resposta.context)
+
+
+class PerfilamentoTests(TestCase):
+    """Middleware de perfilamento e endpoint agregado"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = Usuario.objects.create_user('operacoes', password='senha-teste', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        perfilamento.agregador.reiniciar()
+
+    def test_desligado_nao_acrescenta_cabecalho(self):
+        resposta = self.client.get(reverse('website:loja'))
+        self.assertNotIn('Server-Timing', resposta)
+
+    @override_settings(PERFILAMENTO=True)
+    def test_mede_sql_template_e_cache(self):
+        resposta = self.client.get(reverse('website:loja'))
+        cabecalho = resposta['Server-Timing']
+        for metrica in ('total;dur=', 'sql;dur=', 'template;dur=', 'cache;desc='):
+            self.assertIn(metrica, cabecalho)
+
+        self.client.get(reverse('website:loja'))
+        rota = perfilamento.agregador.resumo()['rotas']['website:loja']
+        self.assertEqual(rota['pedidos'], 2)
+        self.assertGreater(rota['sql_total'], 0)
+        # O segundo pedido veio do cache de páginas
+        self.assertGreater(rota['cache_hits'], 0)
+
+    def test_consultas_repetidas_sinalizam_n_mais_1(self):
+        medicao = perfilamento.Medicao()
+        for _ in range(perfilamento.LIMITE_REPETICOES):
+            medicao.registrar_sql('SELECT * FROM foto_carro WHERE carro_id = %s', 0.001)
+        medicao.registrar_sql('SELECT * FROM carros', 0.002)
+        self.assertEqual(list(medicao.suspeitas_n_mais_1), ['SELECT * FROM foto_carro WHERE carro_id = %s'])
+        self.assertIn('4 consultas, 2 repetidas', perfilamento.server_timing(medicao, 0.01))
+
+    def test_endpoint_exige_staff(self):
+        url = reverse('core:perfilamento')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.staff)
+        dados = self.client.get(url).json()
+        self.assertEqual(set(dados), {'ativo', 'rotas', 'mais_lentos'})
+
+
+class ExportacaoTests(TestCase):
+    """Exportações em streaming: filtros da listagem, valores exatos e uma consulta para as linhas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = Usuario.objects.create_user('contabilidade', password='senha-teste', is_staff=True)
+        modelos = [
+            Modelo.objects.create(marca=Marca.objects.create(nome=nome), nome=modelo, categoria='suv')
+            for nome, modelo in (('Toyota', 'RAV4'), ('Kia', 'Sorento'))
+        ]
+        cor = Cor.objects.create(nome='Azul')
+        cls.carros = [
+            Carro.objects.create(
+                modelo=modelos[i % 2], cor=cor, ano_fabricacao=2022, ano_modelo=2022, condicao='usado',
+                combustivel='diesel', transmissao='manual', chassi=f'X{i:016d}', matricula=f'LD-EX-{i:02d}',
+                preco_venda=Decimal('12000000.10'), descricao='=HYPERLINK("x")' if i == 0 else '',
+            )
+            for i in range(6)
+        ]
+        cliente = Cliente.objects.create(nome='Cliente Exportação', bilhete_identidade='999999999LA999')
+        funcionario = Funcionario.objects.create(nome='Contas', bilhete_identidade='101010101LA101')
+        Venda.objects.bulk_create([
+            Venda(
+                carro=carro, cliente=cliente, funcionario=funcionario, valor_venda=Decimal('9999999.99'),
+                tipo_pagamento='a_vista', status='finalizada' if i < 2 else 'pendente',
+            )
+            for i, carro in enumerate(cls.carros[:3])
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def conteudo(self, resposta):
+        return b''.join(resposta.streaming_content).decode('utf-8')
+
+    def test_carros_com_os_filtros_da_listagem(self):
+        resposta = self.client.get(reverse('administracao:exportar_veiculos'), {'marca': self.carros[0].modelo.marca_id})
+        self.assertTrue(resposta.streaming)
+        self.assertIn('attachment; filename="carros-', resposta['Content-Disposition'])
+
+        linhas = self.conteudo(resposta).lstrip('\ufeff').splitlines()
+        self.assertEqual(linhas[0].split(';')[:4], ['id', 'marca', 'modelo', 'cor'])
+        self.assertEqual(len(linhas), 4)
+        self.assertTrue(all(';Toyota;RAV4;' in linha for linha in linhas[1:]))
+        self.assertIn('12000000.10', linhas[1])
+        # Texto que o Excel leria como fórmula sai neutralizado
+        self.assertIn("'=HYPERLINK", linhas[1])
+
+    def test_tabulacao_e_retorno_tambem_neutralizados(self):
+        for valor in ('\t=1+1', '\r=1+1', '-2+3'):
+            with self.subTest(valor=valor):
+                self.assertEqual(_valor_csv(valor), "'" + valor)
+        self.assertEqual(_valor_csv('Toyota'), 'Toyota')
+
+    def test_links_de_exportacao_sem_pagina_nem_cursor(self):
+        resposta = self.client.get(reverse('administracao:lista_veiculos'), {
+            'marca': self.carros[0].modelo.marca_id, 'page': '1', 'paginacao': 'cursor', 'formato': 'jsonl',
+        })
+        for formato, link in resposta.context['links_exportacao'].items():
+            with self.subTest(formato=formato):
+                rota, parametros = link.split('?')
+                self.assertEqual(rota, reverse('administracao:exportar_veiculos'))
+                self.assertEqual(parse_qs(parametros), {
+                    'marca': [str(self.carros[0].modelo.marca_id)], 'paginacao': ['cursor'], 'formato': [formato],
+                })
+
+    def test_ids_invalidos_sao_ignorados(self):
+        total = Carro.objects.count()
+        for parametros in ({'marca': 'abc'}, {'modelo': '1;DROP'}, {'marca': '9' * 30}, {'marca': ''}):
+            with self.subTest(parametros=parametros):
+                lista = self.client.get(reverse('administracao:lista_veiculos'), parametros)
+                self.assertEqual(lista.status_code, 200)
+                resposta = self.client.get(reverse('administracao:exportar_veiculos'), parametros)
+                self.assertEqual(resposta.status_code, 200)
+                linhas = self.conteudo(resposta).splitlines()[1:]
+                self.assertEqual(len(linhas), total)
+
+    def test_vendas_jsonl_filtradas_numa_consulta(self):
+        resposta = self.client.get(reverse('vendas:exportar'), {'formato': 'jsonl', 'status': 'finalizada'})
+        self.assertEqual(resposta['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        with self.assertNumQueries(1):
+            vendas = [json.loads(linha) for linha in self.conteudo(resposta).splitlines()]
+        self.assertEqual(len(vendas), 2)
+        self.assertEqual(vendas[0]['valor_venda'], '9999999.99')
+        self.assertEqual(vendas[0]['matricula'], 'LD-EX-00')
+
+        # Período sem vendas e filtros inválidos (ignorados)
+        resposta = self.client.get(reverse('vendas:exportar'), {'formato': 'jsonl', 'ate': '2000-01-01'})
+        self.assertEqual(self.conteudo(resposta), '')
+        resposta = self.client.get(reverse('vendas:exportar'), {'formato': 'jsonl', 'funcionario': 'x'})
+        self.assertEqual(len(self.conteudo(resposta).splitlines()), 3)
+
+    def test_ids_acima_do_limite_do_banco_sao_ignorados(self):
+        # Antes rebentavam a meio do streaming, com o 200 já enviado
+        enorme = '9' * 20
+        for rota, parametro in (
+            ('vendas:exportar', 'funcionario'),
+            ('alugueis:exportar', 'funcionario'),
+            ('alugueis:exportar_pagamentos', 'aluguel'),
+            ('alugueis:exportar_pagamentos', 'funcionario'),
+            ('administracao:exportar_movimentacoes', 'carro'),
+        ):
+            with self.subTest(rota=rota, parametro=parametro):
+                sem_filtro = self.conteudo(self.client.get(reverse(rota)))
+                resposta = self.client.get(reverse(rota), {parametro: enorme})
+                self.assertEqual(resposta.status_code, 200)
+                self.assertEqual(self.conteudo(resposta), sem_filtro)
+        linhas = self.conteudo(self.client.get(reverse('vendas:exportar'), {'funcionario': enorme})).splitlines()
+        self.assertEqual(len(linhas), 4)
+
+    def test_formato_invalido_e_acesso_restrito(self):
+        self.assertEqual(self.client.get(reverse('alugueis:exportar'), {'formato': 'xml'}).status_code, 400)
+        self.client.force_login(Usuario.objects.create_user('vendedor', password='senha-teste'))
+        self.assertEqual(self.client.get(reverse('alugueis:exportar_pagamentos')).status_code, 302)
@@ -5,4 +5,6 @@ app_name = 'core'
 
 urlpatterns = [
     path('dashboard/', views.dashboard_view, name='dashboard'),
+    path('cache/estatisticas/', views.estatisticas_cache_view, name='estatisticas_cache'),
+    path('perfilamento/', views.perfilamento_view, name='perfilamento'),
 ]
@@ -1,5 +1,40 @@
 from django.shortcuts import render
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods
 
+from apps.vendas import relatorios
+from .cache import estatisticas_cache
+from . import perfilamento
+
+@login_required
 def dashboard_view(request):
-    return render(request, 'core/home.html')
+    """Painel de vendas e aluguéis servido pelos relatórios materializados (RelatorioVendas)"""
+    resumo = relatorios.resumo_dashboard()
+    resumo['periodos'] = [
+        ('Hoje', resumo['diario']),
+        ('Esta semana', resumo['semanal']),
+        ('Este mês', resumo['mensal']),
+        ('Este ano', resumo['anual']),
+    ]
+    return render(request, 'core/dashboard.html', resumo)
+
+
+@staff_member_required
+def estatisticas_cache_view(request):
+    """Contadores do cache de páginas públicas (para operações)"""
+    return JsonResponse(estatisticas_cache())
+
 
+@staff_member_required
+@require_http_methods(['GET', 'POST'])
+def perfilamento_view(request):
+    """Métricas agregadas do PerfilamentoMiddleware neste processo; POST reinicia os totais"""
+    if request.method == 'POST':
+        perfilamento.agregador.reiniciar()
+    return JsonResponse({
+        'ativo': getattr(settings, 'PERFILAMENTO', False),
+        **perfilamento.agregador.resumo(),
+    })
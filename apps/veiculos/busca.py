@@ -0,0 +1,158 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Carro, Marca, Modelo, Cor, Opcional, IndiceBuscaCarro
+
+
+# Colunas pesquisáveis no site público e na administração (que também busca por documentos)
+COLUNAS_PUBLICAS = ('marca', 'modelo', 'cor', 'descricao', 'opcionais', 'combustivel', 'transmissao')
+COLUNAS_INTERNAS = COLUNAS_PUBLICAS + ('chassi', 'matricula')
+
+# Equivalentes para bancos sem FTS5 (busca simples com icontains)
+CAMPOS_ALTERNATIVOS = {
+    'marca': 'modelo__marca__nome',
+    'modelo': 'modelo__nome',
+    'cor': 'cor__nome',
+    'descricao': 'descricao',
+    'combustivel': 'combustivel',
+    'transmissao': 'transmissao',
+    'chassi': 'chassi',
+    'matricula': 'matricula',
+}
+
+TAMANHO_LOTE = 500
+
+
+def fts_disponivel():
+    """O índice FTS5 só existe em SQLite"""
+    return connection.vendor == 'sqlite'
+
+
+def termos(texto):
+    """Separa o texto digitado em palavras (letras e dígitos), descartando pontuação"""
+    return re.findall(r'\w+', texto or '')
+
+
+def montar_consulta(texto, colunas=COLUNAS_PUBLICAS):
+    """Converte o texto do utilizador numa consulta FTS5 segura.
+
+    Cada palavra vira um prefixo entre aspas ("toy"*), todas obrigatórias,
+    restritas às colunas indicadas. Acentos e maiúsculas são ignorados pelo
+    tokenizador (unicode61 remove_diacritics 2), por isso "eletrico"
+    encontra "Elétrico".
+    """
+    palavras = termos(texto)
+    if not palavras:
+        return ''
+    frase = ' '.join(f'"{palavra}"*' for palavra in palavras)
+    return f'{{{" ".join(colunas)}}} : ({frase})'
+
+
+def condicao_busca(texto, colunas=COLUNAS_PUBLICAS):
+    """Q para filtrar carros pelo texto; vazio se não houver termos"""
+    if not termos(texto):
+        return Q()
+
+    if fts_disponivel():
+        return Q(indice_busca__documento__match=montar_consulta(texto, colunas))
+
+    condicao = Q()
+    for palavra in termos(texto):
+        condicao_palavra = Q()
+        for coluna in colunas:
+            if coluna in CAMPOS_ALTERNATIVOS:
+                condicao_palavra |= Q(**{f'{CAMPOS_ALTERNATIVOS[coluna]}__icontains': palavra})
+        condicao &= condicao_palavra
+    return condicao
+
+
+def ordenacao_relevancia():
+    """Critérios de ordenação por relevância (bm25), com os mais recentes em caso de empate"""
+    if fts_disponivel():
+        return ['indice_busca__rank', '-data_entrada']
+    return ['-data_entrada']
+
+
+def buscar(queryset, texto, colunas=COLUNAS_PUBLICAS, ordenar=True):
+    """Aplica a busca textual a um queryset de Carro, opcionalmente ordenado por relevância"""
+    if not termos(texto):
+        return queryset
+    queryset = queryset.filter(condicao_busca(texto, colunas))
+    if ordenar:
+        queryset = queryset.order_by(*ordenacao_relevancia())
+    return queryset
+
+
+def _sql_rotulo(coluna, choices):
+    """CASE que traduz o valor guardado no rótulo exibido (ex.: 'hibrido' -> 'Híbrido')"""
+    casos = ' '.join(f"WHEN '{valor}' THEN '{rotulo}'" for valor, rotulo in choices)
+    return f"CASE {coluna} {casos} ELSE {coluna} END"
+
+
+def _sql_documentos():
+    """SELECT que produz o conteúdo indexado de cada carro, com os nomes já resolvidos"""
+    through = Carro.opcionais.through._meta
+    return f'''
+        SELECT c.id, ma.nome, mo.nome, co.nome, c.descricao,
+               COALESCE((
+                   SELECT group_concat(o.nome, ' ')
+                   FROM {through.db_table} co2
+                   JOIN {Opcional._meta.db_table} o ON o.id = co2.opcional_id
+                   WHERE co2.carro_id = c.id
+               ), ''),
+               {_sql_rotulo('c.combustivel', Carro.COMBUSTIVEL_CHOICES)},
+               {_sql_rotulo('c.transmissao', Carro.TRANSMISSAO_CHOICES)},
+               c.chassi, c.matricula
+        FROM {Carro._meta.db_table} c
+        JOIN {Modelo._meta.db_table} mo ON mo.id = c.modelo_id
+        JOIN {Marca._meta.db_table} ma ON ma.id = mo.marca_id
+        JOIN {Cor._meta.db_table} co ON co.id = c.cor_id
+    '''
+
+
+def _insert_documentos():
+    return (
+        f'INSERT INTO {IndiceBuscaCarro._meta.db_table} '
+        f'(rowid, marca, modelo, cor, descricao, opcionais, combustivel, transmissao, chassi, matricula) '
+        f'{_sql_documentos()}'
+    )
+
+
+def remover_carros(ids):
+    """Remove carros do índice"""
+    if not fts_disponivel():
+        return
+    ids = list(ids)
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(ids), TAMANHO_LOTE):
+            lote = ids[inicio:inicio + TAMANHO_LOTE]
+            marcadores = ', '.join(['%s'] * len(lote))
+            cursor.execute(
+                f'DELETE FROM {IndiceBuscaCarro._meta.db_table} WHERE rowid IN ({marcadores})',
+                lote
+            )
+
+
+def indexar_carros(ids):
+    """(Re)indexa os carros indicados, em lotes, com um INSERT ... SELECT por lote"""
+    if not fts_disponivel():
+        return
+    ids = list(ids)
+    remover_carros(ids)
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(ids), TAMANHO_LOTE):
+            lote = ids[inicio:inicio + TAMANHO_LOTE]
+            marcadores = ', '.join(['%s'] * len(lote))
+            cursor.execute(f'{_insert_documentos()} WHERE c.id IN ({marcadores})', lote)
+
+
+def reconstruir_indice():
+    """Reconstrói o índice inteiro a partir das tabelas de carros"""
+    if not fts_disponivel():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {IndiceBuscaCarro._meta.db_table}')
+        cursor.execute(_insert_documentos())
+        return cursor.rowcount
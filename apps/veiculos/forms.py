@@ -2,9 +2,24 @@
 from django import forms
 from django.core.exceptions import ValidationError
 from django.utils import timezone
+from apps.usuarios.models import Funcionario
 from .models import Carro, Marca, Modelo, Cor, Opcional, FotoCarro
+from .referencias import cores_ativas, marcas_ativas, modelos_ativos, usar_referencias
 from django.core.validators import RegexValidator
 
+
+# Regras partilhadas pelo formulário de cadastro e pela importação em lote (importacao.py)
+
+def validar_chassi(chassi):
+    if chassi and len(chassi) != 17:
+        raise ValidationError('O chassi deve ter exatamente 17 caracteres.')
+
+
+def validar_anos(ano_fabricacao, ano_modelo):
+    if ano_fabricacao and ano_modelo and ano_fabricacao > ano_modelo:
+        raise ValidationError('Ano de fabricação não pode ser maior que o ano do modelo.')
+
+
 class CarroRegistroForm(forms.ModelForm):
     primeira_foto = forms.ImageField(
         label='Primeira Foto do Carro',
@@ -35,14 +50,15 @@ class CarroRegistroForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
-        # Filtrar apenas modelos de marcas ativas
-        self.fields['modelo'].queryset = Modelo.objects.filter(
-            ativo=True, 
-            marca__ativo=True
-        ).select_related('marca')
+        # Filtrar apenas modelos de marcas ativas; as opções vêm da lista em memória
+        usar_referencias(
+            self.fields['modelo'],
+            Modelo.objects.filter(ativo=True, marca__ativo=True).select_related('marca'),
+            modelos_ativos(),
+        )
         
         # Filtrar apenas cores ativas
-        self.fields['cor'].queryset = Cor.objects.filter(ativo=True)
+        usar_referencias(self.fields['cor'], Cor.objects.filter(ativo=True), cores_ativas())
         
         # Adiciona classes Bootstrap para validação e estilo
         for field_name, field in self.fields.items():
@@ -67,18 +83,17 @@ class CarroRegistroForm(forms.ModelForm):
 
     def clean_chassi(self):
         chassi = self.cleaned_data.get('chassi')
-        if chassi and len(chassi) != 17:
-            raise forms.ValidationError('O chassi deve ter exatamente 17 caracteres.')
+        validar_chassi(chassi)
         return chassi
     
-    def clean_ano_fabricacao(self):
-        ano_fabricacao = self.cleaned_data.get('ano_fabricacao')
-        ano_modelo = self.cleaned_data.get('ano_modelo')
-        
-        if ano_fabricacao and ano_modelo and ano_fabricacao > ano_modelo:
-            raise forms.ValidationError('Ano de fabricação não pode ser maior que o ano do modelo.')
-        
-        return ano_fabricacao
+    def clean(self):
+        cleaned_data = super().clean()
+        # Em clean() e não em clean_ano_fabricacao: o ano do modelo vem depois no formulário
+        try:
+            validar_anos(cleaned_data.get('ano_fabricacao'), cleaned_data.get('ano_modelo'))
+        except ValidationError as erro:
+            self.add_error('ano_fabricacao', erro)
+        return cleaned_data
     
 class MarcaRegistroForm(forms.ModelForm):
     class Meta:
@@ -126,7 +141,7 @@ class ModeloRegistroForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Filtrar apenas marcas ativas
-        self.fields['marca'].queryset = Marca.objects.filter(ativo=True)
+        usar_referencias(self.fields['marca'], Marca.objects.filter(ativo=True), marcas_ativas())
         self.fields['nome'].widget.attrs.update({'required': True})
 
 
@@ -151,4 +166,20 @@ class CorRegistroForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['nome'].widget.attrs.update({'required': True})
\ No newline at end of file
+        self.fields['nome'].widget.attrs.update({'required': True})
+
+class ImportacaoCarrosForm(forms.Form):
+    arquivo = forms.FileField(
+        label='Ficheiro (.csv ou .xlsx)',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.xlsx'})
+    )
+    funcionario = forms.ModelChoiceField(
+        label='Responsável pela entrada',
+        queryset=Funcionario.objects.filter(ativo=True),
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    simular = forms.BooleanField(
+        label='Só validar (não grava nada)',
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
@@ -0,0 +1,15 @@
+from django.db.models import OuterRef, Subquery
+
+from .models import Carro, FotoCarro
+
+
+def atualizar_foto_capa(carro_ids):
+    """Recalcula a foto de capa dos carros indicados num único UPDATE.
+
+    A capa é a foto marcada como principal ou, na falta dela, a primeira pela
+    ordem de exibição; carros sem fotos ficam sem capa.
+    """
+    capa = FotoCarro.objects.filter(
+        carro=OuterRef('pk')
+    ).order_by('-foto_principal', 'ordem', 'data_upload', 'id').values('id')[:1]
+    return Carro.objects.filter(pk__in=carro_ids).update(foto_capa=Subquery(capa))
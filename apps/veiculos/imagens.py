@@ -0,0 +1,156 @@
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .models import FotoCarro
+
+
+logger = logging.getLogger(__name__)
+
+# Tamanhos gerados para cada foto: (largura, altura) máximas, mantendo a proporção
+VARIANTES = {
+    'miniatura': (160, 120),
+    'cartao': (640, 480),
+    'galeria': (1600, 1200),
+}
+
+# Formatos de cada variante: extensão, formato do Pillow e opções de gravação
+FORMATOS = {
+    'jpeg': ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _obter_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGENS_WORKERS', 2),
+                thread_name_prefix='imagens',
+            )
+        return _executor
+
+
+def caminho_variante(nome_original, variante, extensao):
+    """carros/fotos/abc.jpg -> carros/fotos/variantes/abc_cartao.webp"""
+    diretorio, arquivo = posixpath.split(nome_original)
+    base = posixpath.splitext(arquivo)[0]
+    return posixpath.join(diretorio, 'variantes', f'{base}_{variante}.{extensao}')
+
+
+def _preparar(imagem):
+    """Aplica a rotação do EXIF e converte para um modo aceite por JPEG e WebP"""
+    imagem = ImageOps.exif_transpose(imagem)
+    if imagem.mode in ('RGBA', 'LA', 'P'):
+        fundo = Image.new('RGB', imagem.size, (255, 255, 255))
+        imagem = imagem.convert('RGBA')
+        fundo.paste(imagem, mask=imagem.getchannel('A'))
+        return fundo
+    return imagem.convert('RGB')
+
+
+def _codificar(imagem, formato):
+    _, formato_pil, opcoes = FORMATOS[formato]
+    buffer = BytesIO()
+    # Sem o argumento exif, o Pillow grava a imagem sem metadados (GPS, câmara, etc.)
+    imagem.save(buffer, formato_pil, **opcoes)
+    return buffer.getvalue()
+
+
+def gerar_variantes(foto):
+    """Gera as variantes de uma foto e grava-as no storage.
+
+    Devolve (largura, altura, variantes), onde variantes é
+    {'cartao': {'jpeg': nome, 'webp': nome}, ...} com os nomes no storage.
+    """
+    with foto.foto.open('rb') as arquivo:
+        with Image.open(arquivo) as original:
+            imagem = _preparar(original)
+
+    largura, altura = imagem.size
+    variantes = {}
+    for nome, tamanho in VARIANTES.items():
+        copia = imagem.copy()
+        copia.thumbnail(tamanho, Image.Resampling.LANCZOS)
+        variantes[nome] = {}
+        for formato, (extensao, _, _) in FORMATOS.items():
+            variantes[nome][formato] = default_storage.save(
+                caminho_variante(foto.foto.name, nome, extensao), ContentFile(_codificar(copia, formato))
+            )
+    return largura, altura, variantes
+
+
+def processar_foto(foto_id):
+    """Processa uma foto já gravada; erros ficam no log e a foto continua a usar o original"""
+    foto = FotoCarro.objects.filter(pk=foto_id).first()
+    if foto is None or not foto.foto:
+        return False
+    try:
+        largura, altura, variantes = gerar_variantes(foto)
+    except Exception:
+        logger.exception('Falha ao gerar as variantes da foto %s', foto_id)
+        return False
+    # update() em vez de save(): não dispara sinais nem volta a agendar o processamento
+    FotoCarro.objects.filter(pk=foto_id).update(largura=largura, altura=altura, variantes=variantes)
+
+    # Ao reprocessar, as variantes anteriores registadas na foto que não foram
+    # regravadas com o mesmo nome (o storage pode ter escolhido outro) ficam órfãs
+    gravadas = {caminho for formatos in variantes.values() for caminho in formatos.values()}
+    obsoletas = {
+        nome: {formato: caminho for formato, caminho in formatos.items() if caminho not in gravadas}
+        for nome, formatos in (foto.variantes or {}).items()
+    }
+    if any(obsoletas.values()):
+        remover_variantes(obsoletas, foto.foto.name, foto_id)
+    return True
+
+
+def remover_variantes(variantes, nome_original=None, foto_id=None):
+    """Apaga do storage os ficheiros de variantes de uma foto removida ou reprocessada"""
+    partilhadas = FotoCarro.objects.filter(foto=nome_original).exclude(pk=foto_id)
+    if getattr(default_storage, 'deduplica', False) and partilhadas.exists():
+        # Com storage deduplicado, outra foto com o mesmo conteúdo partilha os ficheiros
+        return
+    for formatos in (variantes or {}).values():
+        for caminho in formatos.values():
+            try:
+                default_storage.delete(caminho)
+            except Exception:
+                logger.exception('Falha ao remover a variante %s', caminho)
+
+
+def _em_segundo_plano(funcao, *args):
+    try:
+        funcao(*args)
+    finally:
+        # Cada thread do executor abre a sua própria conexão ao banco
+        close_old_connections()
+
+
+def _executar(funcao, *args):
+    if getattr(settings, 'IMAGENS_PROCESSAMENTO_SINCRONO', False):
+        funcao(*args)
+    else:
+        _obter_executor().submit(_em_segundo_plano, funcao, *args)
+
+
+def agendar_processamento(foto_id):
+    """Processa a foto fora do ciclo do pedido, depois de a transação confirmar"""
+    transaction.on_commit(lambda: _executar(processar_foto, foto_id))
+
+
+def agendar_remocao(variantes, nome_original=None):
+    if variantes:
+        transaction.on_commit(lambda: _executar(remover_variantes, variantes, nome_original))
@@ -0,0 +1,404 @@
+import codecs
+import csv
+import io
+import os
+import re
+import unicodedata
+import zipfile
+import zlib
+from itertools import chain
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from apps.core.cache import ESTOQUE, invalidar
+from . import busca, referencias, semelhantes
+from .forms import validar_anos, validar_chassi
+from .models import Carro, MovimentacaoEstoque
+
+
+# Importação de estoque em lote (CSV ou XLSX), uma linha por carro.
+#
+# As linhas são lidas uma a uma do ficheiro e validadas com as regras do
+# cadastro (LinhaCarroForm). Marca/modelo, cor e opcionais são resolvidos pelo
+# nome, em mapas montados uma vez a partir das listas de referência em
+# memória, sem consultas por linha. As linhas válidas acumulam-se até LOTE:
+# a unicidade de chassi e matrícula do lote é então verificada em duas
+# consultas, e os carros, os seus opcionais e as movimentações de entrada
+# são inseridos com bulk_create numa transação por lote. Só o lote atual fica
+# em memória, além dos chassis e matrículas já aceites (para apanhar
+# repetições dentro do ficheiro).
+#
+# Linhas com erros não impedem as restantes: ficam no relatório, com o número
+# da linha no ficheiro, para serem corrigidas e importadas de novo.
+
+LOTE = 500
+
+# Bytes lidos de cada vez ao detetar a codificação de um CSV
+BLOCO_LEITURA = 64 * 1024
+
+# Erros do openpyxl com um ficheiro danificado: zip inválido ou incompleto,
+# partes em falta (KeyError) ou XML ilegível (ParseError é um SyntaxError)
+ERROS_XLSX = (zipfile.BadZipFile, zlib.error, EOFError, KeyError, ValueError, SyntaxError)
+
+CAMPOS_CARRO = (
+    'ano_fabricacao', 'ano_modelo', 'condicao', 'preco_venda', 'preco_aluguel_diario',
+    'quilometragem', 'combustivel', 'transmissao', 'motor', 'numero_portas',
+    'chassi', 'matricula', 'documento_unico', 'disponivel_venda', 'disponivel_aluguel',
+    'descricao', 'observacoes',
+)
+COLUNAS = ('marca', 'modelo', 'cor') + CAMPOS_CARRO + ('opcionais',)
+OBRIGATORIAS = (
+    'marca', 'modelo', 'cor', 'ano_fabricacao', 'ano_modelo', 'condicao',
+    'combustivel', 'transmissao', 'chassi', 'matricula',
+)
+
+VERDADEIROS = {'1', 'sim', 's', 'x', 'true', 'verdadeiro'}
+
+# Opções aceites pelo valor ("diesel") ou pelo rótulo ("Elétrico", "eletrico")
+ESCOLHAS = {
+    campo: {
+        chave: valor
+        for valor, rotulo in Carro._meta.get_field(campo).choices
+        for chave in (valor, rotulo.casefold())
+    }
+    for campo in ('condicao', 'combustivel', 'transmissao')
+}
+
+
+def _chave(texto):
+    """Nome comparável: sem acentos, minúsculas e espaços simples"""
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(letra for letra in texto if not unicodedata.combining(letra))
+    return ' '.join(texto.casefold().split())
+
+
+def _coluna(cabecalho):
+    return _chave(cabecalho or '').replace(' ', '_')
+
+
+def _texto(valor):
+    """Valor de uma célula como texto (o XLSX devolve números, booleanos e None)"""
+    if valor is None:
+        return ''
+    if isinstance(valor, bool):
+        return 'sim' if valor else 'não'
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor).strip()
+
+
+def _decimal(texto):
+    """'1 250 000,50' ou '1.250.000,50' -> '1250000.50'"""
+    texto = texto.replace(' ', '').replace('\xa0', '')
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    return texto
+
+
+def _colunas(cabecalho):
+    colunas = [_coluna(nome) for nome in cabecalho]
+    em_falta = [coluna for coluna in OBRIGATORIAS if coluna not in colunas]
+    if em_falta:
+        raise ValidationError(f'Colunas obrigatórias em falta: {", ".join(em_falta)}.')
+    return colunas
+
+
+def _codificacao(arquivo):
+    """utf-8-sig se o ficheiro inteiro for UTF-8 válido; senão cp1252, o que o Excel grava em português.
+
+    Lê o ficheiro uma vez em blocos (sem o ter todo em memória) e volta ao
+    início: decidir a meio da importação deixaria metade dos lotes gravados.
+    """
+    decodificador = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for bloco in iter(lambda: arquivo.read(BLOCO_LEITURA), b''):
+            decodificador.decode(bloco)
+        decodificador.decode(b'', final=True)
+        codificacao = 'utf-8-sig'
+    except UnicodeDecodeError:
+        codificacao = 'cp1252'
+    arquivo.seek(0)
+    return codificacao
+
+
+def ler_csv(arquivo):
+    """(número da linha, {coluna: valor}) de um CSV separado por vírgulas ou ponto e vírgula.
+
+    O cabeçalho é lido já aqui, para um ficheiro inválido ser recusado antes
+    de se gravar qualquer linha; as linhas seguem uma a uma.
+    """
+    # cp1252 deixa 5 bytes por definir: substituídos em vez de interromper a leitura
+    texto = io.TextIOWrapper(arquivo, encoding=_codificacao(arquivo), errors='replace', newline='')
+    primeira = texto.readline()
+    separador = ';' if primeira.count(';') > primeira.count(',') else ','
+    leitor = csv.reader(chain([primeira], texto), delimiter=separador)
+    try:
+        colunas = _colunas(next(leitor, []))
+    except csv.Error as erro:
+        raise ValidationError(f'Não foi possível ler o CSV: {erro}.')
+    return _linhas_csv(leitor, colunas)
+
+
+def _linhas_csv(leitor, colunas):
+    try:
+        for valores in leitor:
+            if any(valor.strip() for valor in valores):
+                yield leitor.line_num, dict(zip(colunas, valores))
+    except csv.Error as erro:
+        raise ValidationError(f'Não foi possível ler o CSV a partir da linha {leitor.line_num}: {erro}.')
+
+
+def ler_xlsx(arquivo):
+    """(número da linha, {coluna: valor}) da primeira folha, lida em modo de streaming"""
+    try:
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError:
+        raise ValidationError('A importação de XLSX requer o pacote openpyxl.')
+
+    try:
+        livro = load_workbook(arquivo, read_only=True, data_only=True)
+        linhas = livro.worksheets[0].iter_rows(values_only=True)
+        colunas = _colunas([_texto(valor) for valor in next(linhas, ())])
+    except (InvalidFileException, *ERROS_XLSX):
+        raise ValidationError('O ficheiro não é um XLSX válido ou está danificado.')
+    return _linhas_xlsx(livro, linhas, colunas)
+
+
+def _linhas_xlsx(livro, linhas, colunas):
+    numero = 1
+    try:
+        for numero, valores in enumerate(linhas, start=2):
+            valores = [_texto(valor) for valor in valores]
+            if any(valores):
+                yield numero, dict(zip(colunas, valores))
+    except ERROS_XLSX:
+        raise ValidationError(f'O XLSX está danificado a partir da linha {numero}.')
+    finally:
+        livro.close()
+
+
+def ler(arquivo, nome):
+    """Escolhe o leitor pela extensão do ficheiro"""
+    extensao = os.path.splitext(nome)[1].lower()
+    if extensao == '.csv':
+        return ler_csv(arquivo)
+    if extensao == '.xlsx':
+        return ler_xlsx(arquivo)
+    raise ValidationError('Formato não suportado: envie um ficheiro .csv ou .xlsx.')
+
+
+class MapasReferencias:
+    """Nomes de marca/modelo, cores e opcionais ativos -> ids, montados uma vez por importação"""
+
+    def __init__(self):
+        self.modelos = {
+            (_chave(modelo.marca.nome), _chave(modelo.nome)): modelo.pk
+            for modelo in referencias.modelos_ativos()
+        }
+        self.cores = {_chave(cor.nome): cor.pk for cor in referencias.cores_ativas()}
+        self.opcionais = {_chave(opcional.nome): opcional.pk for opcional in referencias.opcionais_ativos()}
+
+
+class LinhaCarroForm(forms.ModelForm):
+    """Uma linha do ficheiro: campos do Carro com as regras do cadastro e referências pelo nome"""
+
+    marca = forms.CharField(label='Marca')
+    modelo = forms.CharField(label='Modelo')
+    cor = forms.CharField(label='Cor')
+    opcionais = forms.CharField(label='Opcionais', required=False)
+    # Opcionais no modelo (blank=True), mas obrigatórios para identificar cada carro importado
+    chassi = forms.CharField(label='Chassi', max_length=17)
+    matricula = forms.CharField(label='Matrícula', max_length=15)
+
+    class Meta:
+        model = Carro
+        fields = CAMPOS_CARRO
+
+    def __init__(self, valores, mapas):
+        super().__init__(self._preparar(valores))
+        self.mapas = mapas
+
+    @staticmethod
+    def _preparar(valores):
+        dados = {coluna: _texto(valor) for coluna, valor in valores.items() if coluna in COLUNAS}
+        for campo, opcoes in ESCOLHAS.items():
+            dados[campo] = opcoes.get(_chave(dados.get(campo, '')), dados.get(campo, ''))
+        for campo in ('preco_venda', 'preco_aluguel_diario'):
+            dados[campo] = _decimal(dados.get(campo, ''))
+        dados['quilometragem'] = dados.get('quilometragem', '').replace(' ', '') or '0'
+        for campo in ('disponivel_venda', 'disponivel_aluguel'):
+            valor = _chave(dados.get(campo, ''))
+            dados[campo] = valor in VERDADEIROS if valor else Carro._meta.get_field(campo).default
+        return dados
+
+    def clean_chassi(self):
+        chassi = self.cleaned_data['chassi'].strip().upper()
+        validar_chassi(chassi)
+        return chassi
+
+    def clean_matricula(self):
+        return self.cleaned_data['matricula'].strip().upper()
+
+    def clean(self):
+        dados = super().clean()
+        if dados.get('marca') and dados.get('modelo'):
+            self.modelo_id = self.mapas.modelos.get((_chave(dados['marca']), _chave(dados['modelo'])))
+            if self.modelo_id is None:
+                self.add_error('modelo', f'"{dados["marca"]} {dados["modelo"]}" não existe ou está inativo.')
+        if dados.get('cor'):
+            self.cor_id = self.mapas.cores.get(_chave(dados['cor']))
+            if self.cor_id is None:
+                self.add_error('cor', f'"{dados["cor"]}" não existe ou está inativa.')
+
+        self.opcional_ids = []
+        for nome in re.split(r'[|,;]', dados.get('opcionais') or ''):
+            if nome.strip():
+                opcional_id = self.mapas.opcionais.get(_chave(nome))
+                if opcional_id is None:
+                    self.add_error('opcionais', f'"{nome.strip()}" não existe ou está inativo.')
+                else:
+                    self.opcional_ids.append(opcional_id)
+
+        try:
+            validar_anos(dados.get('ano_fabricacao'), dados.get('ano_modelo'))
+        except ValidationError as erro:
+            self.add_error('ano_fabricacao', erro)
+        return dados
+
+    def validate_unique(self):
+        # Chassi e matrícula são verificados por lote, em duas consultas (ver _gravar_lote)
+        pass
+
+    def carro(self):
+        carro = self.instance
+        carro.modelo_id, carro.cor_id = self.modelo_id, self.cor_id
+        return carro
+
+    def mensagens(self):
+        return [
+            f'{self.fields[campo].label}: {erro}' if campo in self.fields else erro
+            for campo, erros in self.errors.items()
+            for erro in erros
+        ]
+
+
+class ResultadoImportacao:
+    """Totais da importação e erros por linha do ficheiro"""
+
+    def __init__(self):
+        self.linhas = 0
+        self.importados = 0
+        self.ids = []
+        self.erros = []
+
+    def erro(self, linha, mensagens):
+        self.erros.append((linha, mensagens))
+
+    def escrever_erros(self, saida):
+        """Relatório de erros em CSV (linha; erros), para corrigir o ficheiro original"""
+        escritor = csv.writer(saida, delimiter=';')
+        escritor.writerow(['linha', 'erros'])
+        for linha, mensagens in self.erros:
+            escritor.writerow([linha, ' | '.join(mensagens)])
+
+
+def _ate_ao_erro(linhas, resultado):
+    """As linhas do leitor até ao fim ou até o ficheiro deixar de se poder ler.
+
+    Nesse caso o erro fica no relatório, na linha seguinte à última lida, e
+    as linhas anteriores são importadas como as de um ficheiro completo.
+    """
+    numero = 1
+    try:
+        for numero, valores in linhas:
+            yield numero, valores
+    except ValidationError as erro:
+        resultado.erro(numero + 1, erro.messages)
+
+
+def importar(linhas, funcionario, lote=LOTE, simular=False):
+    """Importa os carros de `linhas` (ver ler()); com `simular`, só valida.
+
+    Devolve um ResultadoImportacao.
+    """
+    mapas = MapasReferencias()
+    resultado = ResultadoImportacao()
+    aceites = {'chassi': set(), 'matricula': set()}
+    pendentes = []
+    for numero, valores in _ate_ao_erro(linhas, resultado):
+        resultado.linhas += 1
+        form = LinhaCarroForm(valores, mapas)
+        if not form.is_valid():
+            resultado.erro(numero, form.mensagens())
+            continue
+        pendentes.append((numero, form))
+        if len(pendentes) >= lote:
+            _gravar_lote(pendentes, funcionario, aceites, resultado, simular)
+            pendentes = []
+    if pendentes:
+        _gravar_lote(pendentes, funcionario, aceites, resultado, simular)
+
+    if resultado.ids:
+        # Semelhantes calculados uma vez para todos os carros novos (e os vizinhos afetados)
+        semelhantes.agendar(resultado.ids)
+        invalidar(ESTOQUE)
+    # Os erros de unicidade só aparecem quando o lote é gravado, depois dos
+    # erros de linhas seguintes: o relatório segue a ordem do ficheiro
+    resultado.erros.sort(key=lambda erro: erro[0])
+    return resultado
+
+
+def _gravar_lote(pendentes, funcionario, aceites, resultado, simular):
+    existentes = {
+        campo: set(Carro.objects.filter(**{f'{campo}__in': [
+            form.cleaned_data[campo] for _, form in pendentes
+        ]}).values_list(campo, flat=True))
+        for campo in aceites
+    }
+    validos = []
+    for numero, form in pendentes:
+        mensagens = []
+        for campo in aceites:
+            valor = form.cleaned_data[campo]
+            if valor in existentes[campo]:
+                mensagens.append(f'{form.fields[campo].label}: já existe um carro com "{valor}".')
+            elif valor in aceites[campo]:
+                mensagens.append(f'{form.fields[campo].label}: "{valor}" repetido no ficheiro.')
+        if mensagens:
+            resultado.erro(numero, mensagens)
+            continue
+        for campo in aceites:
+            aceites[campo].add(form.cleaned_data[campo])
+        validos.append((numero, form))
+
+    if simular or not validos:
+        resultado.importados += len(validos)
+        return
+
+    try:
+        with transaction.atomic():
+            carros = Carro.objects.bulk_create([form.carro() for _, form in validos])
+            Carro.opcionais.through.objects.bulk_create([
+                Carro.opcionais.through(carro_id=carro.pk, opcional_id=opcional_id)
+                for carro, (_, form) in zip(carros, validos)
+                for opcional_id in dict.fromkeys(form.opcional_ids)
+            ])
+            MovimentacaoEstoque.objects.bulk_create([
+                MovimentacaoEstoque(
+                    carro=carro, funcionario=funcionario, tipo_movimentacao='entrada',
+                    observacoes='Importação em lote',
+                )
+                for carro in carros
+            ])
+            # Sinais não correm no bulk_create: índice de busca do lote de uma vez
+            busca.indexar_carros([carro.pk for carro in carros])
+    except IntegrityError:
+        # Chassi ou matrícula gravados por outro utilizador entre a verificação e a inserção
+        for numero, _ in validos:
+            resultado.erro(numero, ['Lote não gravado: chassi ou matrícula registados entretanto. Importe de novo.'])
+        return
+    resultado.importados += len(carros)
+    resultado.ids.extend(carro.pk for carro in carros)
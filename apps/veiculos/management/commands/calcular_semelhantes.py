@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from apps.veiculos import semelhantes
+
+
+class Command(BaseCommand):
+    help = 'Recalcula do zero os carros semelhantes de todo o estoque disponível'
+
+    def handle(self, *args, **options):
+        total = semelhantes.recalcular_todos()
+        self.stdout.write(self.style.SUCCESS(
+            f'Semelhantes calculados para {total} carros ({semelhantes.TOTAL_SEMELHANTES} por carro).'
+        ))
@@ -0,0 +1,55 @@
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.usuarios.models import Funcionario
+from apps.veiculos import importacao
+
+
+class Command(BaseCommand):
+    help = 'Importa carros em lote de um ficheiro CSV ou XLSX (uma linha por carro)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Ficheiro .csv ou .xlsx com as colunas de importacao.COLUNAS')
+        parser.add_argument(
+            '--funcionario', type=int, required=True,
+            help='Id do funcionário responsável pelas movimentações de entrada',
+        )
+        parser.add_argument('--lote', type=int, default=importacao.LOTE, help='Carros inseridos por transação')
+        parser.add_argument('--simular', action='store_true', help='Só valida o ficheiro, sem gravar')
+        parser.add_argument('--erros', help='Grava o relatório de erros neste CSV')
+
+    def handle(self, *args, **options):
+        funcionario = Funcionario.objects.filter(pk=options['funcionario']).first()
+        if funcionario is None:
+            raise CommandError(f'Funcionário {options["funcionario"]} não existe.')
+
+        inicio = time.perf_counter()
+        try:
+            with open(options['arquivo'], 'rb') as arquivo:
+                resultado = importacao.importar(
+                    importacao.ler(arquivo, options['arquivo']), funcionario,
+                    lote=options['lote'], simular=options['simular'],
+                )
+        except OSError as erro:
+            raise CommandError(f'Não foi possível ler o ficheiro: {erro}')
+        except ValidationError as erro:
+            raise CommandError(' '.join(erro.messages))
+
+        acao = 'válidos (simulação, nada gravado)' if options['simular'] else 'importados'
+        self.stdout.write(self.style.SUCCESS(
+            f'{resultado.importados} de {resultado.linhas} carros {acao} em {time.perf_counter() - inicio:.2f}s.'
+        ))
+        if not resultado.erros:
+            return
+        if options['erros']:
+            with open(options['erros'], 'w', newline='', encoding='utf-8') as saida:
+                resultado.escrever_erros(saida)
+            self.stdout.write(self.style.WARNING(
+                f'{len(resultado.erros)} linhas com erros: relatório em {options["erros"]}'
+            ))
+        else:
+            self.stdout.write(self.style.WARNING(f'{len(resultado.erros)} linhas com erros:'))
+            for linha, mensagens in resultado.erros:
+                self.stdout.write(f'  linha {linha}: {"; ".join(mensagens)}')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from apps.veiculos import imagens
+from apps.veiculos.models import FotoCarro
+
+
+class Command(BaseCommand):
+    help = 'Gera as variantes (miniatura, cartão, galeria) das fotos dos carros'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todas', action='store_true',
+            help='Reprocessa também as fotos que já têm variantes'
+        )
+
+    def handle(self, *args, **options):
+        fotos = FotoCarro.objects.order_by('pk')
+        if not options['todas']:
+            fotos = fotos.filter(variantes={})
+
+        processadas = falhas = 0
+        for foto_id in fotos.values_list('pk', flat=True).iterator():
+            if imagens.processar_foto(foto_id):
+                processadas += 1
+            else:
+                falhas += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{processadas} fotos processadas.'))
+        if falhas:
+            self.stdout.write(self.style.WARNING(f'{falhas} fotos com erro (ver o log).'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.veiculos import busca
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói o índice de busca textual (FTS5) dos carros'
+
+    def handle(self, *args, **options):
+        if not busca.fts_disponivel():
+            self.stdout.write(self.style.WARNING('Busca textual FTS5 disponível apenas em SQLite.'))
+            return
+        total = busca.reconstruir_indice()
+        self.stdout.write(self.style.SUCCESS(f'{total} carros indexados.'))
@@ -0,0 +1,81 @@
+# Generated by Django 5.1.5 on 2026-10-17 00:25
+
+import apps.veiculos.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+CRIAR_INDICE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS carros_busca USING fts5(
+        marca, modelo, cor, descricao, opcionais, chassi, matricula,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+"""
+
+# Pesos do bm25 por coluna: marca e modelo valem mais que a descrição
+CONFIGURAR_RANK = """
+    INSERT INTO carros_busca(carros_busca, rank)
+    VALUES ('rank', 'bm25(10.0, 10.0, 3.0, 1.0, 2.0, 5.0, 5.0)')
+"""
+
+POPULAR_INDICE = """
+    INSERT INTO carros_busca (rowid, marca, modelo, cor, descricao, opcionais, chassi, matricula)
+    SELECT c.id, ma.nome, mo.nome, co.nome, c.descricao,
+           COALESCE((
+               SELECT group_concat(o.nome, ' ')
+               FROM carros_opcionais co2
+               JOIN opcional o ON o.id = co2.opcional_id
+               WHERE co2.carro_id = c.id
+           ), ''),
+           c.chassi, c.matricula
+    FROM carros c
+    JOIN modelos mo ON mo.id = c.modelo_id
+    JOIN marcas ma ON ma.id = mo.marca_id
+    JOIN cor co ON co.id = c.cor_id
+"""
+
+
+def criar_indice(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CRIAR_INDICE)
+    schema_editor.execute(CONFIGURAR_RANK)
+    schema_editor.execute(POPULAR_INDICE)
+
+
+def remover_indice(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS carros_busca')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veiculos', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndiceBuscaCarro',
+            fields=[
+                ('carro', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='indice_busca', serialize=False, to='veiculos.carro')),
+                ('marca', models.TextField(verbose_name='Marca')),
+                ('modelo', models.TextField(verbose_name='Modelo')),
+                ('cor', models.TextField(verbose_name='Cor')),
+                ('descricao', models.TextField(verbose_name='Descrição')),
+                ('opcionais', models.TextField(verbose_name='Opcionais')),
+                ('chassi', models.TextField(verbose_name='Chassi')),
+                ('matricula', models.TextField(verbose_name='Matrícula')),
+                ('documento', apps.veiculos.models.CampoBuscaTextual(db_column='carros_busca')),
+                ('rank', models.FloatField(verbose_name='Relevância')),
+            ],
+            options={
+                'verbose_name': 'Índice de Busca',
+                'verbose_name_plural': 'Índices de Busca',
+                'db_table': 'carros_busca',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(criar_indice, remover_indice),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.5 on 2026-10-17 00:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def preencher_foto_capa(apps, schema_editor):
+    Carro = apps.get_model('veiculos', 'Carro')
+    FotoCarro = apps.get_model('veiculos', 'FotoCarro')
+    capa = FotoCarro.objects.filter(
+        carro=OuterRef('pk')
+    ).order_by('-foto_principal', 'ordem', 'data_upload', 'id').values('id')[:1]
+    Carro.objects.update(foto_capa=Subquery(capa))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veiculos', '0003_indice_busca'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='carro',
+            name='foto_capa',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='veiculos.fotocarro', verbose_name='Foto de Capa'),
+        ),
+        migrations.RunPython(preencher_foto_capa, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.5 on 2026-10-17 00:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veiculos', '0004_carro_foto_capa'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carro',
+            index=models.Index(condition=models.Q(('disponivel_venda', True)), fields=['-data_entrada'], name='carro_venda_recentes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carro',
+            index=models.Index(condition=models.Q(('disponivel_venda', True)), fields=['preco_venda'], name='carro_venda_preco_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carro',
+            index=models.Index(condition=models.Q(('disponivel_venda', True)), fields=['ano_modelo'], name='carro_venda_ano_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carro',
+            index=models.Index(condition=models.Q(('disponivel_venda', True)), fields=['quilometragem'], name='carro_venda_km_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carro',
+            index=models.Index(fields=['-data_entrada'], name='carro_entrada_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='carro',
+            index=models.Index(fields=['condicao', 'combustivel'], name='carro_condicao_comb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fotocarro',
+            index=models.Index(fields=['carro', '-foto_principal', 'ordem', 'data_upload'], name='foto_carro_principal_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacaoestoque',
+            index=models.Index(fields=['carro', '-data_movimentacao'], name='movimentacao_carro_data_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-17 01:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veiculos', '0005_indices_catalogo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fotocarro',
+            name='altura',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Altura'),
+        ),
+        migrations.AddField(
+            model_name='fotocarro',
+            name='largura',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Largura'),
+        ),
+        migrations.AddField(
+            model_name='fotocarro',
+            name='variantes',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Versões redimensionadas geradas após o upload', verbose_name='Variantes'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.5 on 2026-10-17 02:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veiculos', '0006_fotocarro_variantes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CarroSemelhante',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posicao', models.PositiveSmallIntegerField(verbose_name='Posição')),
+                ('pontuacao', models.FloatField(verbose_name='Pontuação')),
+                ('carro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='semelhantes', to='veiculos.carro', verbose_name='Carro')),
+                ('semelhante', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='veiculos.carro', verbose_name='Carro Semelhante')),
+            ],
+            options={
+                'verbose_name': 'Carro Semelhante',
+                'verbose_name_plural': 'Carros Semelhantes',
+                'db_table': 'carros_semelhantes',
+                'ordering': ['carro', 'posicao'],
+                'constraints': [models.UniqueConstraint(fields=('carro', 'posicao'), name='carro_semelhante_posicao_unica')],
+            },
+        ),
+    ]
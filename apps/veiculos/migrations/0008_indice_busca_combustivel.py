@@ -0,0 +1,129 @@
+# Generated by Django 5.1.5 on 2026-10-17 03:40
+
+from django.db import migrations, models
+
+
+# Colunas novas numa tabela FTS5 obrigam a recriá-la. Os rótulos ficam
+# fixos aqui, como estavam ao criar a migração; reconstruir_indice() usa os
+# do modelo.
+
+COMBUSTIVEIS = (
+    ('gasolina', 'Gasolina'),
+    ('etanol', 'Etanol'),
+    ('flex', 'Flex'),
+    ('diesel', 'Diesel'),
+    ('eletrico', 'Elétrico'),
+    ('hibrido', 'Híbrido'),
+)
+
+TRANSMISSOES = (
+    ('manual', 'Manual'),
+    ('automatico', 'Automático'),
+    ('cvt', 'CVT'),
+    ('automatizado', 'Automatizado'),
+)
+
+
+def rotulo(coluna, choices):
+    casos = ' '.join(f"WHEN '{valor}' THEN '{texto}'" for valor, texto in choices)
+    return f'CASE {coluna} {casos} ELSE {coluna} END'
+
+
+CRIAR_INDICE = """
+    CREATE VIRTUAL TABLE carros_busca USING fts5(
+        marca, modelo, cor, descricao, opcionais, combustivel, transmissao, chassi, matricula,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+"""
+
+CONFIGURAR_RANK = """
+    INSERT INTO carros_busca(carros_busca, rank)
+    VALUES ('rank', 'bm25(10.0, 10.0, 3.0, 1.0, 2.0, 3.0, 3.0, 5.0, 5.0)')
+"""
+
+POPULAR_INDICE = f"""
+    INSERT INTO carros_busca
+        (rowid, marca, modelo, cor, descricao, opcionais, combustivel, transmissao, chassi, matricula)
+    SELECT c.id, ma.nome, mo.nome, co.nome, c.descricao,
+           COALESCE((
+               SELECT group_concat(o.nome, ' ')
+               FROM carros_opcionais co2
+               JOIN opcional o ON o.id = co2.opcional_id
+               WHERE co2.carro_id = c.id
+           ), ''),
+           {rotulo('c.combustivel', COMBUSTIVEIS)},
+           {rotulo('c.transmissao', TRANSMISSOES)},
+           c.chassi, c.matricula
+    FROM carros c
+    JOIN modelos mo ON mo.id = c.modelo_id
+    JOIN marcas ma ON ma.id = mo.marca_id
+    JOIN cor co ON co.id = c.cor_id
+"""
+
+# Reverter: o índice da 0003, sem combustível nem transmissão
+CRIAR_INDICE_ANTERIOR = """
+    CREATE VIRTUAL TABLE carros_busca USING fts5(
+        marca, modelo, cor, descricao, opcionais, chassi, matricula,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+"""
+
+CONFIGURAR_RANK_ANTERIOR = """
+    INSERT INTO carros_busca(carros_busca, rank)
+    VALUES ('rank', 'bm25(10.0, 10.0, 3.0, 1.0, 2.0, 5.0, 5.0)')
+"""
+
+POPULAR_INDICE_ANTERIOR = """
+    INSERT INTO carros_busca (rowid, marca, modelo, cor, descricao, opcionais, chassi, matricula)
+    SELECT c.id, ma.nome, mo.nome, co.nome, c.descricao,
+           COALESCE((
+               SELECT group_concat(o.nome, ' ')
+               FROM carros_opcionais co2
+               JOIN opcional o ON o.id = co2.opcional_id
+               WHERE co2.carro_id = c.id
+           ), ''),
+           c.chassi, c.matricula
+    FROM carros c
+    JOIN modelos mo ON mo.id = c.modelo_id
+    JOIN marcas ma ON ma.id = mo.marca_id
+    JOIN cor co ON co.id = c.cor_id
+"""
+
+
+def recriar(schema_editor, *comandos):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS carros_busca')
+    for comando in comandos:
+        schema_editor.execute(comando)
+
+
+def recriar_indice(apps, schema_editor):
+    recriar(schema_editor, CRIAR_INDICE, CONFIGURAR_RANK, POPULAR_INDICE)
+
+
+def restaurar_indice(apps, schema_editor):
+    recriar(schema_editor, CRIAR_INDICE_ANTERIOR, CONFIGURAR_RANK_ANTERIOR, POPULAR_INDICE_ANTERIOR)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veiculos', '0007_carrosemelhante'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indicebuscacarro',
+            name='combustivel',
+            field=models.TextField(default='', verbose_name='Combustível'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='indicebuscacarro',
+            name='transmissao',
+            field=models.TextField(default='', verbose_name='Transmissão'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(recriar_indice, restaurar_indice),
+    ]
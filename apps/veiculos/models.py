@@ -1,8 +1,10 @@
 import os
 import uuid
 from django.db import models
+from django.db.models import Lookup, Q
 from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from django.utils.functional import cached_property
 
 from apps.usuarios.models import Funcionario, Cliente
 from apps.alugueis.models import Aluguel
@@ -13,6 +15,21 @@ def carro_foto_path(instance, filename):
     filename = f'{uuid.uuid4().hex}.{ext}'
     return f'projectos/django/concessionaria/media/carros/fotos/{filename}'
     #return os.path.join('carros/fotos', filename)
+
+
+class CampoBuscaTextual(models.TextField):
+    """Coluna oculta de uma tabela FTS5, usada como operando esquerdo do MATCH"""
+
+
+@CampoBuscaTextual.register_lookup
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
     
 class Marca(models.Model):
     """Modelo para marcas de carros"""
@@ -320,6 +337,17 @@ class Carro(models.Model):
         help_text='Observações internas'
     )
     
+    # Foto exibida nas listagens (mantida por apps.veiculos.fotos.atualizar_foto_capa)
+    foto_capa = models.ForeignKey(
+        'FotoCarro',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Foto de Capa',
+        related_name='+'
+    )
+    
     # Campos de sistema
     data_entrada = models.DateTimeField('Data de Entrada', auto_now_add=True)
     data_atualizacao = models.DateTimeField('Data de Atualização', auto_now=True)
@@ -329,6 +357,16 @@ class Carro(models.Model):
         verbose_name = 'Carro'
         verbose_name_plural = 'Carros'
         ordering = ['-data_entrada']
+        indexes = [
+            # Catálogo público: sempre filtra disponivel_venda e ordena por um destes campos
+            models.Index(fields=['-data_entrada'], condition=Q(disponivel_venda=True), name='carro_venda_recentes_idx'),
+            models.Index(fields=['preco_venda'], condition=Q(disponivel_venda=True), name='carro_venda_preco_idx'),
+            models.Index(fields=['ano_modelo'], condition=Q(disponivel_venda=True), name='carro_venda_ano_idx'),
+            models.Index(fields=['quilometragem'], condition=Q(disponivel_venda=True), name='carro_venda_km_idx'),
+            # Administração: listagem por data de entrada e filtros por condição/combustível
+            models.Index(fields=['-data_entrada'], name='carro_entrada_idx'),
+            models.Index(fields=['condicao', 'combustivel'], name='carro_condicao_comb_idx'),
+        ]
     
     def __str__(self):
         return f"{self.modelo} {self.ano_modelo} - {self.cor}"
@@ -375,14 +413,46 @@ class FotoCarro(models.Model):
     
     data_upload = models.DateTimeField('Data de Upload', auto_now_add=True)
     
+    largura = models.PositiveIntegerField('Largura', null=True, blank=True, editable=False)
+    
+    altura = models.PositiveIntegerField('Altura', null=True, blank=True, editable=False)
+    
+    variantes = models.JSONField(
+        'Variantes',
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text='Versões redimensionadas geradas após o upload'
+    )
+    
     class Meta:
         db_table = 'foto_carro'
         verbose_name = 'Foto do Carro'
         verbose_name_plural = 'Fotos dos Carros'
         ordering = ['ordem', 'data_upload']
+        indexes = [
+            # Mesma ordem usada para escolher a foto de capa (principal primeiro, depois a ordem)
+            models.Index(fields=['carro', '-foto_principal', 'ordem', 'data_upload'], name='foto_carro_principal_idx'),
+        ]
     
     def __str__(self):
         return f"Foto {self.ordem} - {self.carro}"
+    
+    def url_variante(self, nome, formato='jpeg'):
+        """URL de uma variante; enquanto não for gerada, usa a foto original (só em JPEG)"""
+        caminho = self.variantes.get(nome, {}).get(formato)
+        if caminho:
+            return self.foto.storage.url(caminho)
+        return self.foto.url if formato == 'jpeg' else ''
+    
+    @cached_property
+    def urls(self):
+        """Acesso às variantes nos templates: {{ foto.urls.cartao.webp }}"""
+        from .imagens import VARIANTES, FORMATOS
+        return {
+            nome: {formato: self.url_variante(nome, formato) for formato in FORMATOS}
+            for nome in VARIANTES
+        }
 
 class MovimentacaoEstoque(models.Model):
     """Modelo para controle de movimentação de estoque de carros"""
@@ -445,6 +515,9 @@ class MovimentacaoEstoque(models.Model):
         verbose_name = 'Movimentação de Estoque'
         verbose_name_plural = 'Movimentações de Estoque'
         ordering = ['-data_movimentacao']
+        indexes = [
+            models.Index(fields=['carro', '-data_movimentacao'], name='movimentacao_carro_data_idx'),
+        ]
     
     def __str__(self):
         return f"{self.get_tipo_movimentacao_display()} - {self.carro} - {self.data_movimentacao.strftime('%d/%m/%Y')}"
@@ -571,3 +644,72 @@ class Manutencao(models.Model):
 
     def __str__(self):
         return f'{self.get_tipo_manutencao_display()} - {self.carro} - {self.data_manutencao}'
+
+
+class IndiceBuscaCarro(models.Model):
+    """Índice de busca textual dos carros (tabela virtual FTS5, mantida em apps.veiculos.busca)"""
+    
+    carro = models.OneToOneField(
+        Carro,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        related_name='indice_busca'
+    )
+    
+    marca = models.TextField('Marca')
+    modelo = models.TextField('Modelo')
+    cor = models.TextField('Cor')
+    descricao = models.TextField('Descrição')
+    opcionais = models.TextField('Opcionais')
+    combustivel = models.TextField('Combustível')
+    transmissao = models.TextField('Transmissão')
+    chassi = models.TextField('Chassi')
+    matricula = models.TextField('Matrícula')
+    
+    # Colunas ocultas do FTS5: a própria tabela (alvo do MATCH) e a relevância (bm25)
+    documento = CampoBuscaTextual(db_column='carros_busca')
+    rank = models.FloatField('Relevância')
+    
+    class Meta:
+        managed = False
+        db_table = 'carros_busca'
+        verbose_name = 'Índice de Busca'
+        verbose_name_plural = 'Índices de Busca'
+    
+    def __str__(self):
+        return f"Índice - {self.carro_id}"
+
+
+class CarroSemelhante(models.Model):
+    """Carros mais parecidos com cada carro, pré-calculados pelo motor de semelhança"""
+    
+    carro = models.ForeignKey(
+        Carro,
+        on_delete=models.CASCADE,
+        related_name='semelhantes',
+        verbose_name='Carro'
+    )
+    
+    semelhante = models.ForeignKey(
+        Carro,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Carro Semelhante'
+    )
+    
+    posicao = models.PositiveSmallIntegerField('Posição')
+    pontuacao = models.FloatField('Pontuação')
+    
+    class Meta:
+        db_table = 'carros_semelhantes'
+        verbose_name = 'Carro Semelhante'
+        verbose_name_plural = 'Carros Semelhantes'
+        ordering = ['carro', 'posicao']
+        constraints = [
+            # Também é o índice da leitura na página de detalhe
+            models.UniqueConstraint(fields=['carro', 'posicao'], name='carro_semelhante_posicao_unica'),
+        ]
+    
+    def __str__(self):
+        return f"{self.carro} ~ {self.semelhante} ({self.pontuacao:.2f})"
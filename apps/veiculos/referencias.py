@@ -0,0 +1,127 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.forms.models import ModelChoiceIterator
+
+from apps.core.cache import REFERENCIAS, versao
+from .models import Marca, Modelo, Cor, Opcional
+
+
+# Tabelas de referência (marcas, modelos, cores, opcionais) guardadas na memória do processo.
+#
+# Cada lista fica associada à versão do namespace REFERENCIAS, que os sinais
+# incrementam ao gravar ou apagar uma Marca, Modelo, Cor ou Opcional. Com um
+# cache partilhado (CACHE_BACKEND=arquivo) a versão é comum a todos os
+# processos, e uma alteração feita num worker invalida as listas dos outros no
+# pedido seguinte. Com o cache em memória local cada processo tem a sua versão;
+# REFERENCIAS_VALIDADE limita então o tempo em que outro processo pode servir
+# uma lista desatualizada.
+#
+# Os objetos devolvidos são partilhados entre pedidos e threads: não devem ser
+# alterados (use copy.copy() para anotar valores específicos de um pedido).
+
+_memoria = {}
+_lock = threading.Lock()
+
+
+def _obter(nome, carregar):
+    atual = versao(REFERENCIAS)
+    agora = time.monotonic()
+    entrada = _memoria.get(nome)
+    if entrada is not None:
+        versao_entrada, expira, valor = entrada
+        if versao_entrada == atual and agora < expira:
+            return valor
+
+    valor = carregar()
+    with _lock:
+        _memoria[nome] = (atual, agora + settings.REFERENCIAS_VALIDADE, valor)
+    return valor
+
+
+def limpar():
+    """Descarta as listas deste processo (a próxima leitura volta ao banco)"""
+    with _lock:
+        _memoria.clear()
+
+
+def marcas_ativas():
+    return _obter('marcas', lambda: tuple(Marca.objects.filter(ativo=True).order_by('nome')))
+
+
+def modelos_ativos():
+    """Modelos ativos de marcas ativas, com a marca já carregada"""
+    return _obter('modelos', lambda: tuple(
+        Modelo.objects.filter(ativo=True, marca__ativo=True)
+        .select_related('marca')
+        .order_by('marca__nome', 'nome')
+    ))
+
+
+def cores_ativas():
+    return _obter('cores', lambda: tuple(Cor.objects.filter(ativo=True).order_by('nome')))
+
+
+def opcionais_ativos():
+    return _obter('opcionais', lambda: tuple(Opcional.objects.filter(ativo=True)))
+
+
+class CatalogoModelos:
+    """Modelos ativos agrupados por marca, com as respostas JSON já serializadas.
+
+    O ETag é o hash do conteúdo: processos diferentes com os mesmos dados
+    respondem com o mesmo ETag, mesmo que as suas versões locais difiram.
+    Não há Last-Modified: a hora em que cada processo montou o catálogo não
+    diz quando os modelos mudaram, e o Modelo não guarda a data de alteração.
+    """
+
+    VAZIO = b'{"modelos": []}'
+
+    def __init__(self, modelos):
+        mapa = {}
+        for modelo in modelos:
+            mapa.setdefault(modelo.marca_id, []).append({'id': modelo.pk, 'nome': modelo.nome})
+        self.mapa = mapa
+        self.json_todas = json.dumps(
+            {'marcas': {str(marca_id): lista for marca_id, lista in mapa.items()}}
+        ).encode()
+        self._json_por_marca = {
+            marca_id: json.dumps({'modelos': lista}).encode() for marca_id, lista in mapa.items()
+        }
+        self.etag = hashlib.md5(self.json_todas, usedforsecurity=False).hexdigest()
+
+    def json_marca(self, marca_id):
+        return self._json_por_marca.get(marca_id, self.VAZIO)
+
+
+def catalogo_modelos():
+    return _obter('catalogo_modelos', lambda: CatalogoModelos(modelos_ativos()))
+
+
+class _IteradorReferencias(ModelChoiceIterator):
+    """Percorre as opções a partir da lista em memória em vez de consultar o queryset"""
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for obj in self.field.objetos_referencia:
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.objetos_referencia) + (1 if self.field.empty_label is not None else 0)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.objetos_referencia)
+
+
+def usar_referencias(campo, queryset, objetos):
+    """Configura um ModelChoiceField para desenhar as opções a partir da memória.
+
+    O queryset continua a ser usado na validação do valor enviado.
+    """
+    campo.objetos_referencia = objetos
+    campo.iterator = _IteradorReferencias
+    campo.queryset = queryset
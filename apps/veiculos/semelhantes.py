@@ -0,0 +1,309 @@
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Min, Q
+
+from apps.core.cache import ESTOQUE, invalidar
+from .models import Carro, CarroSemelhante
+
+
+logger = logging.getLogger(__name__)
+
+# Quantos semelhantes são guardados (e mostrados) por carro
+TOTAL_SEMELHANTES = 4
+
+# Peso de cada critério na pontuação final (normalizada para 0..1)
+PESOS = {
+    'preco': 3.0,
+    'ano': 2.0,
+    'quilometragem': 1.5,
+    'categoria': 2.5,
+    'combustivel': 1.0,
+    'transmissao': 1.0,
+    'opcionais': 1.0,
+}
+
+# Diferença que reduz a semelhança de um critério contínuo para ~37% (exp(-1)).
+# Preço e quilometragem comparam-se em escala logarítmica: 0.25 ~ 28% de diferença.
+ESCALAS = {
+    'preco': 0.25,
+    'ano': 3.0,
+    'quilometragem': 0.6,
+}
+
+# Linhas pontuadas de cada vez: limita a memória a BLOCO x total de carros
+BLOCO = 256
+
+# Ids por consulta nos filtros __in, abaixo do limite de parâmetros do SQLite
+TAMANHO_LOTE = 500
+
+_local = threading.local()
+
+# Atualizações à espera da thread de cálculo, de todos os pedidos do processo
+_pendentes = set()
+_pendentes_lock = threading.Lock()
+_agendado = False
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class MatrizCarros:
+    """Características dos carros disponíveis, em vetores NumPy alinhados pelo índice"""
+
+    def __init__(self):
+        linhas = list(
+            Carro.objects.filter(Q(disponivel_venda=True) | Q(disponivel_aluguel=True))
+            .order_by('id')
+            .values_list(
+                'id', 'preco_venda', 'ano_modelo', 'quilometragem',
+                'modelo__categoria', 'combustivel', 'transmissao',
+            )
+        )
+        self.ids = np.array([linha[0] for linha in linhas], dtype=np.int64)
+        self.indice = {carro_id: posicao for posicao, carro_id in enumerate(self.ids.tolist())}
+
+        # Sem preço de venda (só aluguel): o critério de preço não conta para esse carro
+        self.preco = np.array(
+            [np.log(float(linha[1])) if linha[1] else np.nan for linha in linhas], dtype=np.float32
+        )
+        self.ano = np.array([linha[2] for linha in linhas], dtype=np.float32)
+        self.quilometragem = np.log1p(np.array([linha[3] for linha in linhas], dtype=np.float32))
+
+        # Critérios por igualdade como blocos one-hot: um produto matricial soma os pesos dos iguais
+        blocos, pesos = [], []
+        for nome, coluna in (('categoria', 4), ('combustivel', 5), ('transmissao', 6)):
+            bloco = self._one_hot([linha[coluna] for linha in linhas])
+            blocos.append(bloco)
+            pesos.append(bloco * PESOS[nome])
+        self.categorias = np.hstack(blocos) if linhas else np.zeros((0, 0), dtype=np.float32)
+        self.categorias_pesadas = np.hstack(pesos) if linhas else self.categorias
+
+        # Opcionais como matriz 0/1 (carros x opcionais) para a interseção num produto matricial
+        pares = list(
+            Carro.opcionais.through.objects.filter(
+                Q(carro__disponivel_venda=True) | Q(carro__disponivel_aluguel=True)
+            ).values_list('carro_id', 'opcional_id')
+        ) if linhas else []
+        colunas = {opcional_id: n for n, opcional_id in enumerate(sorted({o for _, o in pares}))}
+        self.opcionais = np.zeros((len(linhas), len(colunas)), dtype=np.float32)
+        for carro_id, opcional_id in pares:
+            self.opcionais[self.indice[carro_id], colunas[opcional_id]] = 1.0
+        self.total_opcionais = self.opcionais.sum(axis=1)
+
+    @staticmethod
+    def _one_hot(valores):
+        distintos, codigos = np.unique(np.array(valores, dtype=object).astype(str), return_inverse=True)
+        matriz = np.zeros((len(valores), len(distintos)), dtype=np.float32)
+        matriz[np.arange(len(valores)), codigos] = 1.0
+        return matriz
+
+    def __len__(self):
+        return len(self.ids)
+
+    def pontuar(self, linhas):
+        """Pontuações (len(linhas) x total de carros) entre os carros indicados e todos os outros"""
+        linhas = np.asarray(linhas, dtype=np.int64)
+        pontuacoes = np.zeros((len(linhas), len(self)), dtype=np.float32)
+        # Operações no próprio buffer: evitam uma cópia da matriz por passo
+        buffer = np.empty_like(pontuacoes)
+
+        for nome in ('preco', 'ano', 'quilometragem'):
+            valores = getattr(self, nome)
+            np.subtract(valores[linhas, None], valores[None, :], out=buffer)
+            np.abs(buffer, out=buffer)
+            buffer *= -1 / ESCALAS[nome]
+            np.exp(buffer, out=buffer)
+            if nome == 'preco':
+                # Sem preço de venda (NaN) o critério vale zero
+                np.copyto(buffer, 0, where=np.isnan(buffer))
+            buffer *= PESOS[nome]
+            pontuacoes += buffer
+
+        pontuacoes += self.categorias_pesadas[linhas] @ self.categorias.T
+
+        if self.opcionais.shape[1]:
+            # Índice de Jaccard: opcionais em comum / opcionais de um ou de outro
+            comuns = self.opcionais[linhas] @ self.opcionais.T
+            np.add(self.total_opcionais[linhas, None], self.total_opcionais[None, :], out=buffer)
+            buffer -= comuns
+            np.divide(comuns, buffer, out=comuns, where=buffer > 0)
+            comuns *= PESOS['opcionais']
+            pontuacoes += comuns
+
+        pontuacoes /= sum(PESOS.values())
+        # Um carro nunca é semelhante a si próprio
+        pontuacoes[np.arange(len(linhas)), linhas] = -np.inf
+        return pontuacoes
+
+    def mais_semelhantes(self, linhas, total=TOTAL_SEMELHANTES):
+        """{carro_id: [(semelhante_id, pontuacao), ...]} com os melhores de cada carro, por ordem.
+
+        No empate ganha o carro mais antigo (menor id), para o resultado não
+        depender da ordem em que as linhas são calculadas.
+        """
+        resultado = {}
+        total = min(total, len(self) - 1)
+        linhas = list(linhas)
+        for inicio in range(0, len(linhas), BLOCO):
+            bloco = linhas[inicio:inicio + BLOCO]
+            if total <= 0:
+                resultado.update((int(self.ids[linha]), []) for linha in bloco)
+                continue
+            pontuacoes = self.pontuar(bloco)
+            # Pontuação do k-ésimo melhor de cada linha; todos os que a igualam são candidatos
+            limiar = -np.partition(-pontuacoes, total - 1, axis=1)[:, total - 1]
+            candidatas, colunas = np.nonzero(pontuacoes >= limiar[:, None])
+            inicios = np.searchsorted(candidatas, np.arange(len(bloco) + 1))
+            for n, linha in enumerate(bloco):
+                # nonzero devolve as colunas por ordem crescente, isto é, por id
+                cols = colunas[inicios[n]:inicios[n + 1]]
+                valores = pontuacoes[n, cols]
+                ordem = np.argsort(-valores, kind='stable')[:total]
+                resultado[int(self.ids[linha])] = [
+                    (int(self.ids[coluna]), float(valor))
+                    for coluna, valor in zip(cols[ordem].tolist(), valores[ordem].tolist())
+                ]
+        return resultado
+
+
+def _lotes(ids):
+    ids = list(ids)
+    for inicio in range(0, len(ids), TAMANHO_LOTE):
+        yield ids[inicio:inicio + TAMANHO_LOTE]
+
+
+def _gravar(semelhantes, carro_ids=None):
+    """Substitui as listas dos carros indicados (todas, se None) pelas calculadas"""
+    with transaction.atomic():
+        if carro_ids is None:
+            CarroSemelhante.objects.all().delete()
+        else:
+            for lote in _lotes(carro_ids):
+                CarroSemelhante.objects.filter(carro_id__in=lote).delete()
+        CarroSemelhante.objects.bulk_create([
+            CarroSemelhante(carro_id=carro_id, semelhante_id=semelhante_id, posicao=posicao, pontuacao=pontuacao)
+            for carro_id, lista in semelhantes.items()
+            for posicao, (semelhante_id, pontuacao) in enumerate(lista, 1)
+        ], batch_size=1000)
+    invalidar(ESTOQUE)
+
+
+def recalcular_todos():
+    """Recalcula do zero os semelhantes de todos os carros; devolve o número de carros"""
+    matriz = MatrizCarros()
+    _gravar(matriz.mais_semelhantes(range(len(matriz))))
+    return len(matriz)
+
+
+def atualizar(carro_ids):
+    """Atualiza os semelhantes depois de os carros indicados mudarem (ou saírem do estoque).
+
+    Recalcula as listas dos próprios carros e só as dos outros carros que
+    podem ter mudado: os que tinham um dos alterados na lista e aqueles para
+    quem um alterado passa a pontuar acima do pior semelhante guardado.
+    """
+    carro_ids = set(carro_ids)
+    if not carro_ids:
+        return 0
+    matriz = MatrizCarros()
+    alterados = [matriz.indice[carro_id] for carro_id in carro_ids if carro_id in matriz.indice]
+
+    afetados = set(alterados)
+    for lote in _lotes(carro_ids):
+        afetados.update(
+            matriz.indice[carro_id]
+            for carro_id in CarroSemelhante.objects.filter(semelhante_id__in=lote)
+            .values_list('carro_id', flat=True)
+            if carro_id in matriz.indice
+        )
+    if alterados:
+        # A pontuação é simétrica: a coluna de cada alterado é a sua linha
+        melhor = np.full(len(matriz), -np.inf, dtype=np.float32)
+        for inicio in range(0, len(alterados), BLOCO):
+            melhor = np.maximum(melhor, matriz.pontuar(alterados[inicio:inicio + BLOCO]).max(axis=0))
+
+        guardados = {
+            linha['carro_id']: (linha['total'], linha['pior'])
+            for linha in CarroSemelhante.objects.values('carro_id').annotate(
+                total=Count('id'), pior=Min('pontuacao')
+            )
+        }
+        completo = min(TOTAL_SEMELHANTES, len(matriz) - 1)
+        for posicao, carro_id in enumerate(matriz.ids.tolist()):
+            total, pior = guardados.get(carro_id, (0, None))
+            # Empatar com o pior também conta: o desempate por id pode trocar a lista
+            if total < completo or (pior is not None and melhor[posicao] >= pior):
+                afetados.add(posicao)
+
+    semelhantes = matriz.mais_semelhantes(sorted(afetados))
+    # Carros que deixaram de estar disponíveis ficam sem lista
+    _gravar(semelhantes, set(semelhantes) | carro_ids)
+    return len(semelhantes)
+
+
+def _calcular_pendentes():
+    """Corre na thread de cálculo: junta tudo o que foi pedido entretanto num único atualizar()"""
+    global _agendado
+    try:
+        while True:
+            with _pendentes_lock:
+                carro_ids = set(_pendentes)
+                _pendentes.clear()
+                if not carro_ids:
+                    _agendado = False
+                    return
+            try:
+                atualizar(carro_ids)
+            except Exception:
+                logger.exception('Falha ao atualizar os carros semelhantes de %s', sorted(carro_ids))
+    finally:
+        if not settings.SEMELHANTES_PROCESSAMENTO_SINCRONO:
+            # A thread de cálculo abre a sua própria conexão ao banco
+            close_old_connections()
+
+
+def _obter_executor():
+    global _executor
+    # Com o lock, dois pedidos no arranque não criam dois executores (e duas threads a gravar)
+    with _executor_lock:
+        if _executor is None:
+            # Uma só thread: as atualizações nunca gravam as listas ao mesmo tempo
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='semelhantes')
+        return _executor
+
+
+def _processar_pendentes():
+    global _agendado
+    carro_ids = getattr(_local, 'pendentes', set())
+    _local.pendentes = set()
+    if not carro_ids:
+        return
+    with _pendentes_lock:
+        _pendentes.update(carro_ids)
+        if _agendado:
+            return
+        _agendado = True
+    if settings.SEMELHANTES_PROCESSAMENTO_SINCRONO:
+        _calcular_pendentes()
+    else:
+        _obter_executor().submit(_calcular_pendentes)
+
+
+def agendar(carro_ids):
+    """Atualiza os semelhantes depois de a transação confirmar, fora do ciclo do pedido.
+
+    Várias alterações na mesma transação são juntas num único cálculo, feito
+    numa thread à parte; o que chegar enquanto ela calcula entra no cálculo
+    seguinte. Os ids ficam numa lista da thread: se a transação for
+    desfeita, são recalculados no commit seguinte, o que não tem efeito além
+    do custo.
+    """
+    if not hasattr(_local, 'pendentes'):
+        _local.pendentes = set()
+    _local.pendentes.update(carro_ids)
+    transaction.on_commit(_processar_pendentes)
@@ -0,0 +1,129 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from apps.core.cache import ESTOQUE, REFERENCIAS, invalidar
+from .models import Carro, Marca, Modelo, Cor, Opcional, FotoCarro
+from .fotos import atualizar_foto_capa
+from . import busca, imagens, semelhantes
+
+
+# Índice de busca textual
+@receiver(post_save, sender=Carro)
+def indexar_carro(sender, instance, raw=False, **kwargs):
+    """Mantém o índice de busca em dia após criar/editar um carro"""
+    if not raw:
+        busca.indexar_carros([instance.pk])
+
+
+@receiver(post_delete, sender=Carro)
+def remover_carro_do_indice(sender, instance, **kwargs):
+    """Remove o carro apagado do índice de busca"""
+    busca.remover_carros([instance.pk])
+
+
+@receiver(m2m_changed, sender=Carro.opcionais.through)
+def reindexar_opcionais(sender, instance, action, reverse, pk_set, **kwargs):
+    """Reindexa quando os opcionais de um carro mudam (por qualquer dos lados da relação)"""
+    if action == 'pre_clear' and reverse:
+        # Guardar os carros afetados antes de a relação ser limpa
+        instance._carros_afetados = list(instance.carros.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        busca.indexar_carros(pk_set if reverse else [instance.pk])
+    elif action == 'post_clear':
+        busca.indexar_carros(getattr(instance, '_carros_afetados', []) if reverse else [instance.pk])
+
+
+@receiver(post_save, sender=Marca)
+@receiver(post_save, sender=Modelo)
+@receiver(post_save, sender=Cor)
+@receiver(post_save, sender=Opcional)
+def reindexar_referencias(sender, instance, created, raw=False, **kwargs):
+    """Um nome alterado em Marca/Modelo/Cor/Opcional muda o texto indexado dos seus carros"""
+    if created or raw:
+        return
+    filtros = {
+        Marca: 'modelo__marca',
+        Modelo: 'modelo',
+        Cor: 'cor',
+        Opcional: 'opcionais',
+    }
+    ids = Carro.objects.filter(**{filtros[sender]: instance}).values_list('id', flat=True)
+    busca.indexar_carros(ids)
+
+
+# Foto de capa desnormalizada
+@receiver(post_save, sender=FotoCarro)
+@receiver(post_delete, sender=FotoCarro)
+def atualizar_capa_do_carro(sender, instance, raw=False, **kwargs):
+    """Qualquer foto criada, editada ou removida pode mudar a capa do seu carro"""
+    if not raw:
+        atualizar_foto_capa([instance.carro_id])
+
+
+# Caches que dependem do estoque (página inicial, etc.)
+@receiver(post_save, sender=Carro)
+@receiver(post_delete, sender=Carro)
+@receiver(post_save, sender=Marca)
+@receiver(post_delete, sender=Marca)
+@receiver(post_save, sender=Modelo)
+@receiver(post_delete, sender=Modelo)
+@receiver(post_save, sender=Cor)
+@receiver(post_delete, sender=Cor)
+@receiver(post_save, sender=FotoCarro)
+@receiver(post_delete, sender=FotoCarro)
+def invalidar_cache_estoque(sender, **kwargs):
+    """Qualquer alteração no estoque torna obsoletos os dados em cache derivados dele"""
+    invalidar(ESTOQUE)
+
+
+@receiver(post_save, sender=Marca)
+@receiver(post_delete, sender=Marca)
+@receiver(post_save, sender=Modelo)
+@receiver(post_delete, sender=Modelo)
+@receiver(post_save, sender=Cor)
+@receiver(post_delete, sender=Cor)
+@receiver(post_save, sender=Opcional)
+@receiver(post_delete, sender=Opcional)
+def invalidar_cache_referencias(sender, **kwargs):
+    """Listas de referência em memória (marcas, modelos, cores, opcionais) ficam obsoletas em todos os processos"""
+    invalidar(REFERENCIAS)
+
+
+# Variantes das fotos (miniatura, cartão, galeria)
+@receiver(post_save, sender=FotoCarro)
+def processar_foto_enviada(sender, instance, created, raw=False, **kwargs):
+    """Gera as variantes em segundo plano para não atrasar a resposta do upload"""
+    if created and not raw:
+        imagens.agendar_processamento(instance.pk)
+
+
+@receiver(post_delete, sender=FotoCarro)
+def remover_variantes_da_foto(sender, instance, **kwargs):
+    imagens.agendar_remocao(instance.variantes, instance.foto.name)
+
+
+# Carros semelhantes pré-calculados
+@receiver(post_save, sender=Carro)
+@receiver(post_delete, sender=Carro)
+def atualizar_semelhantes_do_carro(sender, instance, raw=False, **kwargs):
+    """Preço, ano, disponibilidade, etc. mudam as listas do carro e dos seus vizinhos"""
+    if not raw:
+        semelhantes.agendar([instance.pk])
+
+
+@receiver(m2m_changed, sender=Carro.opcionais.through)
+def atualizar_semelhantes_por_opcionais(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            semelhantes.agendar([instance.pk])
+        elif action == 'post_clear':
+            semelhantes.agendar(getattr(instance, '_carros_afetados', []))
+        else:
+            semelhantes.agendar(pk_set)
+
+
+@receiver(post_save, sender=Modelo)
+def atualizar_semelhantes_por_categoria(sender, instance, created, raw=False, **kwargs):
+    """A categoria vem do modelo: alterá-lo muda a pontuação de todos os seus carros"""
+    if not created and not raw:
+        semelhantes.agendar(Carro.objects.filter(modelo=instance).values_list('id', flat=True))
@@ -1,3 +1,839 @@
-from django.test import TestCase
+import csv
+import posixpath
+import shutil
+import tempfile
+import threading
+import zipfile
+from decimal import Decimal
+from importlib.util import find_spec
+from io import BytesIO, StringIO
+from unittest import skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings, skipUnlessDBFeature
+from django.urls import reverse
+from PIL import Image
+
+from apps.alugueis.models import Aluguel
+from apps.core.cache import REFERENCIAS, invalidar
+from . import busca, imagens, importacao, referencias, semelhantes
+from .forms import CarroRegistroForm
+from .fotos import atualizar_foto_capa
+from .models import Carro, CarroSemelhante, Marca, Modelo, Cor, Opcional, FotoCarro, MovimentacaoEstoque
+
+
+@skipUnlessDBFeature('supports_partial_indexes')
+class IndicesCatalogoTests(TestCase):
+    """Garante que as consultas do catálogo e da administração usam os índices criados"""
+
+    @classmethod
+    def setUpTestData(cls):
+        marca = Marca.objects.create(nome='Toyota')
+        modelo = Modelo.objects.create(marca=marca, nome='Corolla', categoria='sedan')
+        cor = Cor.objects.create(nome='Branco')
+        Carro.objects.bulk_create([
+            Carro(
+                modelo=modelo, cor=cor, ano_fabricacao=2015 + i % 8, ano_modelo=2015 + i % 8,
+                condicao='novo' if i % 2 else 'usado', combustivel='gasolina', transmissao='manual',
+                preco_venda=1000000 + i, quilometragem=i * 100, disponivel_venda=bool(i % 3),
+                chassi=f'{i:017d}', matricula=f'LD-{i:05d}',
+            )
+            for i in range(50)
+        ])
+
+    def plano(self, queryset):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN é específico do SQLite')
+        return queryset.explain()
+
+    def test_catalogo_usa_indices_parciais(self):
+        disponiveis = Carro.objects.filter(disponivel_venda=True)
+        casos = {
+            '-data_entrada': 'carro_venda_recentes_idx',
+            'preco_venda': 'carro_venda_preco_idx',
+            'ano_modelo': 'carro_venda_ano_idx',
+            'quilometragem': 'carro_venda_km_idx',
+        }
+        for ordem, indice in casos.items():
+            with self.subTest(ordem=ordem):
+                plano = self.plano(disponiveis.order_by(ordem)[:12])
+                self.assertIn(indice, plano)
+                self.assertNotIn('TEMP B-TREE', plano)
+
+    def test_administracao_usa_indice_condicao_combustivel(self):
+        plano = self.plano(Carro.objects.filter(condicao='novo', combustivel='gasolina'))
+        self.assertIn('carro_condicao_comb_idx', plano)
+
+    def test_indices_das_tabelas_relacionadas(self):
+        carro = Carro.objects.first()
+        casos = {
+            'foto_carro_principal_idx': FotoCarro.objects.filter(
+                carro=carro
+            ).order_by('-foto_principal', 'ordem', 'data_upload', 'id')[:1],
+            'movimentacao_carro_data_idx': MovimentacaoEstoque.objects.filter(
+                carro=carro
+            ).order_by('-data_movimentacao'),
+            'aluguel_carro_status_idx': Aluguel.objects.filter(carro=carro, status='ativo'),
+        }
+        for indice, queryset in casos.items():
+            with self.subTest(indice=indice):
+                self.assertIn(indice, self.plano(queryset))
+        # O id de desempate da capa vem no fim do próprio índice (rowid), sem ordenação extra
+        self.assertNotIn('TEMP B-TREE', self.plano(casos['foto_carro_principal_idx']))
+
+
+class BuscaTextualTests(TestCase):
+    """Índice FTS5: relevância, acentos, combustível/transmissão e sincronização"""
+
+    @classmethod
+    def setUpTestData(cls):
+        from apps.usuarios.models import Usuario
+
+        cls.usuario = Usuario.objects.create_user('gestor', password='senha-teste', is_staff=True)
+        cls.marca = Marca.objects.create(nome='Toyota')
+        cls.modelo = Modelo.objects.create(marca=cls.marca, nome='Prius', categoria='sedan')
+        outra = Modelo.objects.create(marca=Marca.objects.create(nome='Kia'), nome='Sportage', categoria='suv')
+        cor = Cor.objects.create(nome='Prata')
+        dados = dict(cor=cor, ano_fabricacao=2020, ano_modelo=2020, condicao='usado', disponivel_venda=True)
+        cls.hibrido = Carro.objects.create(
+            modelo=cls.modelo, combustivel='hibrido', transmissao='cvt',
+            chassi='H' * 17, matricula='LD-01-01-HH', **dados,
+        )
+        # Só a descrição fala em Toyota: conta menos que a marca
+        cls.diesel = Carro.objects.create(
+            modelo=outra, combustivel='diesel', transmissao='automatico',
+            descricao='Mais económico que um Toyota', chassi='D' * 17, matricula='LD-02-02-DD', **dados,
+        )
+
+    def setUp(self):
+        if not busca.fts_disponivel():
+            self.skipTest('O índice FTS5 só existe em SQLite')
+        cache.clear()
+
+    def ids(self, texto):
+        return list(busca.buscar(Carro.objects.all(), texto).values_list('id', flat=True))
+
+    def test_combustivel_e_transmissao_pelo_rotulo_sem_acentos(self):
+        for texto in ('hibrido', 'Híbrido', 'cvt'):
+            with self.subTest(texto=texto):
+                self.assertEqual(self.ids(texto), [self.hibrido.pk])
+        for texto in ('automatico', 'Automático'):
+            with self.subTest(texto=texto):
+                self.assertEqual(self.ids(texto), [self.diesel.pk])
+
+    def test_listagens_ordenadas_por_relevancia(self):
+        loja = self.client.get(reverse('website:loja'), {'search': 'toyota'})
+        self.assertEqual([carro.pk for carro in loja.context['carros']], [self.hibrido.pk, self.diesel.pk])
+
+        self.client.force_login(self.usuario)
+        lista = self.client.get(reverse('administracao:lista_veiculos'), {'search': 'HIBRIDO'})
+        self.assertEqual([carro.pk for carro in lista.context['carros']], [self.hibrido.pk])
+
+    def test_indice_acompanha_alteracoes(self):
+        self.hibrido.combustivel = 'eletrico'
+        self.hibrido.save()
+        self.assertEqual(self.ids('hibrido'), [])
+        self.assertEqual(self.ids('eletrico'), [self.hibrido.pk])
+
+        self.hibrido.opcionais.add(Opcional.objects.create(nome='Câmara de ré', categoria='Segurança'))
+        self.assertEqual(self.ids('camara'), [self.hibrido.pk])
+        self.hibrido.opcionais.clear()
+        self.assertEqual(self.ids('camara'), [])
+
+        self.marca.nome = 'Lexus'
+        self.marca.save()
+        self.modelo.nome = 'CT200h'
+        self.modelo.save()
+        self.assertEqual(self.ids('lexus ct200h'), [self.hibrido.pk])
+        self.assertEqual(self.ids('prius'), [])
+
+        pk = self.diesel.pk
+        self.diesel.delete()
+        self.assertEqual(self.ids('sportage'), [])
+        self.assertFalse(busca.IndiceBuscaCarro.objects.filter(pk=pk).exists())
+
+
+class AtualizarOrdemFotosTests(TestCase):
+    """Reordenação em lote das fotos de um carro"""
+
+    @classmethod
+    def setUpTestData(cls):
+        from apps.usuarios.models import Usuario
+
+        cls.usuario = Usuario.objects.create_user('staff', password='senha-teste', is_staff=True)
+        marca = Marca.objects.create(nome='Toyota')
+        modelo = Modelo.objects.create(marca=marca, nome='Hilux', categoria='pickup')
+        cor = Cor.objects.create(nome='Preto')
+        cls.carro = Carro.objects.create(
+            modelo=modelo, cor=cor, ano_fabricacao=2020, ano_modelo=2021, condicao='usado',
+            combustivel='diesel', transmissao='manual', chassi='A' * 17, matricula='LD-01-01-AA',
+        )
+        cls.outro = Carro.objects.create(
+            modelo=modelo, cor=cor, ano_fabricacao=2020, ano_modelo=2021, condicao='usado',
+            combustivel='diesel', transmissao='manual', chassi='B' * 17, matricula='LD-02-02-BB',
+        )
+        cls.fotos = FotoCarro.objects.bulk_create([
+            FotoCarro(carro=cls.carro, foto=f'carros/fotos/{i}.jpg', ordem=i + 1) for i in range(30)
+        ])
+        cls.foto_alheia = FotoCarro.objects.create(carro=cls.outro, foto='carros/fotos/x.jpg')
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+        self.url = reverse('administracao:atualizar_ordem_fotos', args=[self.carro.pk])
+
+    def test_reordena_com_numero_constante_de_consultas(self):
+        nova_ordem = [foto.pk for foto in reversed(self.fotos)]
+        # sessão + utilizador, leitura das fotos, bulk_update, capa e savepoint/commit
+        with self.assertNumQueries(7):
+            resposta = self.client.post(
+                self.url, {'foto_ids': nova_ordem}, content_type='application/json'
+            )
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual([item['id'] for item in resposta.json()['ordem']], nova_ordem)
+        self.assertEqual(
+            list(self.carro.fotos.order_by('ordem').values_list('pk', flat=True)), nova_ordem
+        )
+        self.carro.refresh_from_db()
+        self.assertEqual(self.carro.foto_capa_id, nova_ordem[0])
+
+    def test_fotos_nao_enviadas_ficam_no_fim(self):
+        primeiras = [self.fotos[5].pk, self.fotos[2].pk]
+        self.client.post(self.url, {'foto_ids[]': primeiras})
+        ordem = list(self.carro.fotos.order_by('ordem').values_list('pk', flat=True))
+        self.assertEqual(ordem[:2], primeiras)
+        self.assertEqual(len(ordem), 30)
+
+    def test_rejeita_fotos_de_outro_carro(self):
+        resposta = self.client.post(self.url, {'foto_ids[]': [self.fotos[0].pk, self.foto_alheia.pk]})
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(resposta.json()['foto_ids_invalidos'], [self.foto_alheia.pk])
+        self.assertEqual(self.carro.fotos.get(pk=self.fotos[0].pk).ordem, 1)
+
+    def test_exige_post(self):
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+
+class FotoCapaTests(TestCase):
+    """Carro.foto_capa acompanha uploads, remoções, foto principal e reordenação"""
+
+    @classmethod
+    def setUpTestData(cls):
+        from apps.usuarios.models import Usuario
+
+        cls.usuario = Usuario.objects.create_user('gestor', password='senha-teste', is_staff=True)
+        modelo = Modelo.objects.create(marca=Marca.objects.create(nome='Mazda'), nome='CX-5', categoria='suv')
+        cls.carro = Carro.objects.create(
+            modelo=modelo, cor=Cor.objects.create(nome='Vermelho'), ano_fabricacao=2021, ano_modelo=2021,
+            condicao='usado', combustivel='gasolina', transmissao='automatico',
+            chassi='F' * 17, matricula='LD-05-05-FF',
+        )
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        configuracao = override_settings(
+            MEDIA_ROOT=media,
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+        )
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.client.force_login(self.usuario)
+        self.url = reverse('administracao:detalhes_veiculo', args=[self.carro.pk])
+
+    def capa(self):
+        self.carro.refresh_from_db()
+        return self.carro.foto_capa_id
+
+    def enviar(self, nome):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 30)).save(buffer, 'JPEG')
+        arquivo = SimpleUploadedFile(nome, buffer.getvalue(), content_type='image/jpeg')
+        self.client.post(self.url, {'upload_foto': '1', 'foto': arquivo})
+        return self.carro.fotos.latest('id')
+
+    def test_capa_acompanha_as_fotos(self):
+        primeira = self.enviar('a.jpg')
+        segunda = self.enviar('b.jpg')
+        terceira = self.enviar('c.jpg')
+        # A primeira foto enviada passa a principal
+        self.assertEqual(self.capa(), primeira.pk)
+
+        self.client.post(self.url, {'definir_principal': '1', 'foto_id': terceira.pk})
+        self.assertEqual(self.capa(), terceira.pk)
+
+        # Remover a principal promove a primeira pela ordem
+        self.client.post(self.url, {'remover_foto': '1', 'foto_id': terceira.pk})
+        self.assertEqual(self.capa(), primeira.pk)
+        self.assertTrue(self.carro.fotos.get(pk=primeira.pk).foto_principal)
+
+        # Sem principal, a capa é a primeira na nova ordem
+        self.carro.fotos.update(foto_principal=False)
+        self.client.post(
+            reverse('administracao:atualizar_ordem_fotos', args=[self.carro.pk]),
+            {'foto_ids': [segunda.pk, primeira.pk]}, content_type='application/json',
+        )
+        self.assertEqual(self.capa(), segunda.pk)
+
+        self.client.post(self.url, {'remover_foto': '1', 'foto_id': segunda.pk})
+        self.client.post(self.url, {'remover_foto': '1', 'foto_id': primeira.pk})
+        self.assertIsNone(self.capa())
+
+    def test_empate_desfeito_pelo_id(self):
+        fotos = FotoCarro.objects.bulk_create([
+            FotoCarro(carro=self.carro, foto=f'carros/fotos/e{i}.jpg', ordem=1) for i in range(3)
+        ])
+        FotoCarro.objects.filter(carro=self.carro).update(data_upload=fotos[0].data_upload)
+        atualizar_foto_capa([self.carro.pk])
+        self.assertEqual(self.capa(), min(foto.pk for foto in fotos))
+
+
+class VariantesFotoTests(TestCase):
+    """Geração das variantes redimensionadas após o upload"""
+
+    @classmethod
+    def setUpTestData(cls):
+        marca = Marca.objects.create(nome='Kia')
+        modelo = Modelo.objects.create(marca=marca, nome='Sportage', categoria='suv')
+        cor = Cor.objects.create(nome='Cinza')
+        cls.carro = Carro.objects.create(
+            modelo=modelo, cor=cor, ano_fabricacao=2022, ano_modelo=2022, condicao='novo',
+            combustivel='gasolina', transmissao='automatica', chassi='C' * 17, matricula='LD-03-03-CC',
+        )
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        configuracao = override_settings(
+            MEDIA_ROOT=media,
+            IMAGENS_PROCESSAMENTO_SINCRONO=True,
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+        )
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def jpeg_com_exif(self, tamanho=(2000, 1500)):
+        imagem = Image.new('RGB', tamanho, (200, 30, 30))
+        exif = Image.Exif()
+        exif[0x010F] = 'Fabricante da câmara'
+        buffer = BytesIO()
+        imagem.save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('foto.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_gera_variantes_sem_exif_depois_do_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            foto = FotoCarro.objects.create(carro=self.carro, foto=self.jpeg_com_exif())
+            foto.refresh_from_db()
+            # Antes do commit a página continua a usar o original
+            self.assertEqual(foto.variantes, {})
+            self.assertEqual(foto.url_variante('cartao'), foto.foto.url)
+
+        foto.refresh_from_db()
+        self.assertEqual((foto.largura, foto.altura), (2000, 1500))
+        self.assertEqual(set(foto.variantes), {'miniatura', 'cartao', 'galeria'})
+        for nome, formatos in foto.variantes.items():
+            self.assertEqual(set(formatos), {'jpeg', 'webp'})
+            with default_storage.open(formatos['jpeg']) as arquivo, Image.open(arquivo) as imagem:
+                self.assertLessEqual(imagem.width, 1600)
+                self.assertEqual(len(imagem.getexif()), 0)
+        with default_storage.open(foto.variantes['cartao']['webp']) as arquivo, Image.open(arquivo) as imagem:
+            self.assertEqual((imagem.format, imagem.size), ('WEBP', (640, 480)))
+
+        variantes = foto.variantes
+        with self.captureOnCommitCallbacks(execute=True):
+            foto.delete()
+        self.assertFalse(default_storage.exists(variantes['galeria']['jpeg']))
+
+
+    def test_reprocessar_remove_as_variantes_anteriores(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            foto = FotoCarro.objects.create(carro=self.carro, foto=self.jpeg_com_exif((800, 600)))
+        foto.refresh_from_db()
+        anteriores = [caminho for formatos in foto.variantes.values() for caminho in formatos.values()]
+
+        # O FileSystemStorage grava com outro nome quando o ficheiro já existe
+        self.assertTrue(imagens.processar_foto(foto.pk))
+        foto.refresh_from_db()
+        atuais = [caminho for formatos in foto.variantes.values() for caminho in formatos.values()]
+        self.assertTrue(set(atuais).isdisjoint(anteriores))
+        self.assertTrue(all(default_storage.exists(caminho) for caminho in atuais))
+        self.assertFalse(any(default_storage.exists(caminho) for caminho in anteriores))
+        _, ficheiros = default_storage.listdir(posixpath.dirname(atuais[0]))
+        self.assertEqual(len(ficheiros), len(atuais))
+
+
+    def test_reprocessar_com_storage_por_conteudo_mantem_as_variantes(self):
+        configuracao = override_settings(STORAGES={
+            'default': {'BACKEND': 'apps.core.storage.ArmazenamentoConteudo'},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        with self.captureOnCommitCallbacks(execute=True):
+            foto = FotoCarro.objects.create(carro=self.carro, foto=self.jpeg_com_exif((800, 600)))
+        foto.refresh_from_db()
+        anteriores = foto.variantes
+
+        # Mesmo conteúdo, mesmos nomes: nada a apagar
+        self.assertTrue(imagens.processar_foto(foto.pk))
+        foto.refresh_from_db()
+        self.assertEqual(foto.variantes, anteriores)
+        self.assertTrue(default_storage.exists(anteriores['cartao']['webp']))
+
+
+class CarroDetailViewTests(TestCase):
+    """Página de detalhe da administração com número fixo de consultas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        from apps.usuarios.models import Usuario
+
+        cls.usuario = Usuario.objects.create_user('gestor', password='senha-teste', is_staff=True)
+        marca = Marca.objects.create(nome='Nissan')
+        modelo = Modelo.objects.create(marca=marca, nome='Navara', categoria='pickup')
+        cor = Cor.objects.create(nome='Branco')
+        cls.carro = Carro.objects.create(
+            modelo=modelo, cor=cor, ano_fabricacao=2019, ano_modelo=2019, condicao='usado',
+            combustivel='diesel', transmissao='manual', chassi='D' * 17, matricula='LD-04-04-DD',
+        )
+        cls.opcionais = [
+            Opcional.objects.create(nome=f'Opcional {i}', categoria='Conforto') for i in range(6)
+        ]
+        cls.carro.opcionais.add(*cls.opcionais[:2])
+        cls.inativo = Opcional.objects.create(nome='Descontinuado', ativo=False)
+        FotoCarro.objects.bulk_create([
+            FotoCarro(carro=cls.carro, foto=f'carros/fotos/d{i}.jpg', ordem=i, foto_principal=i == 3)
+            for i in range(1, 13)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.usuario)
+        self.url = reverse('administracao:detalhes_veiculo', args=[self.carro.pk])
+
+    def test_numero_fixo_de_consultas(self):
+        # sessão, utilizador, carro, fotos, opcionais do carro, opcionais ativos,
+        # e as escolhas de modelo e cor do formulário
+        with self.assertNumQueries(8):
+            resposta = self.client.get(self.url)
+        # Com as listas de referência já em memória
+        with self.assertNumQueries(5):
+            self.client.get(self.url)
+
+        contexto = resposta.context
+        self.assertEqual(len(contexto['fotos']), 12)
+        self.assertEqual(contexto['foto_principal'].ordem, 3)
+        self.assertEqual(
+            {opcional.pk for opcional in contexto['opcionais_disponiveis']},
+            {opcional.pk for opcional in self.opcionais[2:]},
+        )
+
+    def test_opcional_alterado_atualiza_lista_em_cache(self):
+        self.client.get(self.url)
+        novo = Opcional.objects.create(nome='Teto panorâmico', categoria='Conforto')
+        resposta = self.client.get(self.url)
+        self.assertIn(novo, resposta.context['opcionais_disponiveis'])
+
+    def test_remover_foto_principal_promove_a_seguinte(self):
+        principal = self.carro.fotos.get(foto_principal=True)
+        resposta = self.client.post(self.url, {'remover_foto': '1', 'foto_id': principal.pk})
+        self.assertRedirects(resposta, self.url)
+        self.assertFalse(FotoCarro.objects.filter(pk=principal.pk).exists())
+        self.assertEqual(self.carro.fotos.get(foto_principal=True).ordem, 1)
+
+
+class ReferenciasTests(TestCase):
+    """Listas de referência em memória, invalidadas pela versão partilhada"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.marca = Marca.objects.create(nome='Toyota')
+        cls.modelo = Modelo.objects.create(marca=cls.marca, nome='Hilux', categoria='pickup')
+        cls.cor = Cor.objects.create(nome='Prata')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_segunda_leitura_nao_consulta_o_banco(self):
+        self.assertEqual(list(referencias.modelos_ativos()), [self.modelo])
+        with self.assertNumQueries(0):
+            modelos = referencias.modelos_ativos()
+            self.assertEqual(modelos[0].marca.nome, 'Toyota')
+
+    def test_gravar_ou_apagar_invalida(self):
+        referencias.marcas_ativas()
+        nova = Marca.objects.create(nome='Audi')
+        self.assertEqual(list(referencias.marcas_ativas()), [nova, self.marca])
+        Cor.objects.create(nome='Azul')
+        Cor.objects.filter(nome='Azul').get().delete()
+        self.assertEqual(list(referencias.cores_ativas()), [self.cor])
+
+    def test_versao_alterada_por_outro_processo(self):
+        referencias.cores_ativas()
+        # update() não dispara sinais: só a versão partilhada avisa da mudança
+        Cor.objects.filter(pk=self.cor.pk).update(nome='Cinzento')
+        self.assertEqual(referencias.cores_ativas()[0].nome, 'Prata')
+        invalidar(REFERENCIAS)
+        self.assertEqual(referencias.cores_ativas()[0].nome, 'Cinzento')
+
+    def test_formulario_usa_lista_em_memoria_e_valida_no_banco(self):
+        referencias.modelos_ativos()
+        referencias.cores_ativas()
+        with self.assertNumQueries(0):
+            form = CarroRegistroForm()
+            html = str(form['modelo']) + str(form['cor'])
+        self.assertIn('Hilux', html)
+        self.assertIn('Prata', html)
+
+        Modelo.objects.filter(pk=self.modelo.pk).update(ativo=False)
+        form = CarroRegistroForm(data={'modelo': self.modelo.pk, 'cor': self.cor.pk})
+        self.assertIn('modelo', form.errors)
+
+
+class ModelosPorMarcaTests(TestCase):
+    """Endpoint AJAX de modelos por marca, com ETag e modo completo"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.toyota = Marca.objects.create(nome='Toyota')
+        cls.hilux = Modelo.objects.create(marca=cls.toyota, nome='Hilux', categoria='pickup')
+        cls.corolla = Modelo.objects.create(marca=cls.toyota, nome='Corolla', categoria='sedan')
+        cls.kia = Marca.objects.create(nome='Kia')
+        Modelo.objects.create(marca=cls.kia, nome='Sportage', categoria='suv')
+        Modelo.objects.create(marca=cls.kia, nome='Rio', categoria='hatch', ativo=False)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('administracao:obter_modelos_por_marca')
+
+    def test_modelos_de_uma_marca(self):
+        dados = self.client.get(self.url, {'marca_id': self.toyota.pk}).json()
+        self.assertEqual(
+            dados['modelos'],
+            [{'id': self.corolla.pk, 'nome': 'Corolla'}, {'id': self.hilux.pk, 'nome': 'Hilux'}],
+        )
+        self.assertEqual(self.client.get(self.url, {'marca_id': 'x'}).json(), {'modelos': []})
+
+    def test_modo_completo(self):
+        marcas = self.client.get(self.url, {'todas': '1'}).json()['marcas']
+        self.assertEqual(set(marcas), {str(self.toyota.pk), str(self.kia.pk)})
+        self.assertEqual([m['nome'] for m in marcas[str(self.kia.pk)]], ['Sportage'])
+
+    def test_revalidacao_com_etag(self):
+        resposta = self.client.get(self.url, {'todas': '1'})
+        self.assertIn('no-cache', resposta['Cache-Control'])
+        # Só o ETag, derivado do conteúdo, decide a revalidação
+        self.assertNotIn('Last-Modified', resposta)
+        etag = resposta['ETag']
+        with self.assertNumQueries(0):
+            nao_modificado = self.client.get(self.url, {'todas': '1'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(nao_modificado.status_code, 304)
+
+        Modelo.objects.create(marca=self.kia, nome='Picanto', categoria='hatch')
+        resposta = self.client.get(self.url, {'todas': '1'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], etag)
+
+
+@override_settings(SEMELHANTES_PROCESSAMENTO_SINCRONO=True)
+class CarrosSemelhantesTests(TestCase):
+    """Motor de semelhança e atualização incremental das listas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        marca = Marca.objects.create(nome='Toyota')
+        suv = Modelo.objects.create(marca=marca, nome='RAV4', categoria='suv')
+        sedan = Modelo.objects.create(marca=marca, nome='Corolla', categoria='sedan')
+        cor = Cor.objects.create(nome='Preto')
+        cls.teto, cls.gps = (Opcional.objects.create(nome=nome) for nome in ('Teto solar', 'GPS'))
+
+        def carro(n, modelo, ano, preco, km, combustivel='diesel'):
+            return Carro.objects.create(
+                modelo=modelo, cor=cor, ano_fabricacao=ano, ano_modelo=ano, condicao='usado',
+                preco_venda=Decimal(preco), quilometragem=km, combustivel=combustivel,
+                transmissao='automatica', chassi=f'S{n:016d}', matricula=f'LD-SM-{n:02d}',
+            )
+
+        cls.base = carro(1, suv, 2020, 20_000_000, 40_000)
+        cls.gemeo = carro(2, suv, 2020, 21_000_000, 45_000)
+        cls.parecido = carro(3, suv, 2018, 17_000_000, 70_000)
+        cls.diferente = carro(4, sedan, 2008, 3_000_000, 220_000, combustivel='gasolina')
+        cls.outros = [carro(5 + i, sedan, 2012 + i, 6_000_000 + i * 500_000, 150_000) for i in range(4)]
+        for c in (cls.base, cls.gemeo):
+            c.opcionais.add(cls.teto, cls.gps)
+
+    def setUp(self):
+        semelhantes.recalcular_todos()
+
+    def lista(self, carro):
+        return list(carro.semelhantes.values_list('semelhante_id', flat=True))
+
+    def assertIgualAoRecalculo(self):
+        matriz = semelhantes.MatrizCarros()
+        esperado = {
+            carro_id: [semelhante_id for semelhante_id, _ in lista]
+            for carro_id, lista in matriz.mais_semelhantes(range(len(matriz))).items()
+        }
+        guardado = {}
+        for carro_id, semelhante_id in CarroSemelhante.objects.values_list('carro_id', 'semelhante_id'):
+            guardado.setdefault(carro_id, []).append(semelhante_id)
+        self.assertEqual(guardado, esperado)
+
+    def test_ordena_por_semelhanca(self):
+        self.assertEqual(self.lista(self.base)[:2], [self.gemeo.pk, self.parecido.pk])
+        self.assertNotIn(self.diferente.pk, self.lista(self.base))
+        self.assertEqual(len(self.lista(self.diferente)), semelhantes.TOTAL_SEMELHANTES)
+
+    def test_alteracao_incremental_igual_ao_recalculo(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.diferente.modelo = self.base.modelo
+            self.diferente.ano_modelo = 2020
+            self.diferente.preco_venda = Decimal(20_500_000)
+            self.diferente.quilometragem = 42_000
+            self.diferente.combustivel = 'diesel'
+            self.diferente.save()
+            self.diferente.opcionais.add(self.teto, self.gps)
+        self.assertIn(self.diferente.pk, self.lista(self.base)[:2])
+        self.assertIgualAoRecalculo()
+
+    def test_carro_indisponivel_sai_das_listas(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Carro.objects.filter(pk=self.gemeo.pk).update(disponivel_venda=False, disponivel_aluguel=False)
+            semelhantes.agendar([self.gemeo.pk])
+        self.assertFalse(CarroSemelhante.objects.filter(semelhante=self.gemeo).exists())
+        self.assertEqual(self.lista(self.gemeo), [])
+        self.assertIgualAoRecalculo()
+
+    def test_calculo_fora_do_pedido(self):
+        tarefas = []
+
+        class Executor:
+            def submit(self, funcao, *args):
+                tarefas.append(funcao)
+
+        anterior = semelhantes._executor
+        semelhantes._executor = Executor()
+        self.addCleanup(setattr, semelhantes, '_executor', anterior)
+        antes = self.lista(self.base)
+
+        with override_settings(SEMELHANTES_PROCESSAMENTO_SINCRONO=False):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.parecido.preco_venda = Decimal(21_000_000)
+                self.parecido.save()
+                self.diferente.save()
+            # Nada calculado no pedido: uma tarefa para as duas alterações
+            self.assertEqual(len(tarefas), 1)
+            self.assertEqual(self.lista(self.base), antes)
+            # O que chega com a tarefa ainda por correr junta-se a ela
+            with self.captureOnCommitCallbacks(execute=True):
+                self.gemeo.opcionais.clear()
+            self.assertEqual(len(tarefas), 1)
+
+        tarefas[0]()
+        self.assertFalse(semelhantes._agendado)
+        self.assertIgualAoRecalculo()
+
+    def test_um_so_executor_com_pedidos_simultaneos(self):
+        anterior = semelhantes._executor
+        semelhantes._executor = None
+        self.addCleanup(setattr, semelhantes, '_executor', anterior)
+        partida = threading.Barrier(8)
+        executores = []
+
+        def obter():
+            partida.wait()
+            executores.append(semelhantes._obter_executor())
+
+        threads = [threading.Thread(target=obter) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(executor) for executor in executores}), 1)
+        executores[0].shutdown()
+
+    def test_detalhe_publico_mostra_semelhantes(self):
+        resposta = self.client.get(reverse('website:carro_detailhe', args=[self.base.pk]))
+        self.assertEqual(
+            [carro.pk for carro in resposta.context['carros_relacionados']], self.lista(self.base)
+        )
+
+
+@override_settings(SEMELHANTES_PROCESSAMENTO_SINCRONO=True)
+class ImportacaoCarrosTests(TestCase):
+    """Importação em lote: linhas válidas gravadas por lote, as restantes no relatório de erros"""
+
+    CABECALHO = 'Marca;Modelo;Cor;Ano Fabricação;Ano Modelo;Condição;Preço Venda;Combustível;Transmissão;Chassi;Matrícula;Opcionais\n'
+
+    @classmethod
+    def setUpTestData(cls):
+        from apps.usuarios.models import Funcionario, Usuario
+
+        marca = Marca.objects.create(nome='Toyota')
+        cls.modelo = Modelo.objects.create(marca=marca, nome='Land Cruiser', categoria='suv')
+        Cor.objects.create(nome='Cinzento Grafite')
+        cls.gps = Opcional.objects.create(nome='GPS')
+        Opcional.objects.create(nome='Câmara de Ré')
+        cls.funcionario = Funcionario.objects.create(nome='Stock', bilhete_identidade='444444444LA444')
+        cls.usuario = Usuario.objects.create_user('importador', password='senha-teste', is_staff=True)
+        Carro.objects.create(
+            modelo=cls.modelo, cor=Cor.objects.get(), ano_fabricacao=2020, ano_modelo=2020, condicao='usado',
+            combustivel='diesel', transmissao='manual', chassi='JTEEXISTENTE00001', matricula='LD-00-00-EX',
+        )
+
+    def setUp(self):
+        referencias.limpar()
+
+    def arquivo(self, *linhas):
+        return BytesIO((self.CABECALHO + ''.join(linhas)).encode('utf-8'))
+
+    def importar(self, arquivo, **opcoes):
+        with self.captureOnCommitCallbacks(execute=True):
+            return importacao.importar(importacao.ler(arquivo, 'estoque.csv'), self.funcionario, **opcoes)
+
+    def test_linhas_validas_gravadas_e_erros_por_linha(self):
+        resultado = self.importar(self.arquivo(
+            'toyota;LAND CRUISER;cinzento grafite;2023;2024;Novo;"45 000 000,00";Diesel;Automático;jte00000000000001;ld-11-11-aa;GPS | camara de re\n',
+            'Toyota;Land Cruiser;Cinzento Grafite;2024;2024;usado;;diesel;manual;JTE00000000000002;LD-22-22-BB;\n',
+            'Toyota;Hilux;Cinzento Grafite;2024;2024;novo;;diesel;manual;JTE00000000000003;LD-33-33-CC;\n',
+            'Toyota;Land Cruiser;Cinzento Grafite;2025;2024;novo;;diesel;manual;JTE0003;LD-44-44-DD;\n',
+            'Toyota;Land Cruiser;Cinzento Grafite;2024;2024;novo;;diesel;manual;JTE00000000000001;LD-55-55-EE;\n',
+            'Toyota;Land Cruiser;Cinzento Grafite;2024;2024;novo;;diesel;manual;JTEEXISTENTE00001;LD-66-66-FF;\n',
+        ), lote=2)
+
+        self.assertEqual((resultado.linhas, resultado.importados), (6, 2))
+        self.assertEqual([linha for linha, _ in resultado.erros], [4, 5, 6, 7])
+        self.assertIn('Hilux', resultado.erros[0][1][0])
+        self.assertEqual(len(resultado.erros[1][1]), 2)  # chassi curto e anos trocados
+        # O primeiro lote já foi gravado: a repetição é apanhada pela consulta do lote seguinte
+        self.assertIn('já existe um carro com "JTE00000000000001"', resultado.erros[2][1][0])
+        self.assertIn('já existe', resultado.erros[3][1][0])
+
+        carro = Carro.objects.get(chassi='JTE00000000000001')
+        self.assertEqual((carro.matricula, carro.transmissao), ('LD-11-11-AA', 'automatico'))
+        self.assertEqual(carro.preco_venda, Decimal('45000000.00'))
+        self.assertEqual(carro.opcionais.count(), 2)
+        self.assertEqual(
+            MovimentacaoEstoque.objects.filter(tipo_movimentacao='entrada', funcionario=self.funcionario).count(), 2
+        )
+        if busca.fts_disponivel():
+            self.assertEqual(busca.buscar(Carro.objects.all(), 'land cruiser gps').get(), carro)
+
+    def test_relatorio_na_ordem_do_ficheiro(self):
+        resultado = self.importar(self.arquivo(
+            'Toyota;Land Cruiser;Cinzento Grafite;2024;2024;novo;;diesel;manual;JTEEXISTENTE00001;LD-70-70-AA;\n',
+            'Toyota;Land Cruiser;Roxo;2024;2024;novo;;diesel;manual;JTE70000000000002;LD-70-70-BB;\n',
+            'Toyota;Land Cruiser;Cinzento Grafite;2024;2024;novo;;diesel;manual;JTE70000000000003;;\n',
+        ), lote=5)
+        # O chassi repetido da linha 2 só é detetado ao gravar o lote, depois das linhas 3 e 4
+        self.assertEqual([linha for linha, _ in resultado.erros], [2, 3, 4])
+        self.assertIn('Matrícula', resultado.erros[2][1][0])
+
+        saida = StringIO()
+        resultado.escrever_erros(saida)
+        self.assertEqual([linha.split(';')[0] for linha in saida.getvalue().splitlines()[1:]], ['2', '3', '4'])
+
+    def test_csv_do_excel_em_cp1252(self):
+        # O Excel em português grava CSV em cp1252; aqui o único acento está na última linha
+        cabecalho = self.CABECALHO.replace('ç', 'c').replace('ã', 'a').replace('í', 'i').replace('é', 'e')
+        self.assertTrue(cabecalho.isascii())
+        arquivo = BytesIO((cabecalho + ''.join(
+            f'Toyota;Land Cruiser;Cinzento Grafite;2024;2024;novo;;diesel;manual;JTE9000000000000{i};LD-90-90-0{i};GPS\n'
+            for i in range(3)
+        ) + 'Toyota;Land Cruiser;Cinzento Grafite;2024;2024;novo;;diesel;Automático;JTE90000000000009;LD-90-90-09;Câmara de Ré\n'
+        ).encode('cp1252'))
+        resultado = self.importar(arquivo)
+        self.assertEqual((resultado.importados, resultado.erros), (4, []))
+        carro = Carro.objects.get(chassi='JTE90000000000009')
+        self.assertEqual(carro.transmissao, 'automatico')
+        self.assertEqual([opcional.nome for opcional in carro.opcionais.all()], ['Câmara de Ré'])
+
+    def test_csv_ilegivel_a_meio_fica_no_relatorio(self):
+        resultado = self.importar(self.arquivo(
+            'Toyota;Land Cruiser;Cinzento Grafite;2024;2024;novo;;diesel;manual;JTE91000000000001;LD-91-91-01;\n',
+            'Toyota;Land Cruiser;Cinzento Grafite;2024;2024;novo;;diesel;manual;JTE91000000000002;LD-91-91-02;"'
+            + 'x' * (csv.field_size_limit() + 1) + '"\n',
+        ))
+        # A linha lida antes do erro é importada; o erro fica no relatório em vez de um 500
+        self.assertEqual(resultado.importados, 1)
+        self.assertEqual(len(resultado.erros), 1)
+        self.assertIn('Não foi possível ler o CSV', resultado.erros[0][1][0])
+
+    @skipUnless(find_spec('openpyxl'), 'A importação de XLSX requer o openpyxl')
+    def test_xlsx_danificado_recusado_no_formulario(self):
+        self.client.force_login(self.usuario)
+        url = reverse('administracao:importar_veiculos')
+        zip_sem_folhas = BytesIO()
+        with zipfile.ZipFile(zip_sem_folhas, 'w') as arquivo:
+            arquivo.writestr('leia-me.txt', 'não é um livro do Excel')
+        for nome, conteudo in (('corrompido.xlsx', b'PK\x03\x04 nada'), ('zip.xlsx', zip_sem_folhas.getvalue())):
+            with self.subTest(arquivo=nome):
+                resposta = self.client.post(url, {
+                    'arquivo': SimpleUploadedFile(nome, conteudo), 'funcionario': self.funcionario.pk,
+                })
+                self.assertEqual(resposta.status_code, 200)
+                self.assertFormError(
+                    resposta.context['form'], 'arquivo', 'O ficheiro não é um XLSX válido ou está danificado.'
+                )
+        self.assertEqual(Carro.objects.count(), 1)
+
+    @skipUnless(find_spec('openpyxl'), 'A importação de XLSX requer o openpyxl')
+    def test_importa_xlsx(self):
+        from openpyxl import Workbook
+
+        livro = Workbook()
+        folha = livro.active
+        folha.append(self.CABECALHO.strip().split(';'))
+        folha.append(['Toyota', 'Land Cruiser', 'Cinzento Grafite', 2024, 2024, 'Novo', 45000000.5,
+                      'Diesel', 'Automático', 'JTE80000000000001', 'LD-80-80-AA', 'GPS'])
+        folha.append([])
+        folha.append(['Toyota', 'Land Cruiser', 'Cinzento Grafite', 2024.0, 2024, 'novo', None,
+                      'diesel', 'manual', 'JTE80000000000002', None, None])
+        arquivo = BytesIO()
+        livro.save(arquivo)
+        arquivo.seek(0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = importacao.importar(importacao.ler(arquivo, 'estoque.xlsx'), self.funcionario)
+        self.assertEqual((resultado.linhas, resultado.importados), (2, 1))
+        # A linha vazia conta para a numeração, como no Excel
+        self.assertEqual([linha for linha, _ in resultado.erros], [4])
+        carro = Carro.objects.get(chassi='JTE80000000000001')
+        self.assertEqual((carro.preco_venda, carro.transmissao), (Decimal('45000000.50'), 'automatico'))
+        self.assertEqual(list(carro.opcionais.all()), [self.gps])
+
+    def test_simulacao_nao_grava_e_nao_consulta_por_linha(self):
+        linhas = [
+            f'Toyota;Land Cruiser;Cinzento Grafite;2024;2024;novo;;diesel;manual;JTE1000000000000{i};LD-10-10-0{i};GPS\n'
+            for i in range(8)
+        ]
+        # modelos, cores e opcionais (uma vez) + chassis e matrículas existentes (uma vez por lote)
+        with self.assertNumQueries(5):
+            resultado = self.importar(self.arquivo(*linhas), simular=True)
+        self.assertEqual((resultado.importados, resultado.erros), (8, []))
+        self.assertEqual(Carro.objects.count(), 1)
+
+    def test_pagina_de_importacao(self):
+        self.client.force_login(self.usuario)
+        url = reverse('administracao:importar_veiculos')
+        self.assertEqual(self.client.get(url, {'modelo': 1})['Content-Type'], 'text/csv; charset=utf-8')
+
+        arquivo = SimpleUploadedFile('estoque.csv', self.arquivo(
+            'Toyota;Land Cruiser;Cinzento Grafite;2024;2024;novo;;diesel;manual;JTE20000000000001;LD-20-20-AA;\n',
+            'Toyota;Land Cruiser;Roxo;2024;2024;novo;;diesel;manual;JTE20000000000002;LD-20-20-BB;\n',
+        ).getvalue())
+        resposta = self.client.post(url, {'arquivo': arquivo, 'funcionario': self.funcionario.pk})
+        self.assertEqual(resposta.context['resultado'].importados, 1)
+        self.assertContains(resposta, 'Roxo')
+
+        xls = SimpleUploadedFile('estoque.xls', b'nada')
+        resposta = self.client.post(url, {'arquivo': xls, 'funcionario': self.funcionario.pk})
+        self.assertFormError(resposta.context['form'], 'arquivo', 'Formato não suportado: envie um ficheiro .csv ou .xlsx.')
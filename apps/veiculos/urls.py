@@ -6,8 +6,12 @@ app_name = 'administracao'
 urlpatterns = [
     # Lista e cadastro de carros
     path('', views.CarroListView.as_view(), name='lista_veiculos'),
+     path('importar/', views.importar_veiculos, name='importar_veiculos'),
+     path('exportar/', views.exportar_veiculos, name='exportar_veiculos'),
+     path('movimentacoes/exportar/', views.exportar_movimentacoes, name='exportar_movimentacoes'),
      path('remover/<int:pk>/', views.CarroDeleteView.as_view(), name='remover_veiculo'),
      path('carro/detalhe/<int:pk>/', views.CarroDetailView.as_view(), name='detalhes_veiculo'),
+     path('carro/<int:pk>/fotos/ordem/', views.atualizar_ordem_fotos, name='atualizar_ordem_fotos'),
     
     # Página principal de gerenciamento
     path('gerenciamento/', views.GerenciamentoView.as_view(), name='gerenciamento'),
@@ -2,16 +2,67 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.generic import ListView, DeleteView, DetailView
 from django.contrib import messages
-from django.http import JsonResponse
-from .models import Carro, Marca, Modelo, Cor, Opcional, FotoCarro
-from .forms import CarroRegistroForm, MarcaRegistroForm, ModeloRegistroForm, CorRegistroForm
-from django.db.models import Q, Count
-from django.urls import reverse_lazy
+from django.http import HttpResponse, JsonResponse, Http404
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import etag, require_POST
+from django.db import transaction
+import json
+from .models import Carro, Marca, Modelo, Cor, Opcional, FotoCarro, MovimentacaoEstoque
+from .forms import CarroRegistroForm, MarcaRegistroForm, ModeloRegistroForm, CorRegistroForm, ImportacaoCarrosForm
+from . import busca, importacao
+from .fotos import atualizar_foto_capa
+from .referencias import catalogo_modelos, cores_ativas, marcas_ativas, modelos_ativos, opcionais_ativos
+from apps.core.cache import ESTOQUE, invalidar
+from django.db.models import Q, Count, Prefetch
+from django.urls import reverse, reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.messages.views import SuccessMessageMixin
 from django.db import models
+from apps.core.paginacao import PaginacaoCursorMixin
+from apps.core.exportacao import ID_MAXIMO, Exportacao, filtrar
 
-class CarroListView(LoginRequiredMixin, ListView):
+
+def filtrar_carros(queryset, parametros, ordenar=True):
+    """Filtros da listagem de veículos (também usados na exportação)"""
+    # Filtro de busca (índice textual, ordenado por relevância)
+    search_query = parametros.get('search', '')
+    if search_query:
+        queryset = busca.buscar(queryset, search_query, busca.COLUNAS_INTERNAS, ordenar=ordenar)
+
+    # Filtros por marca e modelo: ids inválidos (não numéricos ou fora do
+    # intervalo de um inteiro do banco) são ignorados em vez de gerar erro 500
+    for parametro, campo in (('marca', 'modelo__marca_id'), ('modelo', 'modelo_id')):
+        try:
+            valor = int(parametros.get(parametro, ''))
+        except ValueError:
+            continue
+        if 0 < valor <= ID_MAXIMO:
+            queryset = queryset.filter(**{campo: valor})
+
+    # Filtro por condição
+    condicao = parametros.get('condicao', '')
+    if condicao:
+        queryset = queryset.filter(condicao=condicao)
+
+    # Filtro por combustível
+    combustivel = parametros.get('combustivel', '')
+    if combustivel:
+        queryset = queryset.filter(combustivel=combustivel)
+
+    # Filtro por disponibilidade
+    disponibilidade = parametros.get('disponibilidade', '')
+    if disponibilidade == 'venda':
+        queryset = queryset.filter(disponivel_venda=True)
+    elif disponibilidade == 'aluguel':
+        queryset = queryset.filter(disponivel_aluguel=True)
+
+    return queryset
+
+
+class CarroListView(LoginRequiredMixin, PaginacaoCursorMixin, ListView):
     model = Carro
     template_name = 'veiculos/lista.html'
     context_object_name = 'carros'
@@ -19,56 +70,17 @@ class CarroListView(LoginRequiredMixin, ListView):
     
     def get_queryset(self):
         queryset = super().get_queryset().select_related(
-            'modelo__marca', 'cor'
-        ).prefetch_related('fotos')
-        
-        # Filtro de busca
-        search_query = self.request.GET.get('search', '')
-        if search_query:
-            queryset = queryset.filter(
-                Q(modelo__nome__icontains=search_query) |
-                Q(modelo__marca__nome__icontains=search_query) |
-                Q(chassi__icontains=search_query) |
-                Q(matricula__icontains=search_query) |
-                Q(cor__nome__icontains=search_query)
-            )
-        
-        # Filtro por marca
-        marca_id = self.request.GET.get('marca', '')
-        if marca_id:
-            queryset = queryset.filter(modelo__marca_id=marca_id)
-        
-        # Filtro por modelo
-        modelo_id = self.request.GET.get('modelo', '')
-        if modelo_id:
-            queryset = queryset.filter(modelo_id=modelo_id)
-        
-        # Filtro por condição
-        condicao = self.request.GET.get('condicao', '')
-        if condicao:
-            queryset = queryset.filter(condicao=condicao)
-        
-        # Filtro por combustível
-        combustivel = self.request.GET.get('combustivel', '')
-        if combustivel:
-            queryset = queryset.filter(combustivel=combustivel)
-        
-        # Filtro por disponibilidade
-        disponibilidade = self.request.GET.get('disponibilidade', '')
-        if disponibilidade == 'venda':
-            queryset = queryset.filter(disponivel_venda=True)
-        elif disponibilidade == 'aluguel':
-            queryset = queryset.filter(disponivel_aluguel=True)
-        
-        return queryset
+            'modelo__marca', 'cor', 'foto_capa'
+        )
+        return filtrar_carros(queryset, self.request.GET)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
         # Adicionar contexto para filtros
-        context['marcas'] = Marca.objects.filter(ativo=True).order_by('nome')
-        context['modelos'] = Modelo.objects.filter(ativo=True).select_related('marca').order_by('marca__nome', 'nome')
-        context['cores'] = Cor.objects.filter(ativo=True).order_by('nome')
+        context['marcas'] = marcas_ativas()
+        context['modelos'] = modelos_ativos()
+        context['cores'] = cores_ativas()
         
         # Choices para filtros
         context['condicao_choices'] = Carro.CONDICAO_CHOICES
@@ -87,6 +99,15 @@ class CarroListView(LoginRequiredMixin, ListView):
         context['combustivel_selecionado'] = self.request.GET.get('combustivel', '')
         context['disponibilidade_selecionada'] = self.request.GET.get('disponibilidade', '')
         
+        # Links de exportação: os filtros da listagem, sem a página nem o cursor
+        parametros = self.request.GET.copy()
+        for chave in ('page', 'cursor', 'formato'):
+            parametros.pop(chave, None)
+        context['links_exportacao'] = {}
+        for formato in ('csv', 'jsonl'):
+            parametros['formato'] = formato
+            context['links_exportacao'][formato] = f"{reverse('administracao:exportar_veiculos')}?{parametros.urlencode()}"
+
         # Adicionar formulário para registro de carro
         context['form'] = CarroRegistroForm()
         
@@ -149,28 +170,39 @@ class CarroDetailView(LoginRequiredMixin, DetailView):
     template_name = 'veiculos/detalhes.html'
     context_object_name = 'carro'
     
+    def get_queryset(self):
+        # Carro, fotos e opcionais em três consultas; o resto do contexto sai destas listas
+        return super().get_queryset().select_related(
+            'modelo__marca', 'cor'
+        ).prefetch_related(
+            Prefetch('fotos', queryset=FotoCarro.objects.order_by('ordem', 'data_upload')),
+            'opcionais',
+        )
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
         # Formulário para edição
         context['form'] = CarroRegistroForm(instance=self.object)
         
-        # Carrega as fotos do carro ordenadas
-        context['fotos'] = self.object.fotos.all().order_by('ordem', 'data_upload')
+        # Fotos do carro ordenadas (já carregadas pelo prefetch)
+        fotos = list(self.object.fotos.all())
+        context['fotos'] = fotos
         
         # Foto principal ou primeira foto
-        foto_principal = self.object.fotos.filter(foto_principal=True).first()
-        if not foto_principal:
-            foto_principal = self.object.fotos.first()
-        context['foto_principal'] = foto_principal
+        context['foto_principal'] = next(
+            (foto for foto in fotos if foto.foto_principal), fotos[0] if fotos else None
+        )
         
         # Opcionais do carro
-        context['opcionais'] = self.object.opcionais.all()
+        opcionais = list(self.object.opcionais.all())
+        context['opcionais'] = opcionais
         
-        # Todos os opcionais disponíveis para adicionar
-        context['opcionais_disponiveis'] = Opcional.objects.exclude(
-            id__in=self.object.opcionais.values_list('id', flat=True)
-        ).filter(ativo=True)
+        # Opcionais ativos que o carro ainda não tem, a partir da lista em cache
+        ids_opcionais = {opcional.pk for opcional in opcionais}
+        context['opcionais_disponiveis'] = [
+            opcional for opcional in opcionais_ativos() if opcional.pk not in ids_opcionais
+        ]
         
         # Histórico de alterações (se você tiver um modelo de auditoria)
         # context['historico'] = self.object.historico.all()[:10]
@@ -200,7 +232,8 @@ class CarroDetailView(LoginRequiredMixin, DetailView):
         return context
 
     def post(self, request, *args, **kwargs):
-        self.object = self.get_object()
+        # Sem prefetch: as ações abaixo alteram fotos e opcionais e precisam de dados frescos
+        self.object = self.get_object(queryset=Carro.objects.all())
         
         # Atualizar informações do carro
         if 'atualizar_carro' in request.POST:
@@ -208,7 +241,7 @@ class CarroDetailView(LoginRequiredMixin, DetailView):
             if form.is_valid():
                 form.save()
                 messages.success(request, 'Informações do veículo atualizadas com sucesso!')
-                return redirect('admninistracao:detalhes_veiculo', pk=self.object.pk)
+                return redirect('administracao:detalhes_veiculo', pk=self.object.pk)
             else:
                 messages.error(request, 'Erro ao atualizar as informações do veículo.')
                 return self.get(request, *args, **kwargs)
@@ -303,23 +336,64 @@ class CarroDetailView(LoginRequiredMixin, DetailView):
         return super().get(request, *args, **kwargs)
 
 # View AJAX para atualizar ordem das fotos
+@login_required
+@require_POST
 def atualizar_ordem_fotos(request, pk):
-    """View AJAX para atualizar a ordem das fotos"""
-    if request.method == 'POST' and request.is_ajax():
-        carro = get_object_or_404(Carro, pk=pk)
+    """View AJAX para atualizar a ordem das fotos.
+
+    Recebe os ids na nova ordem (foto_ids[] no formulário ou {"foto_ids": [...]}
+    em JSON). As fotos não enviadas ficam depois, na ordem em que já estavam.
+    Custo constante: uma leitura das fotos do carro e um único bulk_update.
+    """
+    if request.content_type == 'application/json':
+        try:
+            foto_ids = json.loads(request.body or b'{}').get('foto_ids', [])
+        except (ValueError, AttributeError):
+            return JsonResponse({'success': False, 'erro': 'JSON inválido.'}, status=400)
+    else:
         foto_ids = request.POST.getlist('foto_ids[]')
-        
-        for i, foto_id in enumerate(foto_ids, 1):
-            try:
-                foto = FotoCarro.objects.get(id=foto_id, carro=carro)
-                foto.ordem = i
-                foto.save(update_fields=['ordem'])
-            except FotoCarro.DoesNotExist:
-                continue
-        
-        return JsonResponse({'success': True})
     
-    return JsonResponse({'success': False})
+    try:
+        foto_ids = [int(foto_id) for foto_id in foto_ids]
+    except (TypeError, ValueError):
+        return JsonResponse({'success': False, 'erro': 'Identificadores de foto inválidos.'}, status=400)
+    if not foto_ids or len(set(foto_ids)) != len(foto_ids):
+        return JsonResponse({'success': False, 'erro': 'Lista de fotos vazia ou com repetições.'}, status=400)
+    
+    with transaction.atomic():
+        fotos = {
+            foto.id: foto
+            for foto in FotoCarro.objects.select_for_update().filter(carro_id=pk).only('id', 'ordem', 'carro_id')
+        }
+        if not fotos and not Carro.objects.filter(pk=pk).exists():
+            raise Http404('Carro não encontrado')
+        
+        desconhecidas = [foto_id for foto_id in foto_ids if foto_id not in fotos]
+        if desconhecidas:
+            return JsonResponse({
+                'success': False,
+                'erro': 'Há fotos que não pertencem a este carro.',
+                'foto_ids_invalidos': desconhecidas,
+            }, status=400)
+        
+        enviadas = set(foto_ids)
+        restantes = sorted(
+            (foto for foto_id, foto in fotos.items() if foto_id not in enviadas),
+            key=lambda foto: (foto.ordem, foto.id)
+        )
+        nova_ordem = [fotos[foto_id] for foto_id in foto_ids] + restantes
+        for posicao, foto in enumerate(nova_ordem, 1):
+            foto.ordem = posicao
+        FotoCarro.objects.bulk_update(nova_ordem, ['ordem'])
+        
+        # bulk_update não dispara sinais: atualizar capa e caches aqui
+        atualizar_foto_capa([pk])
+        invalidar(ESTOQUE)
+    
+    return JsonResponse({
+        'success': True,
+        'ordem': [{'id': foto.id, 'ordem': foto.ordem} for foto in nova_ordem],
+    })
 
 # MARCAS CORES E MODELOS
 class GerenciamentoView(LoginRequiredMixin, ListView):
@@ -483,10 +557,101 @@ def deletar_cor(request, pk):
     return redirect('administracao:gerenciamento?tab=cores')
 
 
+@etag(lambda request: catalogo_modelos().etag)
 def obter_modelos_por_marca(request):
-    """View AJAX para obter modelos de uma marca específica"""
-    marca_id = request.GET.get('marca_id')
-    if marca_id:
-        modelos = Modelo.objects.filter(marca_id=marca_id, ativo=True).values('id', 'nome')
-        return JsonResponse({'modelos': list(modelos)})
-    return JsonResponse({'modelos': []})
\ No newline at end of file
+    """View AJAX para obter os modelos de uma marca específica.
+
+    Com ?todas=1 devolve o mapa completo {marca_id: [modelos]}, para o cliente
+    carregar tudo de uma vez. As respostas vêm já serializadas da memória e o
+    navegador revalida-as com If-None-Match (304 enquanto nada mudar).
+    """
+    catalogo = catalogo_modelos()
+    if request.GET.get('todas'):
+        corpo = catalogo.json_todas
+    else:
+        try:
+            corpo = catalogo.json_marca(int(request.GET.get('marca_id', '')))
+        except ValueError:
+            corpo = catalogo.VAZIO
+    response = HttpResponse(corpo, content_type='application/json')
+    patch_cache_control(response, no_cache=True)
+    return response
+
+# Máximo de linhas com erros mostradas na página (o comando gera o relatório completo)
+ERROS_NA_PAGINA = 200
+
+
+@staff_member_required
+def importar_veiculos(request):
+    """Importação de estoque em lote; ?modelo=1 devolve um CSV vazio com as colunas esperadas"""
+    if request.GET.get('modelo'):
+        response = HttpResponse(';'.join(importacao.COLUNAS) + '\r\n', content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="modelo_importacao_carros.csv"'
+        return response
+
+    resultado = None
+    if request.method == 'POST':
+        form = ImportacaoCarrosForm(request.POST, request.FILES)
+        if form.is_valid():
+            arquivo = form.cleaned_data['arquivo']
+            try:
+                resultado = importacao.importar(
+                    importacao.ler(arquivo, arquivo.name), form.cleaned_data['funcionario'],
+                    simular=form.cleaned_data['simular'],
+                )
+            except ValidationError as erro:
+                form.add_error('arquivo', erro)
+    else:
+        funcionario = getattr(request.user, 'funcionario_profile', None)
+        form = ImportacaoCarrosForm(initial={'funcionario': funcionario.pk if funcionario else None})
+
+    return render(request, 'veiculos/importar.html', {
+        'form': form,
+        'resultado': resultado,
+        'erros': resultado.erros[:ERROS_NA_PAGINA] if resultado else [],
+        'colunas': importacao.COLUNAS,
+        'obrigatorias': importacao.OBRIGATORIAS,
+    })
+
+
+# Exportações para a contabilidade (CSV ou JSON Lines, em streaming)
+
+# As colunas do carro seguem as da importação (importacao.COLUNAS, sem opcionais)
+EXPORTACAO_CARROS = Exportacao('carros', (
+    ('id', 'id'),
+    ('marca', 'modelo__marca__nome'),
+    ('modelo', 'modelo__nome'),
+    ('cor', 'cor__nome'),
+    *((campo, campo) for campo in importacao.CAMPOS_CARRO),
+    ('data_entrada', 'data_entrada'),
+))
+
+EXPORTACAO_MOVIMENTACOES = Exportacao('movimentacoes', (
+    ('id', 'id'),
+    ('data', 'data_movimentacao'),
+    ('tipo', 'tipo_movimentacao'),
+    ('carro_id', 'carro_id'),
+    ('chassi', 'carro__chassi'),
+    ('matricula', 'carro__matricula'),
+    ('funcionario', 'funcionario__nome'),
+    ('venda_id', 'venda_id'),
+    ('aluguel_id', 'aluguel_id'),
+    ('observacoes', 'observacoes'),
+))
+
+
+@staff_member_required
+def exportar_veiculos(request):
+    """Estoque com os filtros da listagem (?search=, ?marca=, ...); ?formato=csv|jsonl"""
+    carros = filtrar_carros(Carro.objects.all(), request.GET, ordenar=False)
+    return EXPORTACAO_CARROS.resposta(carros, request.GET.get('formato', 'csv'))
+
+
+@staff_member_required
+def exportar_movimentacoes(request):
+    """Movimentações de estoque; filtros ?de=, ?ate=, ?tipo=, ?carro="""
+    movimentacoes = filtrar(
+        MovimentacaoEstoque.objects.all(), request.GET, 'data_movimentacao',
+        tipo='tipo_movimentacao', carro='carro_id',
+    )
+    return EXPORTACAO_MOVIMENTACOES.resposta(movimentacoes, request.GET.get('formato', 'csv'))
@@ -0,0 +1,165 @@
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import Case, Count, IntegerField, Max, Min, Value, When
+from django.utils import timezone
+
+from apps.usuarios.models import Funcionario
+from .models import TaxaComissao, Venda
+from .periodos import CENTAVO, em_kwanzas, intervalo, limites, soma_centavos
+
+
+# Comissões de venda.
+#
+# Cada venda finalizada paga ao funcionário a taxa em vigor no dia da venda
+# (TaxaComissao); sem histórico vale a taxa atual (Funcionario.comissao_venda).
+#
+# O intervalo pedido é cortado em trechos nos inícios dos períodos e nos dias
+# em que alguma taxa muda, e as vendas são somadas numa única consulta
+# agrupada por funcionário e trecho, em centavos inteiros. Dentro de um trecho
+# cada funcionário tem uma só taxa, aplicada em Python sobre o total. O
+# resultado da consulta tem funcionários x trechos linhas, qualquer que seja o
+# número de vendas, e a comissão de cada grupo (centavos x taxa) é exata: o
+# arredondamento ao centavo é feito uma vez, no total de cada período.
+
+# Início da taxa que fica em vigor para trás quando um funcionário sem histórico muda de taxa
+INICIO_HISTORICO = date(2000, 1, 1)
+
+
+class HistoricoTaxas:
+    """Taxas de comissão dos funcionários ao longo do tempo, lidas de uma vez"""
+
+    def __init__(self, funcionario_ids=None):
+        taxas = TaxaComissao.objects.order_by('funcionario_id', 'vigente_desde')
+        atuais = Funcionario.objects.all()
+        if funcionario_ids is not None:
+            taxas = taxas.filter(funcionario_id__in=funcionario_ids)
+            atuais = atuais.filter(pk__in=funcionario_ids)
+
+        self._datas, self._percentuais = {}, {}
+        for funcionario_id, vigente_desde, percentual in taxas.values_list(
+            'funcionario_id', 'vigente_desde', 'percentual'
+        ):
+            self._datas.setdefault(funcionario_id, []).append(vigente_desde)
+            self._percentuais.setdefault(funcionario_id, []).append(percentual)
+        self._atuais = dict(atuais.values_list('id', 'comissao_venda'))
+
+    def taxa(self, funcionario_id, dia):
+        """Percentual em vigor para o funcionário no dia"""
+        datas = self._datas.get(funcionario_id, ())
+        posicao = bisect_right(datas, dia) - 1
+        if posicao >= 0:
+            return self._percentuais[funcionario_id][posicao]
+        return self._atuais.get(funcionario_id) or Decimal(0)
+
+    def mudancas(self, inicio, fim):
+        """Dias de ]inicio, fim] em que a taxa de algum funcionário muda"""
+        return {dia for datas in self._datas.values() for dia in datas if inicio < dia <= fim}
+
+
+def comissao_exata(centavos, taxa):
+    """Comissão em centavos x percentual, sem arredondamento (somável entre grupos)"""
+    return Decimal(centavos or 0) * taxa
+
+
+def arredondar(exata):
+    """Comissão em kwanzas, arredondada ao centavo, a partir da soma de comissao_exata"""
+    return (exata / 10000).quantize(CENTAVO, ROUND_HALF_UP)
+
+
+def _meia_noite(dia):
+    return timezone.make_aware(datetime.combine(dia, time.min))
+
+
+def _trecho(campo, cortes, primeiro=0):
+    """Índice do trecho (em `cortes`, dias por ordem) em que cai o valor do campo.
+
+    CASE aninhados numa busca binária: cada linha faz log2(trechos)
+    comparações, sem funções Python por linha (no SQLite, TruncDate é uma).
+    """
+    if len(cortes) == 1:
+        return Value(primeiro)
+    meio = len(cortes) // 2
+    return Case(
+        When(**{f'{campo}__gte': _meia_noite(cortes[meio])}, then=_trecho(campo, cortes[meio:], primeiro + meio)),
+        default=_trecho(campo, cortes[:meio], primeiro),
+        output_field=IntegerField(),
+    )
+
+
+def calcular(inicio, fim, periodo=None, funcionario_ids=None):
+    """Comissões por funcionário das vendas finalizadas nos dias [inicio, fim].
+
+    Com `periodo` ('diario', 'semanal', 'mensal' ou 'anual') sai uma linha por
+    funcionário e período, cortado pelo intervalo pedido; sem ele, uma linha
+    por funcionário para o intervalo todo. Sem `inicio` ou `fim` o intervalo
+    vai da primeira à última venda. Cada linha traz também o valor vendido a
+    cada taxa, para o recibo de pagamento.
+    """
+    vendas = Venda.objects.filter(status='finalizada', **intervalo('data_venda', inicio, fim))
+    if funcionario_ids is not None:
+        vendas = vendas.filter(funcionario_id__in=funcionario_ids)
+    if inicio is None or fim is None:
+        extremos = vendas.aggregate(primeira=Min('data_venda'), ultima=Max('data_venda'))
+        if extremos['primeira'] is None:
+            return []
+        inicio = inicio or timezone.localdate(extremos['primeira'])
+        fim = fim or timezone.localdate(extremos['ultima'])
+
+    historico = HistoricoTaxas(funcionario_ids)
+    cortes = {inicio} | historico.mudancas(inicio, fim)
+    dia = inicio
+    while periodo and dia <= fim:
+        cortes.add(dia)
+        dia = limites(periodo, dia)[1] + timedelta(days=1)
+    cortes = sorted(cortes)
+
+    totais = {}
+    for linha in vendas.annotate(trecho=_trecho('data_venda', cortes)).values(
+        'funcionario_id', 'trecho'
+    ).annotate(quantidade=Count('id'), centavos=soma_centavos('valor_venda')).order_by():
+        dia = cortes[linha['trecho']]
+        chave = (linha['funcionario_id'], max(limites(periodo, dia)[0], inicio) if periodo else inicio)
+        total = totais.setdefault(chave, {'quantidade': 0, 'exata': Decimal(0), 'taxas': {}})
+        taxa = historico.taxa(linha['funcionario_id'], dia)
+        total['quantidade'] += linha['quantidade']
+        total['exata'] += comissao_exata(linha['centavos'], taxa)
+        total['taxas'][taxa] = total['taxas'].get(taxa, 0) + linha['centavos']
+
+    resultado = []
+    for funcionario_id, inicio_linha in sorted(totais, key=lambda chave: (chave[1], chave[0])):
+        total = totais[(funcionario_id, inicio_linha)]
+        resultado.append({
+            'funcionario_id': funcionario_id,
+            'inicio': inicio_linha,
+            'fim': min(limites(periodo, inicio_linha)[1], fim) if periodo else fim,
+            'quantidade_vendas': total['quantidade'],
+            'valor_total_vendas': em_kwanzas(sum(total['taxas'].values())),
+            'valor_comissao': arredondar(total['exata']),
+            'taxas': {taxa: em_kwanzas(centavos) for taxa, centavos in sorted(total['taxas'].items())},
+        })
+    return resultado
+
+
+def registrar_taxa(funcionario, percentual_anterior, dia=None):
+    """Regista no histórico a taxa atual do funcionário, em vigor a partir do dia (hoje por omissão).
+
+    Sem histórico, a taxa anterior passa a valer desde INICIO_HISTORICO, para
+    as vendas já feitas manterem a comissão. A nova taxa vale para as vendas
+    do próprio dia. Grava com update/bulk_create, que não disparam os sinais
+    de TaxaComissao (esses reconstroem todos os relatórios).
+    """
+    dia = dia or timezone.localdate()
+    historico = TaxaComissao.objects.filter(funcionario_id=funcionario.pk)
+    novas = []
+    if not historico.exists():
+        novas.append(TaxaComissao(
+            funcionario_id=funcionario.pk, percentual=percentual_anterior, vigente_desde=INICIO_HISTORICO
+        ))
+    if not historico.filter(vigente_desde=dia).update(percentual=funcionario.comissao_venda):
+        novas.append(TaxaComissao(
+            funcionario_id=funcionario.pk, percentual=funcionario.comissao_venda, vigente_desde=dia
+        ))
+    TaxaComissao.objects.bulk_create(novas)
+    return dia
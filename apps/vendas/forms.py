@@ -0,0 +1,45 @@
+from django import forms
+
+from .models import Venda
+
+
+class VendaForm(forms.ModelForm):
+    """Dados da venda; o carro vem da URL e é reservado pelo serviço"""
+
+    status = forms.ChoiceField(
+        label='Status',
+        choices=[opcao for opcao in Venda.STATUS_CHOICES if opcao[0] != 'cancelada'],
+        initial='finalizada',
+    )
+
+    class Meta:
+        model = Venda
+        fields = [
+            'cliente', 'funcionario', 'valor_venda', 'valor_entrada', 'valor_financiado',
+            'tipo_pagamento', 'forma_pagamento', 'banco_financiamento', 'numero_parcelas',
+            'status', 'observacoes',
+        ]
+        widgets = {
+            'observacoes': forms.Textarea(attrs={'rows': 2}),
+            'valor_venda': forms.NumberInput(attrs={'step': '0.01'}),
+            'valor_entrada': forms.NumberInput(attrs={'step': '0.01'}),
+            'valor_financiado': forms.NumberInput(attrs={'step': '0.01'}),
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['cliente'].queryset = self.fields['cliente'].queryset.order_by('nome')
+        self.fields['funcionario'].queryset = self.fields['funcionario'].queryset.order_by('nome')
+        for campo in self.fields.values():
+            campo.widget.attrs['class'] = 'form-select' if isinstance(campo.widget, forms.Select) else 'form-control'
+
+    def clean(self):
+        dados = super().clean()
+        valor = dados.get('valor_venda')
+        entrada = dados.get('valor_entrada') or 0
+        financiado = dados.get('valor_financiado') or 0
+        if valor is not None and entrada + financiado > valor:
+            raise forms.ValidationError('A entrada e o valor financiado não podem ultrapassar o valor da venda.')
+        if dados.get('tipo_pagamento') in ('financiado', 'misto') and not dados.get('numero_parcelas'):
+            self.add_error('numero_parcelas', 'Indique o número de parcelas do financiamento.')
+        return dados
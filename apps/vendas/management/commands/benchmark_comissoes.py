@@ -0,0 +1,148 @@
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.core.dados_sinteticos import datas_historicas
+from apps.usuarios.models import Cliente, Funcionario
+from apps.veiculos.models import Carro, Cor, Marca, Modelo
+from apps.vendas import comissoes
+from apps.vendas.models import TaxaComissao, Venda
+from apps.vendas.periodos import intervalo, limites
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede o cálculo de comissões com um volume sintético de vendas. '
+        'Tudo é criado numa transação desfeita no fim: o banco fica como estava.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendas', type=int, default=1000000, help='Número de vendas sintéticas')
+        parser.add_argument('--funcionarios', type=int, default=50, help='Número de funcionários')
+        parser.add_argument('--meses', type=int, default=36, help='Meses de histórico por onde as vendas se espalham')
+        parser.add_argument('--lote', type=int, default=20000, help='Vendas por bulk_create')
+        parser.add_argument(
+            '--sem-ingenuo', action='store_true',
+            help='Não mede o cálculo venda a venda (lê o funcionário e a taxa de cada venda do mês)',
+        )
+
+    def handle(self, *args, **options):
+        if min(options['vendas'], options['funcionarios'], options['meses'], options['lote']) < 1:
+            raise CommandError('--vendas, --funcionarios, --meses e --lote têm de ser positivos.')
+
+        with transaction.atomic():
+            mes = self._popular(options)
+            self._medir(mes, options)
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Dados do benchmark descartados.'))
+
+    def _popular(self, options):
+        rng = random.Random(0)
+        hoje = timezone.localdate()
+        fim = limites('mensal', hoje.replace(day=1) - timedelta(days=1))[1]
+        inicio = fim.replace(day=1)
+        for _ in range(options['meses'] - 1):
+            inicio = (inicio - timedelta(days=1)).replace(day=1)
+        dias = (fim - inicio).days + 1
+
+        modelo = Modelo.objects.create(marca=Marca.objects.create(nome='Benchmark'), nome='Comissões', categoria='sedan')
+        carro = Carro.objects.create(
+            modelo=modelo, cor=Cor.objects.create(nome='Benchmark'), ano_fabricacao=2020, ano_modelo=2020,
+            condicao='usado', combustivel='gasolina', transmissao='manual',
+            chassi='BENCHCOMISSOES001', matricula='BC-00-00',
+        )
+        cliente = Cliente.objects.create(nome='Cliente Benchmark', bilhete_identidade='BENCHMARK000LA00')
+        funcionarios = Funcionario.objects.bulk_create([
+            Funcionario(nome=f'Vendedor {n}', bilhete_identidade=f'BENCH{n:09d}LA', comissao_venda=Decimal('2.00'))
+            for n in range(options['funcionarios'])
+        ])
+        # Uma a três taxas por funcionário, mudando em datas dentro do histórico
+        TaxaComissao.objects.bulk_create([
+            TaxaComissao(
+                funcionario=funcionario, percentual=Decimal(rng.choice(('1.00', '1.50', '2.25', '2.50', '3.00'))),
+                vigente_desde=comissoes.INICIO_HISTORICO if n == 0 else inicio + timedelta(days=rng.randrange(dias)),
+            )
+            for funcionario in funcionarios for n in range(rng.randint(1, 3))
+        ], ignore_conflicts=True)
+
+        inicio_insercao = time.perf_counter()
+        origem = timezone.make_aware(datetime.combine(inicio, datetime.min.time()))
+        segundos = dias * 86400
+        with datas_historicas():
+            for primeiro in range(0, options['vendas'], options['lote']):
+                Venda.objects.bulk_create([
+                    Venda(
+                        carro=carro, cliente=cliente, funcionario=rng.choice(funcionarios),
+                        valor_venda=Decimal(rng.randrange(50000000, 3000000000)) / 100,
+                        tipo_pagamento='a_vista',
+                        status='finalizada' if rng.random() < 0.9 else rng.choice(('pendente', 'cancelada')),
+                        data_venda=origem + timedelta(seconds=rng.randrange(segundos)),
+                    )
+                    for _ in range(min(options['lote'], options['vendas'] - primeiro))
+                ])
+        self.stdout.write(
+            f'{options["vendas"]} vendas de {inicio:%m/%Y} a {fim:%m/%Y} inseridas em '
+            f'{time.perf_counter() - inicio_insercao:.1f}s'
+        )
+        if connection.vendor == 'sqlite':
+            # Estatísticas atualizadas para o planeador escolher o índice das vendas finalizadas
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        return limites('mensal', fim)
+
+    def _cronometrar(self, descricao, funcao, memoria=True):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        mensagem = f'{descricao}: {time.perf_counter() - inicio:.2f}s'
+        if memoria:
+            # Segunda execução só para a memória: o tracemalloc deixa o Python bem mais lento
+            tracemalloc.start()
+            funcao()
+            mensagem += f', pico de memória {tracemalloc.get_traced_memory()[1] / 1024 / 1024:.1f} MB'
+            tracemalloc.stop()
+        self.stdout.write(mensagem)
+        return resultado
+
+    def _medir(self, mes, options):
+        inicio, fim = mes
+        folha = self._cronometrar(
+            f'Folha de {inicio:%m/%Y}', lambda: comissoes.calcular(inicio, fim)
+        )
+        self.stdout.write(
+            f'  {len(folha)} funcionários, {sum(linha["quantidade_vendas"] for linha in folha)} vendas, '
+            f'{sum(linha["valor_comissao"] for linha in folha)} Kz de comissões'
+        )
+        historico = self._cronometrar(
+            'Histórico completo por mês', lambda: comissoes.calcular(None, None, 'mensal')
+        )
+        self.stdout.write(f'  {len(historico)} linhas (funcionário x mês)')
+
+        if not options['sem_ingenuo']:
+            self._comparar_ingenuo(inicio, fim, folha)
+
+    def _comparar_ingenuo(self, inicio, fim, folha):
+        """Uma venda de cada vez, a ler o funcionário e a taxa do dia: o custo que o motor evita"""
+        def ingenuo():
+            exatas = {}
+            vendas = Venda.objects.filter(status='finalizada', **intervalo('data_venda', inicio, fim))
+            for venda in vendas.iterator():
+                funcionario = Funcionario.objects.get(pk=venda.funcionario_id)
+                taxa = TaxaComissao.objects.filter(
+                    funcionario=funcionario, vigente_desde__lte=timezone.localdate(venda.data_venda)
+                ).order_by('-vigente_desde').values_list('percentual', flat=True).first()
+                if taxa is None:
+                    taxa = funcionario.comissao_venda
+                exatas[funcionario.pk] = exatas.get(funcionario.pk, 0) + venda.valor_venda * 100 * taxa
+            return {pk: comissoes.arredondar(exata) for pk, exata in exatas.items()}
+
+        esperado = self._cronometrar(f'Venda a venda, {inicio:%m/%Y}', ingenuo, memoria=False)
+        obtido = {linha['funcionario_id']: linha['valor_comissao'] for linha in folha}
+        if obtido != esperado:
+            raise CommandError('O motor de comissões e o cálculo venda a venda não coincidem.')
+        self.stdout.write('  comissões iguais às do motor, ao centavo')
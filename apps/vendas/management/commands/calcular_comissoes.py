@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.usuarios.models import Funcionario
+from apps.vendas import comissoes
+from apps.vendas.periodos import PERIODOS, limites
+
+
+class Command(BaseCommand):
+    help = 'Calcula as comissões de venda de um mês por funcionário (folha de pagamento)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mes', help='Mês no formato AAAA-MM (padrão: o mês anterior)')
+        parser.add_argument(
+            '--periodo', choices=PERIODOS, help='Divide o mês em períodos (ex.: semanal); padrão: o mês inteiro'
+        )
+        parser.add_argument(
+            '--funcionario', type=int, action='append', dest='funcionarios',
+            help='Só este funcionário (id); pode ser repetido',
+        )
+
+    def handle(self, *args, **options):
+        if options['mes']:
+            try:
+                dia = datetime.strptime(options['mes'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('--mes tem de estar no formato AAAA-MM.')
+        else:
+            dia = timezone.localdate().replace(day=1) - timedelta(days=1)
+        inicio, fim = limites('mensal', dia)
+
+        linhas = comissoes.calcular(inicio, fim, options['periodo'], options['funcionarios'])
+        nomes = dict(
+            Funcionario.objects.filter(pk__in={linha['funcionario_id'] for linha in linhas})
+            .values_list('id', 'nome')
+        )
+
+        self.stdout.write(f'Comissões de {inicio:%d/%m/%Y} a {fim:%d/%m/%Y}')
+        total = 0
+        for linha in linhas:
+            taxas = ', '.join(f'{valor} Kz a {taxa}%' for taxa, valor in linha['taxas'].items())
+            self.stdout.write(
+                f'{linha["inicio"]:%d/%m} a {linha["fim"]:%d/%m}  '
+                f'{nomes.get(linha["funcionario_id"], linha["funcionario_id"])}: '
+                f'{linha["quantidade_vendas"]} vendas ({taxas}) -> {linha["valor_comissao"]} Kz'
+            )
+            total += linha['valor_comissao']
+        self.stdout.write(self.style.SUCCESS(f'Total de comissões: {total} Kz.'))
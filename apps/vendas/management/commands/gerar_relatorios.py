@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.vendas import relatorios
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói os relatórios de vendas e aluguéis (RelatorioVendas) a partir das transações'
+
+    def handle(self, *args, **options):
+        total = relatorios.reconstruir()
+        self.stdout.write(self.style.SUCCESS(f'Relatórios gerados a partir de {total} dias de atividade.'))
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.5 on 2026-10-17 02:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0001_initial'),
+        ('vendas', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatorioVendas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.CharField(choices=[('diario', 'Diário'), ('semanal', 'Semanal'), ('mensal', 'Mensal'), ('anual', 'Anual')], max_length=10, verbose_name='Período')),
+                ('data_inicio', models.DateField(verbose_name='Data de Início')),
+                ('data_fim', models.DateField(verbose_name='Data de Fim')),
+                ('quantidade_vendas', models.PositiveIntegerField(default=0, verbose_name='Quantidade de Vendas')),
+                ('valor_total_vendas', models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='Valor Total de Vendas (Kz)')),
+                ('valor_comissoes', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Valor das Comissões (Kz)')),
+                ('quantidade_alugueis', models.PositiveIntegerField(default=0, verbose_name='Quantidade de Aluguéis')),
+                ('valor_total_alugueis', models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='Valor Total de Aluguéis (Kz)')),
+                ('data_geracao', models.DateTimeField(auto_now_add=True, verbose_name='Data de Geração')),
+                ('funcionario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='usuarios.funcionario', verbose_name='Funcionário')),
+            ],
+            options={
+                'verbose_name': 'Relatório de Vendas',
+                'verbose_name_plural': 'Relatórios de Vendas',
+                'db_table': 'relatorio_vendas',
+                'ordering': ['-data_geracao'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('funcionario__isnull', False)), fields=('periodo', 'data_inicio', 'funcionario'), name='relatorio_periodo_funcionario_unico'), models.UniqueConstraint(condition=models.Q(('funcionario__isnull', True)), fields=('periodo', 'data_inicio'), name='relatorio_periodo_geral_unico')],
+            },
+        ),
+    ]
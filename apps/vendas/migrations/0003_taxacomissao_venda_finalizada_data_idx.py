@@ -0,0 +1,35 @@
+# Generated by Django 5.1.5 on 2026-10-17 02:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0001_initial'),
+        ('vendas', '0002_relatoriovendas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaxaComissao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('percentual', models.DecimalField(decimal_places=2, max_digits=5, verbose_name='Comissão de Venda (%)')),
+                ('vigente_desde', models.DateField(verbose_name='Em Vigor Desde')),
+                ('funcionario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='taxas_comissao', to='usuarios.funcionario', verbose_name='Funcionário')),
+            ],
+            options={
+                'verbose_name': 'Taxa de Comissão',
+                'verbose_name_plural': 'Taxas de Comissão',
+                'db_table': 'taxa_comissao',
+                'ordering': ['funcionario', '-vigente_desde'],
+                'constraints': [models.UniqueConstraint(fields=('funcionario', 'vigente_desde'), name='taxa_comissao_funcionario_data_unica')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='venda',
+            index=models.Index(condition=models.Q(('status', 'finalizada')), fields=['data_venda', 'funcionario', 'valor_venda'], name='venda_finalizada_data_idx'),
+        ),
+    ]
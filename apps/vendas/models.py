@@ -108,6 +108,14 @@ class Venda(models.Model):
         verbose_name = 'Venda'
         verbose_name_plural = 'Vendas'
         ordering = ['-data_venda']
+        indexes = [
+            # Comissões e relatórios: vendas finalizadas de um intervalo, sem ler a tabela
+            models.Index(
+                fields=['data_venda', 'funcionario', 'valor_venda'],
+                condition=models.Q(status='finalizada'),
+                name='venda_finalizada_data_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"Venda #{self.id} - {self.carro} - {self.cliente.nome}"
@@ -144,4 +152,125 @@ class DocumentoVenda(models.Model):
         ordering = ['-data_upload']
     
     def __str__(self):
-        return f"{self.tipo_documento} - Venda #{self.venda.id}"
\ No newline at end of file
+        return f"{self.tipo_documento} - Venda #{self.venda.id}"
+
+class RelatorioVendas(models.Model):
+    """Totais de vendas e aluguéis por período, materializados pelo motor de relatórios.
+
+    Cada linha cobre um período (dia, semana, mês ou ano) de um funcionário;
+    a linha sem funcionário é o total geral da concessionária nesse período.
+    """
+    
+    PERIODO_CHOICES = (
+        ('diario', 'Diário'),
+        ('semanal', 'Semanal'),
+        ('mensal', 'Mensal'),
+        ('anual', 'Anual'),
+    )
+    
+    periodo = models.CharField(
+        'Período',
+        max_length=10,
+        choices=PERIODO_CHOICES
+    )
+    
+    data_inicio = models.DateField('Data de Início')
+    data_fim = models.DateField('Data de Fim')
+    
+    funcionario = models.ForeignKey(
+        Funcionario,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name='Funcionário'
+    )
+    
+    # Métricas de vendas
+    quantidade_vendas = models.PositiveIntegerField('Quantidade de Vendas', default=0)
+    valor_total_vendas = models.DecimalField(
+        'Valor Total de Vendas (Kz)',
+        max_digits=15,
+        decimal_places=2,
+        default=0
+    )
+    
+    valor_comissoes = models.DecimalField(
+        'Valor das Comissões (Kz)',
+        max_digits=12,
+        decimal_places=2,
+        default=0
+    )
+    
+    # Métricas de aluguel
+    quantidade_alugueis = models.PositiveIntegerField('Quantidade de Aluguéis', default=0)
+    valor_total_alugueis = models.DecimalField(
+        'Valor Total de Aluguéis (Kz)',
+        max_digits=15,
+        decimal_places=2,
+        default=0
+    )
+    
+    data_geracao = models.DateTimeField('Data de Geração', auto_now_add=True)
+    
+    class Meta:
+        db_table = 'relatorio_vendas'
+        verbose_name = 'Relatório de Vendas'
+        verbose_name_plural = 'Relatórios de Vendas'
+        ordering = ['-data_geracao']
+        constraints = [
+            # Uma linha por período e funcionário, e uma linha geral por período
+            models.UniqueConstraint(
+                fields=['periodo', 'data_inicio', 'funcionario'],
+                condition=models.Q(funcionario__isnull=False),
+                name='relatorio_periodo_funcionario_unico',
+            ),
+            models.UniqueConstraint(
+                fields=['periodo', 'data_inicio'],
+                condition=models.Q(funcionario__isnull=True),
+                name='relatorio_periodo_geral_unico',
+            ),
+        ]
+    
+    def __str__(self):
+        if self.funcionario:
+            return f"Relatório {self.get_periodo_display()} - {self.funcionario.nome} - {self.data_inicio} a {self.data_fim}"
+        return f"Relatório {self.get_periodo_display()} - Geral - {self.data_inicio} a {self.data_fim}"
+
+
+class TaxaComissao(models.Model):
+    """Histórico das taxas de comissão de um funcionário.
+
+    Cada venda paga a taxa em vigor no dia em que foi feita: a taxa com a
+    maior data de início que não seja posterior ao dia da venda.
+    """
+    
+    funcionario = models.ForeignKey(
+        Funcionario,
+        on_delete=models.CASCADE,
+        verbose_name='Funcionário',
+        related_name='taxas_comissao'
+    )
+    
+    percentual = models.DecimalField(
+        'Comissão de Venda (%)',
+        max_digits=5,
+        decimal_places=2
+    )
+    
+    vigente_desde = models.DateField('Em Vigor Desde')
+    
+    class Meta:
+        db_table = 'taxa_comissao'
+        verbose_name = 'Taxa de Comissão'
+        verbose_name_plural = 'Taxas de Comissão'
+        ordering = ['funcionario', '-vigente_desde']
+        constraints = [
+            # Também serve de índice à procura da taxa em vigor numa data
+            models.UniqueConstraint(
+                fields=['funcionario', 'vigente_desde'],
+                name='taxa_comissao_funcionario_data_unica',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.funcionario.nome} - {self.percentual}% desde {self.vigente_desde:%d/%m/%Y}"
@@ -0,0 +1,45 @@
+import calendar
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import BigIntegerField, F, Sum
+from django.db.models.functions import Cast, Round
+from django.utils import timezone
+
+
+# Períodos e valores em dinheiro partilhados pelos relatórios e pelas comissões
+
+PERIODOS = ('diario', 'semanal', 'mensal', 'anual')
+
+CENTAVO = Decimal('0.01')
+
+
+def limites(periodo, dia):
+    """(início, fim) do período que contém o dia; a semana começa à segunda-feira"""
+    if periodo == 'diario':
+        return dia, dia
+    if periodo == 'semanal':
+        inicio = dia - timedelta(days=dia.weekday())
+        return inicio, inicio + timedelta(days=6)
+    if periodo == 'mensal':
+        return dia.replace(day=1), dia.replace(day=calendar.monthrange(dia.year, dia.month)[1])
+    return date(dia.year, 1, 1), date(dia.year, 12, 31)
+
+
+def soma_centavos(campo):
+    """Soma exata em centavos: no SQLite os decimais são REAL e a soma direta acumula erro"""
+    return Sum(Cast(Round(F(campo) * 100), BigIntegerField()))
+
+
+def em_kwanzas(centavos):
+    return (Decimal(centavos or 0) / 100).quantize(CENTAVO)
+
+
+def intervalo(campo, inicio, fim):
+    """Filtro de um campo de data/hora para os dias [inicio, fim] no fuso local"""
+    filtros = {}
+    if inicio is not None:
+        filtros[f'{campo}__gte'] = timezone.make_aware(datetime.combine(inicio, time.min))
+    if fim is not None:
+        filtros[f'{campo}__lt'] = timezone.make_aware(datetime.combine(fim + timedelta(days=1), time.min))
+    return filtros
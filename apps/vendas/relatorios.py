@@ -0,0 +1,233 @@
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from apps.alugueis.models import Aluguel, PagamentoAluguel
+from . import comissoes
+from .models import RelatorioVendas, Venda
+from .periodos import PERIODOS, em_kwanzas, intervalo, limites, soma_centavos
+
+
+# Relatórios materializados (RelatorioVendas).
+#
+# A unidade calculada a partir das tabelas de vendas e aluguéis é o dia de um
+# funcionário; semanas e meses são somas dos dias já materializados, anos são
+# somas dos meses, e a linha geral de cada período é a soma das linhas dos
+# funcionários. Uma venda ou pagamento novo recalcula um dia e sobe pelos
+# períodos que o contêm, sem voltar a percorrer as tabelas transacionais.
+
+# Período materializado de onde cada período maior é somado (o ano soma 12 meses, não 365 dias)
+FONTES = {'semanal': 'diario', 'mensal': 'diario', 'anual': 'mensal'}
+
+CONTAGENS = ('quantidade_vendas', 'quantidade_alugueis')
+VALORES = ('valor_total_vendas', 'valor_comissoes', 'valor_total_alugueis')
+
+_local = threading.local()
+
+
+def _vazio():
+    return {**{campo: 0 for campo in CONTAGENS}, **{campo: Decimal('0.00') for campo in VALORES}}
+
+
+def _somar(destino, origem):
+    for campo in CONTAGENS + VALORES:
+        destino[campo] += origem[campo]
+
+
+def calcular_dias(inicio=None, fim=None, funcionario_ids=None):
+    """{(funcionario_id, dia): métricas} lidas das vendas e aluguéis, numa consulta agrupada por tabela"""
+    vendas = Venda.objects.filter(status='finalizada', **intervalo('data_venda', inicio, fim))
+    alugueis = Aluguel.objects.exclude(status='cancelado')
+    if inicio is not None:
+        alugueis = alugueis.filter(data_inicio__gte=inicio)
+    if fim is not None:
+        alugueis = alugueis.filter(data_inicio__lte=fim)
+    pagamentos = PagamentoAluguel.objects.filter(**intervalo('data_pagamento', inicio, fim))
+    if funcionario_ids is not None:
+        vendas = vendas.filter(funcionario_id__in=funcionario_ids)
+        alugueis = alugueis.filter(funcionario_id__in=funcionario_ids)
+        pagamentos = pagamentos.filter(aluguel__funcionario_id__in=funcionario_ids)
+
+    dias = defaultdict(_vazio)
+    historico = comissoes.HistoricoTaxas(funcionario_ids)
+
+    for linha in vendas.annotate(dia=TruncDate('data_venda')).values('funcionario_id', 'dia').annotate(
+        quantidade=Count('id'), centavos=soma_centavos('valor_venda')
+    ).order_by():
+        metricas = dias[(linha['funcionario_id'], linha['dia'])]
+        metricas['quantidade_vendas'] = linha['quantidade']
+        metricas['valor_total_vendas'] = em_kwanzas(linha['centavos'])
+        # Taxa em vigor no dia; a comissão do dia é arredondada uma vez ao centavo
+        # (a paga ao funcionário sai de comissoes.calcular, arredondada no período)
+        metricas['valor_comissoes'] = comissoes.arredondar(comissoes.comissao_exata(
+            linha['centavos'], historico.taxa(linha['funcionario_id'], linha['dia'])
+        ))
+
+    for linha in alugueis.values('funcionario_id', 'data_inicio').annotate(quantidade=Count('id')).order_by():
+        dias[(linha['funcionario_id'], linha['data_inicio'])]['quantidade_alugueis'] = linha['quantidade']
+
+    for linha in pagamentos.annotate(dia=TruncDate('data_pagamento')).values(
+        'aluguel__funcionario_id', 'dia'
+    ).annotate(centavos=soma_centavos('valor')).order_by():
+        dias[(linha['aluguel__funcionario_id'], linha['dia'])]['valor_total_alugueis'] = em_kwanzas(
+            linha['centavos']
+        )
+    return dias
+
+
+def _acumular(dias, periodo):
+    """Soma os dias de cada funcionário nos períodos que os contêm"""
+    totais = defaultdict(_vazio)
+    for (funcionario_id, dia), metricas in dias.items():
+        _somar(totais[(funcionario_id, limites(periodo, dia)[0])], metricas)
+    return totais
+
+
+def _com_geral(totais):
+    """Acrescenta a linha geral (funcionario None) de cada período"""
+    geral = defaultdict(_vazio)
+    for (_, inicio), metricas in totais.items():
+        _somar(geral[(None, inicio)], metricas)
+    return {**totais, **geral}
+
+
+def _linhas(periodo, totais):
+    return [
+        RelatorioVendas(
+            periodo=periodo, funcionario_id=funcionario_id,
+            data_inicio=inicio, data_fim=limites(periodo, inicio)[1], **metricas,
+        )
+        for (funcionario_id, inicio), metricas in totais.items()
+        if any(metricas.values())
+    ]
+
+
+def reconstruir():
+    """Recalcula todos os relatórios a partir das tabelas de vendas e aluguéis"""
+    dias = calcular_dias()
+    with transaction.atomic():
+        RelatorioVendas.objects.all().delete()
+        for periodo in PERIODOS:
+            # Acumular a partir dos dias dá o mesmo que a soma incremental por FONTES
+            totais = dias if periodo == 'diario' else _acumular(dias, periodo)
+            RelatorioVendas.objects.bulk_create(_linhas(periodo, _com_geral(totais)), batch_size=1000)
+    return len(dias)
+
+
+def _substituir(periodo, chaves, totais):
+    """Troca as linhas materializadas das chaves (funcionario_id, início) pelos novos totais"""
+    for funcionario_id, inicio in chaves:
+        RelatorioVendas.objects.filter(
+            periodo=periodo, data_inicio=inicio, funcionario_id=funcionario_id
+        ).delete()
+    RelatorioVendas.objects.bulk_create(
+        _linhas(periodo, {chave: totais[chave] for chave in chaves if chave in totais})
+    )
+
+
+def atualizar(pares):
+    """Atualiza os relatórios afetados por mudanças nos dias (funcionario_id, dia) indicados"""
+    pares = {(funcionario_id, dia) for funcionario_id, dia in pares if funcionario_id is not None}
+    if not pares:
+        return 0
+    funcionario_ids = {funcionario_id for funcionario_id, _ in pares}
+    inicio = min(dia for _, dia in pares)
+    fim = max(dia for _, dia in pares)
+
+    with transaction.atomic():
+        # 1. Dias afetados, lidos das tabelas transacionais
+        dias = calcular_dias(inicio, fim, funcionario_ids)
+        _substituir('diario', pares, dias)
+
+        for periodo in PERIODOS:
+            chaves = {(funcionario_id, limites(periodo, dia)[0]) for funcionario_id, dia in pares}
+            inicio_periodo = min(inicio for _, inicio in chaves)
+            fim_periodo = max(limites(periodo, inicio)[1] for _, inicio in chaves)
+
+            # 2. Semanas, meses e anos dos funcionários: soma das linhas já materializadas
+            if periodo in FONTES:
+                totais = defaultdict(_vazio)
+                for linha in RelatorioVendas.objects.filter(
+                    periodo=FONTES[periodo], funcionario_id__in=funcionario_ids,
+                    data_inicio__gte=inicio_periodo, data_inicio__lte=fim_periodo,
+                ):
+                    chave = (linha.funcionario_id, limites(periodo, linha.data_inicio)[0])
+                    if chave in chaves:
+                        _somar(totais[chave], _metricas(linha))
+                _substituir(periodo, chaves, totais)
+
+            # 3. Linha geral do período: soma das linhas dos funcionários
+            inicios = {inicio for _, inicio in chaves}
+            geral = defaultdict(_vazio)
+            for linha in RelatorioVendas.objects.filter(
+                periodo=periodo, data_inicio__in=inicios, funcionario__isnull=False
+            ):
+                _somar(geral[(None, linha.data_inicio)], _metricas(linha))
+            _substituir(periodo, {(None, inicio) for inicio in inicios}, geral)
+    return len(pares)
+
+
+def _metricas(linha):
+    return {campo: getattr(linha, campo) for campo in CONTAGENS + VALORES}
+
+
+def _processar_pendentes():
+    pares = getattr(_local, 'pendentes', set())
+    _local.pendentes = set()
+    if getattr(_local, 'reconstruir', False):
+        _local.reconstruir = False
+        reconstruir()
+    elif pares:
+        atualizar(pares)
+
+
+def agendar(pares):
+    """Atualiza os relatórios dos dias (funcionario_id, dia) depois de a transação confirmar"""
+    if not hasattr(_local, 'pendentes'):
+        _local.pendentes = set()
+    _local.pendentes.update(pares)
+    transaction.on_commit(_processar_pendentes)
+
+
+def agendar_reconstrucao():
+    """Reconstrói tudo no commit (ex.: o histórico de taxas de comissão foi editado)"""
+    _local.reconstruir = True
+    transaction.on_commit(_processar_pendentes)
+
+
+def resumo_dashboard(hoje=None, total_meses=12):
+    """Dados do dashboard lidos só dos relatórios materializados (duas consultas)"""
+    hoje = hoje or timezone.localdate()
+    ano, mes = hoje.year, hoje.month - total_meses + 1
+    while mes <= 0:
+        ano, mes = ano - 1, mes + 12
+    meses = []
+    inicio = date(ano, mes, 1)
+    while inicio <= hoje:
+        meses.append(inicio)
+        inicio = limites('mensal', inicio)[1] + timedelta(days=1)
+
+    atuais = {periodo: limites(periodo, hoje)[0] for periodo in PERIODOS}
+    filtro = Q(periodo='mensal', data_inicio__in=meses)
+    for periodo, inicio in atuais.items():
+        filtro |= Q(periodo=periodo, data_inicio=inicio)
+    gerais = {
+        (linha.periodo, linha.data_inicio): _metricas(linha)
+        for linha in RelatorioVendas.objects.filter(filtro, funcionario__isnull=True)
+    }
+
+    return {
+        **{periodo: gerais.get((periodo, inicio)) or _vazio() for periodo, inicio in atuais.items()},
+        'meses': [{'inicio': inicio, **(gerais.get(('mensal', inicio)) or _vazio())} for inicio in meses],
+        'ranking': list(
+            RelatorioVendas.objects.filter(
+                periodo='mensal', data_inicio=atuais['mensal'], funcionario__isnull=False
+            ).select_related('funcionario').order_by('-valor_total_vendas', '-valor_total_alugueis')[:10]
+        ),
+    }
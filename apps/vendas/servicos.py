@@ -0,0 +1,51 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from apps.core.cache import ESTOQUE, invalidar
+from apps.veiculos import semelhantes
+from apps.veiculos.models import Carro, HistoricoStatusCarro, MovimentacaoEstoque
+from .models import Venda
+
+
+# Registo de uma venda.
+#
+# Tudo acontece numa transação: a reserva do carro, a Venda, a saída de
+# estoque e o histórico de status. A reserva é um UPDATE condicional
+# (disponivel_venda=True -> False) em vez de ler o carro e gravá-lo com
+# save(): o banco bloqueia a linha e só um de dois pedidos simultâneos
+# encontra o carro ainda disponível; o outro atualiza 0 linhas e a venda é
+# recusada sem escrever nada. Um carro vendido deixa também de estar
+# disponível para aluguel.
+#
+# update() não dispara os sinais de Carro, por isso o cache do estoque e os
+# semelhantes do carro são atualizados aqui, no commit.
+
+
+def registrar_venda(carro_id, cliente, funcionario, status='finalizada', observacoes_estoque='', **dados):
+    """Vende o carro ao cliente; `dados` são os restantes campos da Venda.
+
+    Levanta ValidationError se o carro já não estiver disponível para venda.
+    """
+    with transaction.atomic():
+        reservado = Carro.objects.filter(pk=carro_id, disponivel_venda=True).update(
+            disponivel_venda=False, disponivel_aluguel=False
+        )
+        if not reservado:
+            raise ValidationError({'carro': 'Este carro já não está disponível para venda.'})
+
+        venda = Venda.objects.create(
+            carro_id=carro_id, cliente=cliente, funcionario=funcionario, status=status, **dados
+        )
+        MovimentacaoEstoque.objects.create(
+            carro_id=carro_id, funcionario=funcionario, venda=venda,
+            tipo_movimentacao='saida_venda', observacoes=observacoes_estoque,
+        )
+        HistoricoStatusCarro.objects.create(
+            carro_id=carro_id, funcionario=funcionario, data_alteracao=timezone.now(),
+            status_anterior='disponivel', status_novo='vendido',
+            motivo=f'Venda #{venda.pk} ({venda.get_status_display().lower()})',
+        )
+        transaction.on_commit(lambda: invalidar(ESTOQUE))
+        semelhantes.agendar([carro_id])
+    return venda
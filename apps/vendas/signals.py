@@ -0,0 +1,79 @@
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from apps.alugueis.models import Aluguel, PagamentoAluguel
+from apps.usuarios.models import Funcionario
+from .models import TaxaComissao, Venda
+from . import comissoes, relatorios
+
+
+def _dia(valor):
+    """Dia local de uma data/hora (as vendas e pagamentos guardam a hora em UTC)"""
+    return timezone.localdate(valor) if hasattr(valor, 'hour') else valor
+
+
+# Relatórios materializados: o estado anterior também conta (funcionário ou data alterados)
+@receiver(pre_save, sender=Venda)
+@receiver(pre_save, sender=Aluguel)
+@receiver(pre_save, sender=PagamentoAluguel)
+def guardar_estado_anterior(sender, instance, raw=False, **kwargs):
+    instance._dias_relatorio = set()
+    if instance.pk and not raw:
+        anterior = sender.objects.filter(pk=instance.pk).first()
+        if anterior is not None:
+            instance._dias_relatorio = _dias_afetados(anterior)
+
+
+def _dias_afetados(instance):
+    if isinstance(instance, Venda):
+        return {(instance.funcionario_id, _dia(instance.data_venda))} if instance.data_venda else set()
+    if isinstance(instance, Aluguel):
+        dias = {(instance.funcionario_id, instance.data_inicio)}
+        if instance.pk:
+            # O funcionário do aluguel também é o dos seus pagamentos
+            dias.update(
+                (instance.funcionario_id, _dia(data))
+                for data in instance.pagamentos.values_list('data_pagamento', flat=True)
+            )
+        return dias
+    aluguel = Aluguel.objects.filter(pk=instance.aluguel_id).values_list('funcionario_id', flat=True).first()
+    return {(aluguel, _dia(instance.data_pagamento))} if instance.data_pagamento else set()
+
+
+@receiver(post_save, sender=Venda)
+@receiver(post_save, sender=Aluguel)
+@receiver(post_save, sender=PagamentoAluguel)
+@receiver(post_delete, sender=Venda)
+@receiver(post_delete, sender=Aluguel)
+@receiver(post_delete, sender=PagamentoAluguel)
+def atualizar_relatorios(sender, instance, raw=False, **kwargs):
+    """Recalcula, no commit, só os dias (e os períodos que os contêm) tocados pela alteração"""
+    if not raw:
+        relatorios.agendar(getattr(instance, '_dias_relatorio', set()) | _dias_afetados(instance))
+
+
+@receiver(pre_save, sender=Funcionario)
+def guardar_taxa_anterior(sender, instance, raw=False, **kwargs):
+    instance._taxa_anterior = None
+    if instance.pk and not raw:
+        instance._taxa_anterior = sender.objects.filter(pk=instance.pk).values_list(
+            'comissao_venda', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Funcionario)
+def registrar_taxa_comissao(sender, instance, created, raw=False, **kwargs):
+    """Nova taxa de comissão: entra no histórico a partir de hoje e só o dia de hoje é recalculado"""
+    anterior = getattr(instance, '_taxa_anterior', None)
+    if not raw and not created and anterior is not None and anterior != instance.comissao_venda:
+        dia = comissoes.registrar_taxa(instance, anterior)
+        relatorios.agendar({(instance.pk, dia)})
+
+
+@receiver(post_save, sender=TaxaComissao)
+@receiver(post_delete, sender=TaxaComissao)
+def reconstruir_relatorios(sender, instance, raw=False, **kwargs):
+    """Histórico editado diretamente (ex.: taxa retroativa): todas as comissões podem mudar"""
+    if not raw:
+        relatorios.agendar_reconstrucao()
@@ -1,3 +1,287 @@
-from django.test import TestCase
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from io import StringIO
+
+from apps.alugueis.models import Aluguel, PagamentoAluguel
+from apps.usuarios.models import Cliente, Funcionario, Usuario
+from apps.veiculos.models import Carro, Cor, HistoricoStatusCarro, Marca, Modelo, MovimentacaoEstoque
+from . import comissoes, relatorios, servicos
+from .models import RelatorioVendas, TaxaComissao, Venda
+
+
+class RelatoriosMaterializadosTests(TestCase):
+    """Motor de relatórios: dias calculados das transações, períodos somados dos dias"""
+
+    @classmethod
+    def setUpTestData(cls):
+        modelo = Modelo.objects.create(marca=Marca.objects.create(nome='Hyundai'), nome='Tucson', categoria='suv')
+        cor = Cor.objects.create(nome='Cinzento')
+        cls.carros = [
+            Carro.objects.create(
+                modelo=modelo, cor=cor, ano_fabricacao=2021, ano_modelo=2021, condicao='usado',
+                combustivel='gasolina', transmissao='automatica', chassi=f'R{i:016d}', matricula=f'LD-RV-{i:02d}',
+            )
+            for i in range(3)
+        ]
+        cls.cliente = Cliente.objects.create(nome='Cliente Relatórios', bilhete_identidade='111111111LA111')
+        cls.ana = Funcionario.objects.create(nome='Ana', bilhete_identidade='222222222LA222', comissao_venda=Decimal('2.50'))
+        cls.rui = Funcionario.objects.create(nome='Rui', bilhete_identidade='333333333LA333', comissao_venda=Decimal('1.00'))
+        cls.hoje = timezone.localdate()
+
+    def vender(self, funcionario, valor, carro=0, status='finalizada'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Venda.objects.create(
+                carro=self.carros[carro], cliente=self.cliente, funcionario=funcionario,
+                valor_venda=Decimal(valor), tipo_pagamento='a_vista', status=status,
+            )
+
+    def alugar(self, funcionario, inicio, pagamentos=()):
+        with self.captureOnCommitCallbacks(execute=True):
+            aluguel = Aluguel.objects.create(
+                carro=self.carros[2], cliente=self.cliente, funcionario=funcionario,
+                data_inicio=inicio, data_fim_prevista=inicio + timedelta(days=3),
+                valor_diario=Decimal('25000.00'), valor_total_previsto=Decimal('75000.00'),
+            )
+            for valor in pagamentos:
+                PagamentoAluguel.objects.create(aluguel=aluguel, valor=Decimal(valor))
+        return aluguel
+
+    def linha(self, periodo, funcionario=None, dia=None):
+        return RelatorioVendas.objects.get(
+            periodo=periodo, funcionario=funcionario,
+            data_inicio=relatorios.limites(periodo, dia or self.hoje)[0],
+        )
+
+    def materializado(self):
+        return sorted(
+            RelatorioVendas.objects.values_list(
+                'periodo', 'data_inicio', 'data_fim', 'funcionario_id', 'quantidade_vendas',
+                'valor_total_vendas', 'valor_comissoes', 'quantidade_alugueis', 'valor_total_alugueis',
+            ),
+            key=str,
+        )
+
+    def test_totais_exatos_por_funcionario_e_geral(self):
+        self.vender(self.ana, '1000000.10')
+        self.vender(self.ana, '2000000.20', carro=1)
+        self.vender(self.rui, '500000.00')
+
+        for periodo in relatorios.PERIODOS:
+            with self.subTest(periodo=periodo):
+                ana = self.linha(periodo, self.ana)
+                self.assertEqual(ana.quantidade_vendas, 2)
+                self.assertEqual(ana.valor_total_vendas, Decimal('3000000.30'))
+                self.assertEqual(ana.valor_comissoes, Decimal('75000.01'))
+                geral = self.linha(periodo)
+                self.assertEqual(geral.quantidade_vendas, 3)
+                self.assertEqual(geral.valor_total_vendas, Decimal('3500000.30'))
+                self.assertEqual(geral.valor_comissoes, Decimal('80000.01'))
+
+    def test_incremental_igual_a_reconstrucao(self):
+        self.vender(self.ana, '1500000.00')
+        pendente = self.vender(self.rui, '800000.00', carro=1, status='pendente')
+        semana_passada = self.hoje - timedelta(days=7)
+        self.alugar(self.rui, semana_passada, pagamentos=['25000.00', '50000.00'])
+        self.alugar(self.ana, date(self.hoje.year - 1, 12, 31))
+
+        # Venda finalizada depois: o dia e os períodos que o contêm passam a contá-la
+        with self.captureOnCommitCallbacks(execute=True):
+            pendente.status = 'finalizada'
+            pendente.save()
+        self.assertEqual(self.linha('anual').quantidade_vendas, 2)
+
+        incremental = self.materializado()
+        relatorios.reconstruir()
+        self.assertEqual(incremental, self.materializado())
+
+    def test_alteracao_remove_periodos_sem_atividade(self):
+        venda = self.vender(self.ana, '1000000.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            venda.status = 'cancelada'
+            venda.save()
+        self.assertFalse(RelatorioVendas.objects.exists())
+
+    def test_nova_taxa_de_comissao_recalcula(self):
+        self.vender(self.rui, '1000000.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rui.comissao_venda = Decimal('3.00')
+            self.rui.save()
+        self.assertEqual(self.linha('mensal', self.rui).valor_comissoes, Decimal('30000.00'))
+
+    def test_dashboard_le_apenas_os_relatorios(self):
+        self.vender(self.ana, '1000000.00')
+        self.alugar(self.rui, self.hoje, pagamentos=['75000.00'])
+        cache.clear()
+        self.client.force_login(Usuario.objects.create_user('painel', password='senha-teste'))
+        # sessão, utilizador, totais gerais e ranking do mês
+        with self.assertNumQueries(4):
+            resposta = self.client.get(reverse('core:dashboard'))
+        self.assertEqual(resposta.context['mensal']['valor_total_vendas'], Decimal('1000000.00'))
+        self.assertEqual(resposta.context['diario']['valor_total_alugueis'], Decimal('75000.00'))
+        self.assertEqual(len(resposta.context['meses']), 12)
+        self.assertEqual(
+            [linha.funcionario for linha in resposta.context['ranking']], [self.ana, self.rui]
+        )
+
+
+class ComissoesTests(TestCase):
+    """Motor de comissões: taxa em vigor no dia da venda, somas exatas numa consulta agrupada"""
+
+    @classmethod
+    def setUpTestData(cls):
+        modelo = Modelo.objects.create(marca=Marca.objects.create(nome='Kia'), nome='Sportage', categoria='suv')
+        cls.carro = Carro.objects.create(
+            modelo=modelo, cor=Cor.objects.create(nome='Branco'), ano_fabricacao=2022, ano_modelo=2022,
+            condicao='novo', combustivel='gasolina', transmissao='automatica',
+            chassi='C0000000000000001', matricula='LD-CM-01',
+        )
+        cls.cliente = Cliente.objects.create(nome='Cliente Comissões', bilhete_identidade='444444444LA444')
+        cls.ana = Funcionario.objects.create(nome='Ana', bilhete_identidade='555555555LA555', comissao_venda=Decimal('3.00'))
+        cls.rui = Funcionario.objects.create(nome='Rui', bilhete_identidade='666666666LA666', comissao_venda=Decimal('1.50'))
+        TaxaComissao.objects.bulk_create([
+            TaxaComissao(funcionario=cls.ana, percentual=Decimal('2.00'), vigente_desde=comissoes.INICIO_HISTORICO),
+            TaxaComissao(funcionario=cls.ana, percentual=Decimal('3.00'), vigente_desde=date(2026, 3, 16)),
+        ])
+
+    def vender(self, funcionario, valor, dia, status='finalizada'):
+        venda = Venda.objects.create(
+            carro=self.carro, cliente=self.cliente, funcionario=funcionario,
+            valor_venda=Decimal(valor), tipo_pagamento='a_vista', status=status,
+        )
+        # data_venda é auto_now_add: a data histórica é gravada à parte
+        momento = timezone.make_aware(datetime.combine(dia, time(23, 30)))
+        Venda.objects.filter(pk=venda.pk).update(data_venda=momento)
+        return venda
+
+    def test_taxa_em_vigor_no_dia_da_venda(self):
+        self.vender(self.ana, '1000000.00', date(2026, 3, 15))
+        self.vender(self.ana, '1000000.00', date(2026, 3, 16))
+        self.vender(self.ana, '999999.99', date(2026, 3, 31), status='cancelada')
+        # Sem histórico vale a taxa atual do funcionário
+        self.vender(self.rui, '333333.33', date(2026, 3, 20))
+
+        with self.assertNumQueries(3):
+            folha = comissoes.calcular(date(2026, 3, 1), date(2026, 3, 31))
+        ana, rui = folha
+        self.assertEqual((ana['funcionario_id'], ana['quantidade_vendas']), (self.ana.pk, 2))
+        self.assertEqual(ana['valor_total_vendas'], Decimal('2000000.00'))
+        self.assertEqual(ana['valor_comissao'], Decimal('50000.00'))
+        self.assertEqual(ana['taxas'], {Decimal('2.00'): Decimal('1000000.00'), Decimal('3.00'): Decimal('1000000.00')})
+        self.assertEqual(rui['valor_comissao'], Decimal('5000.00'))
+
+    def test_arredonda_uma_vez_por_periodo(self):
+        # Quase meio centavo de comissão por venda: arredondada venda a venda, a folha daria zero
+        for dia in (2, 3, 4, 5, 6, 7):
+            self.vender(self.rui, '0.33', date(2026, 4, dia))
+        self.vender(self.rui, '0.33', date(2026, 5, 1))
+
+        (abril,) = comissoes.calcular(date(2026, 4, 1), date(2026, 4, 30))
+        self.assertEqual(abril['valor_comissao'], Decimal('0.03'))
+        semanas = comissoes.calcular(None, None, periodo='semanal')
+        self.assertEqual(
+            [(linha['inicio'], linha['fim'], linha['quantidade_vendas']) for linha in semanas],
+            [(date(2026, 4, 2), date(2026, 4, 5), 4), (date(2026, 4, 6), date(2026, 4, 12), 2),
+             (date(2026, 4, 27), date(2026, 5, 1), 1)],
+        )
+
+    def test_nova_taxa_so_vale_a_partir_de_hoje(self):
+        ontem = timezone.localdate() - timedelta(days=1)
+        self.vender(self.rui, '1000000.00', ontem)
+        relatorios.reconstruir()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rui.comissao_venda = Decimal('4.00')
+            self.rui.save()
+        self.assertEqual(
+            list(self.rui.taxas_comissao.order_by('vigente_desde').values_list('percentual', flat=True)),
+            [Decimal('1.50'), Decimal('4.00')],
+        )
+        (linha,) = comissoes.calcular(ontem, timezone.localdate())
+        self.assertEqual(linha['valor_comissao'], Decimal('15000.00'))
+        self.assertEqual(
+            RelatorioVendas.objects.get(periodo='diario', data_inicio=ontem, funcionario=self.rui).valor_comissoes,
+            Decimal('15000.00'),
+        )
+
+    def test_comando_da_folha_mensal(self):
+        self.vender(self.ana, '1000000.00', date(2026, 3, 16))
+        saida = StringIO()
+        call_command('calcular_comissoes', mes='2026-03', stdout=saida)
+        self.assertIn('Ana: 1 vendas (1000000.00 Kz a 3.00%) -> 30000.00 Kz', saida.getvalue())
+        self.assertIn('Total de comissões: 30000.00 Kz.', saida.getvalue())
+
+
+@override_settings(SEMELHANTES_PROCESSAMENTO_SINCRONO=True)
+class RegistrarVendaTests(TestCase):
+    """Venda, saída de estoque e histórico gravados juntos; o mesmo carro não se vende duas vezes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        modelo = Modelo.objects.create(marca=Marca.objects.create(nome='Kia'), nome='Sportage', categoria='suv')
+        cls.carro = Carro.objects.create(
+            modelo=modelo, cor=Cor.objects.create(nome='Branco'), ano_fabricacao=2023, ano_modelo=2023,
+            condicao='novo', combustivel='gasolina', transmissao='automatica', chassi='V0000000000000001',
+            matricula='LD-VD-01', preco_venda=Decimal('18000000.00'),
+        )
+        cls.cliente = Cliente.objects.create(nome='Cliente Venda', bilhete_identidade='777777777LA777')
+        cls.usuario = Usuario.objects.create_user('vendedor', password='senha-teste', is_staff=True)
+        cls.funcionario = Funcionario.objects.create(
+            nome='Vendedor', bilhete_identidade='888888888LA888', usuario=cls.usuario
+        )
+
+    def vender(self, **dados):
+        with self.captureOnCommitCallbacks(execute=True):
+            return servicos.registrar_venda(
+                self.carro.pk, self.cliente, self.funcionario,
+                valor_venda=Decimal('17500000.00'), tipo_pagamento='a_vista', **dados
+            )
+
+    def test_venda_atualiza_estoque_e_historico(self):
+        venda = self.vender()
+
+        self.carro.refresh_from_db()
+        self.assertEqual((self.carro.disponivel_venda, self.carro.disponivel_aluguel), (False, False))
+        self.assertEqual(venda.status, 'finalizada')
+        movimentacao = MovimentacaoEstoque.objects.get(carro=self.carro)
+        self.assertEqual((movimentacao.tipo_movimentacao, movimentacao.venda_id), ('saida_venda', venda.pk))
+        self.assertEqual(HistoricoStatusCarro.objects.get(carro=self.carro).status_novo, 'vendido')
+
+    def test_carro_ja_vendido_e_recusado_sem_escrever(self):
+        self.vender()
+        with self.assertRaises(ValidationError):
+            self.vender()
+        self.assertEqual(Venda.objects.filter(carro=self.carro).count(), 1)
+        self.assertEqual(MovimentacaoEstoque.objects.filter(carro=self.carro).count(), 1)
+
+    def test_formulario_regista_a_venda(self):
+        self.client.force_login(self.usuario)
+        url = reverse('vendas:registrar', args=[self.carro.pk])
+        resposta = self.client.get(url)
+        self.assertEqual(resposta.context['form'].initial['funcionario'], self.funcionario.pk)
+
+        resposta = self.client.post(url, {
+            'cliente': self.cliente.pk, 'funcionario': self.funcionario.pk,
+            'valor_venda': '17500000.00', 'valor_entrada': '5000000.00', 'valor_financiado': '12500000.00',
+            'tipo_pagamento': 'misto', 'numero_parcelas': 24, 'status': 'pendente',
+        })
+        self.assertRedirects(resposta, reverse('administracao:detalhes_veiculo', args=[self.carro.pk]))
+        self.assertEqual(Venda.objects.get(carro=self.carro).status, 'pendente')
+
+        # Já vendido: o formulário deixa de abrir
+        self.assertRedirects(self.client.get(url), reverse('administracao:detalhes_veiculo', args=[self.carro.pk]))
+
+    def test_anonimo_vai_para_o_login_antes_de_consultar_o_carro(self):
+        for pk in (self.carro.pk, 999999):
+            with self.subTest(pk=pk):
+                url = reverse('vendas:registrar', args=[pk])
+                with self.assertNumQueries(0):
+                    resposta = self.client.get(url)
+                self.assertRedirects(resposta, f'{reverse(settings.LOGIN_URL)}?next={url}', fetch_redirect_response=False)
@@ -4,5 +4,6 @@ from . import views
 app_name = 'vendas'
 
 urlpatterns = [
-    
+    path('carro/<int:pk>/vender/', views.RegistrarVendaView.as_view(), name='registrar'),
+    path('exportar/', views.exportar_vendas, name='exportar'),
 ]
@@ -1,3 +1,86 @@
-from django.shortcuts import render
+from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.exceptions import ValidationError
+from django.shortcuts import get_object_or_404, redirect
+from django.views.generic import FormView
 
-# Create your views here.
+from apps.core.exportacao import Exportacao, filtrar
+from apps.veiculos.models import Carro
+from .forms import VendaForm
+from .models import Venda
+from .servicos import registrar_venda
+
+
+class CarroDisponivelMixin:
+    """Carrega o carro da URL e recusa os que já não estão à venda.
+
+    Vem depois do LoginRequiredMixin: um visitante anónimo é enviado para o
+    login antes de qualquer consulta, sem saber se o carro existe.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        self.carro = get_object_or_404(Carro.objects.select_related('modelo__marca', 'cor'), pk=kwargs['pk'])
+        if not self.carro.disponivel_venda:
+            messages.error(request, 'Este carro não está disponível para venda.')
+            return redirect('administracao:detalhes_veiculo', pk=self.carro.pk)
+        return super().dispatch(request, *args, **kwargs)
+
+
+class RegistrarVendaView(LoginRequiredMixin, CarroDisponivelMixin, FormView):
+    form_class = VendaForm
+    template_name = 'vendas/registrar.html'
+
+    def get_initial(self):
+        funcionario = getattr(self.request.user, 'funcionario_profile', None)
+        return {
+            'valor_venda': self.carro.preco_venda,
+            'valor_entrada': self.carro.preco_venda,
+            'funcionario': funcionario.pk if funcionario else None,
+        }
+
+    def get_context_data(self, **kwargs):
+        kwargs['carro'] = self.carro
+        return super().get_context_data(**kwargs)
+
+    def form_valid(self, form):
+        dados = dict(form.cleaned_data)
+        try:
+            venda = registrar_venda(
+                self.carro.pk, dados.pop('cliente'), dados.pop('funcionario'), dados.pop('status'), **dados
+            )
+        except ValidationError as erro:
+            # Vendido por outro pedido entre abrir o formulário e submetê-lo
+            messages.error(self.request, ' '.join(erro.messages))
+            return redirect('administracao:detalhes_veiculo', pk=self.carro.pk)
+        messages.success(self.request, f'Venda #{venda.pk} de {self.carro.nome_completo} registada com sucesso!')
+        return redirect('administracao:detalhes_veiculo', pk=self.carro.pk)
+
+
+EXPORTACAO_VENDAS = Exportacao('vendas', (
+    ('id', 'id'),
+    ('data', 'data_venda'),
+    ('status', 'status'),
+    ('carro_id', 'carro_id'),
+    ('chassi', 'carro__chassi'),
+    ('matricula', 'carro__matricula'),
+    ('cliente', 'cliente__nome'),
+    ('cliente_bi', 'cliente__bilhete_identidade'),
+    ('funcionario', 'funcionario__nome'),
+    ('valor_venda', 'valor_venda'),
+    ('valor_entrada', 'valor_entrada'),
+    ('valor_financiado', 'valor_financiado'),
+    ('tipo_pagamento', 'tipo_pagamento'),
+    ('forma_pagamento', 'forma_pagamento'),
+    ('banco_financiamento', 'banco_financiamento'),
+    ('numero_parcelas', 'numero_parcelas'),
+))
+
+
+@staff_member_required
+def exportar_vendas(request):
+    """Vendas para a contabilidade; filtros ?de=, ?ate=, ?status=, ?funcionario=; ?formato=csv|jsonl"""
+    vendas = filtrar(
+        Venda.objects.all(), request.GET, 'data_venda', status='status', funcionario='funcionario_id',
+    )
+    return EXPORTACAO_VENDAS.resposta(vendas, request.GET.get('formato', 'csv'))
@@ -0,0 +1,235 @@
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q, F, Count, Case, When, Value, CharField, IntegerField
+from django.db.models.functions import Cast
+
+from apps.alugueis import disponibilidade
+from apps.core.exportacao import ID_MAXIMO
+from apps.veiculos.models import Carro
+from apps.veiculos import busca
+
+
+# Faixas de preço (Kz) usadas nas facetas da loja: (chave, mínimo, máximo, rótulo)
+FAIXAS_PRECO = (
+    ('ate_5m', None, Decimal('5000000'), 'Até 5 milhões'),
+    ('5m_10m', Decimal('5000000'), Decimal('10000000'), '5 a 10 milhões'),
+    ('10m_20m', Decimal('10000000'), Decimal('20000000'), '10 a 20 milhões'),
+    ('20m_40m', Decimal('20000000'), Decimal('40000000'), '20 a 40 milhões'),
+    ('acima_40m', Decimal('40000000'), None, 'Acima de 40 milhões'),
+)
+
+ORDENACOES = {
+    'preco_asc': 'preco_venda',
+    'preco_desc': '-preco_venda',
+    'ano_asc': 'ano_modelo',
+    'ano_desc': '-ano_modelo',
+    'km_asc': 'quilometragem',
+    'km_desc': '-quilometragem',
+    'recente': '-data_entrada',
+    'antigo': 'data_entrada',
+}
+
+# Filtros do catálogo -> lookup no Carro
+LOOKUPS = {
+    'marca': 'modelo__marca_id',
+    'cor': 'cor_id',
+    'condicao': 'condicao',
+    'combustivel': 'combustivel',
+    'transmissao': 'transmissao',
+    'ano_min': 'ano_modelo__gte',
+    'ano_max': 'ano_modelo__lte',
+    'preco_min': 'preco_venda__gte',
+    'preco_max': 'preco_venda__lte',
+}
+
+# Facetas: (coluna agrupada, filtros ignorados na contagem). Cada faceta conta
+# sem o seu próprio filtro, para as outras opções continuarem a mostrar
+# quantos carros teriam; com uma marca escolhida, as restantes não ficam a (0).
+FACETAS = {
+    'marcas': ('modelo__marca_id', ('marca',)),
+    'cores': ('cor_id', ('cor',)),
+    'combustiveis': ('combustivel', ('combustivel',)),
+    'transmissoes': ('transmissao', ('transmissao',)),
+    'condicoes': ('condicao', ('condicao',)),
+    'anos': ('ano_modelo', ('ano_min', 'ano_max')),
+    'faixas_preco': ('faixa_preco', ('preco_min', 'preco_max', 'faixa')),
+}
+
+
+def _inteiro(valor):
+    # Fora do alcance de um inteiro do banco é tão inválido como um texto
+    try:
+        valor = int(valor)
+    except (TypeError, ValueError):
+        return None
+    return valor if abs(valor) <= ID_MAXIMO else None
+
+
+def _decimal(valor):
+    try:
+        return Decimal(valor)
+    except (TypeError, ValueError, InvalidOperation):
+        return None
+
+
+def _data(valor):
+    try:
+        return date.fromisoformat(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _escolha(valor, choices):
+    return valor if valor in dict(choices) else None
+
+
+def condicao_faixa(chave):
+    """Q da faixa de preço: mínimo inclusivo, máximo exclusivo, como nas contagens"""
+    _, minimo, maximo, _ = next(faixa for faixa in FAIXAS_PRECO if faixa[0] == chave)
+    condicao = Q(preco_venda__isnull=False)
+    if minimo is not None:
+        condicao &= Q(preco_venda__gte=minimo)
+    if maximo is not None:
+        condicao &= Q(preco_venda__lt=maximo)
+    return condicao
+
+
+class BuscaCatalogo:
+    """Motor de busca da loja: filtros, ordenação e facetas numa única condição"""
+
+    def __init__(self, params):
+        self.params = params
+        self.filtros = self._limpar_filtros(params)
+        if params.get('ordem') in ORDENACOES or (params.get('ordem') == 'relevancia' and 'search' in self.filtros):
+            self.ordem = params.get('ordem')
+        else:
+            # Com texto de busca e sem ordenação escolhida, os mais relevantes vêm primeiro
+            self.ordem = 'relevancia' if 'search' in self.filtros else 'recente'
+
+    def _limpar_filtros(self, params):
+        """Valida os parâmetros GET, descartando valores inválidos em vez de gerar erro 500"""
+        filtros = {
+            'search': (params.get('search') or '').strip() or None,
+            'marca': _inteiro(params.get('marca')),
+            'cor': _inteiro(params.get('cor')),
+            'condicao': _escolha(params.get('condicao'), Carro.CONDICAO_CHOICES),
+            'combustivel': _escolha(params.get('combustivel'), Carro.COMBUSTIVEL_CHOICES),
+            'transmissao': _escolha(params.get('transmissao'), Carro.TRANSMISSAO_CHOICES),
+            'ano_min': _inteiro(params.get('ano_min')),
+            'ano_max': _inteiro(params.get('ano_max')),
+            'preco_min': _decimal(params.get('preco_min')),
+            'preco_max': _decimal(params.get('preco_max')),
+            'faixa': _escolha(params.get('faixa'), [(chave, rotulo) for chave, _, _, rotulo in FAIXAS_PRECO]),
+        }
+        # Datas de aluguel só contam juntas e por ordem
+        inicio, fim = _data(params.get('aluguel_inicio')), _data(params.get('aluguel_fim'))
+        if inicio and fim and inicio <= fim:
+            filtros['aluguel_inicio'], filtros['aluguel_fim'] = inicio, fim
+        return {chave: valor for chave, valor in filtros.items() if valor is not None}
+
+    def condicao(self, ignorar=()):
+        """Monta todos os filtros ativos num único objeto Q, exceto os de `ignorar`"""
+        f = {chave: valor for chave, valor in self.filtros.items() if chave not in ignorar}
+        if 'aluguel_inicio' in f:
+            # Carros de aluguel sem nenhum dia ocupado entre as datas pedidas
+            condicao = Q(disponivel_aluguel=True)
+            ocupados = self._ocupados()
+            if ocupados:
+                condicao &= ~Q(pk__in=ocupados)
+        else:
+            condicao = Q(disponivel_venda=True)
+
+        if 'search' in f:
+            condicao &= busca.condicao_busca(f['search'], busca.COLUNAS_PUBLICAS)
+
+        for chave, lookup in LOOKUPS.items():
+            if chave in f:
+                condicao &= Q(**{lookup: f[chave]})
+        if 'faixa' in f:
+            condicao &= condicao_faixa(f['faixa'])
+
+        return condicao
+
+    def _ocupados(self):
+        # Calculado uma vez por busca: a listagem e as facetas usam a mesma condição
+        if not hasattr(self, '_carros_ocupados'):
+            self._carros_ocupados = disponibilidade.calendario().ocupados(
+                self.filtros['aluguel_inicio'], self.filtros['aluguel_fim']
+            )
+        return self._carros_ocupados
+
+    def ordenacao(self):
+        if self.ordem == 'relevancia':
+            return busca.ordenacao_relevancia()
+        return [ORDENACOES[self.ordem]]
+
+    def resultados(self):
+        """Queryset da listagem, com os relacionamentos usados nos cartões"""
+        return Carro.objects.select_related(
+            'modelo__marca', 'cor', 'foto_capa'
+        ).filter(
+            self.condicao()
+        ).order_by(*self.ordenacao())
+
+    def facetas(self):
+        """Contagens por marca, cor, combustível, transmissão, condição, ano e faixa de preço.
+
+        Um GROUP BY por faceta, cada um sobre os filtros ativos menos os da
+        própria faceta, juntos numa única consulta com UNION ALL. A parte
+        'total' conta os carros com todos os filtros, para a paginação por
+        cursor, que não faz COUNT.
+        """
+        faixa_preco = Case(
+            *[When(condicao_faixa(chave), then=Value(indice)) for indice, (chave, *_) in enumerate(FAIXAS_PRECO)],
+            default=Value(None),
+            output_field=IntegerField(),
+        )
+
+        def contagem(nome, coluna, condicao):
+            return Carro.objects.filter(condicao).order_by().annotate(
+                faixa_preco=faixa_preco,
+            ).annotate(
+                faceta=Value(nome, output_field=CharField()),
+                chave=Cast(coluna, CharField()),
+            ).values_list('faceta', 'chave').annotate(total=Count('id'))
+
+        partes = [
+            contagem(nome, F(coluna), self.condicao(ignorar=ignorar))
+            for nome, (coluna, ignorar) in FACETAS.items()
+        ]
+        partes.append(contagem('total', Value(''), self.condicao()))
+        linhas = partes[0].union(*partes[1:], all=True)
+
+        contagens = {nome: {} for nome in FACETAS}
+        total = 0
+        for nome, chave, quantidade in linhas:
+            if nome == 'total':
+                total = quantidade
+            elif chave is not None:
+                contagens[nome][chave] = quantidade
+
+        def inteiros(valores):
+            return {int(chave): quantidade for chave, quantidade in valores.items()}
+
+        faixas = inteiros(contagens['faixas_preco'])
+        return {
+            'total': total,
+            'marcas': inteiros(contagens['marcas']),
+            'cores': inteiros(contagens['cores']),
+            'combustiveis': contagens['combustiveis'],
+            'transmissoes': contagens['transmissoes'],
+            'condicoes': contagens['condicoes'],
+            'anos': sorted(inteiros(contagens['anos']).items(), reverse=True),
+            'faixas_preco': [
+                {
+                    'chave': chave,
+                    'rotulo': rotulo,
+                    'preco_min': minimo,
+                    'preco_max': maximo,
+                    'total': faixas[indice],
+                }
+                for indice, (chave, minimo, maximo, rotulo) in enumerate(FAIXAS_PRECO)
+                if indice in faixas
+            ],
+        }
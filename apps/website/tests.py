@@ -1,3 +1,142 @@
+from decimal import Decimal
+from urllib.parse import parse_qs
+
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+
+from apps.core.cache import ESTOQUE, versao
+from apps.veiculos.models import Carro, Cor, FotoCarro, Marca, Modelo
+from .catalogo import BuscaCatalogo
+
+
+class FacetasCatalogoTests(TestCase):
+    """Contagens das facetas da loja e links das faixas de preço"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.toyota = Marca.objects.create(nome='Toyota')
+        cls.honda = Marca.objects.create(nome='Honda')
+        corolla = Modelo.objects.create(marca=cls.toyota, nome='Corolla', categoria='sedan')
+        civic = Modelo.objects.create(marca=cls.honda, nome='Civic', categoria='sedan')
+        cor = Cor.objects.create(nome='Branco')
+        precos = [Decimal('4000000'), Decimal('5000000'), Decimal('10000000'), Decimal('15000000'), None]
+        for i, preco in enumerate(precos):
+            Carro.objects.create(
+                modelo=corolla if i % 2 == 0 else civic, cor=cor, ano_fabricacao=2018 + i, ano_modelo=2018 + i,
+                condicao='novo' if i < 2 else 'usado', combustivel='gasolina', transmissao='manual',
+                preco_venda=preco, quilometragem=1000 * i, disponivel_venda=True,
+                chassi=f'{i:017d}', matricula=f'LD-{i:05d}',
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_faceta_ignora_o_proprio_filtro(self):
+        facetas = BuscaCatalogo({'marca': str(self.toyota.pk)}).facetas()
+
+        # Marcas contadas sem o filtro de marca; as outras facetas respeitam-no
+        self.assertEqual(facetas['marcas'], {self.toyota.pk: 3, self.honda.pk: 2})
+        self.assertEqual(facetas['condicoes'], {'novo': 1, 'usado': 2})
+        self.assertEqual(facetas['total'], 3)
+
+        facetas = BuscaCatalogo({'marca': str(self.toyota.pk), 'condicao': 'novo'}).facetas()
+        self.assertEqual(facetas['marcas'], {self.toyota.pk: 1, self.honda.pk: 1})
+        self.assertEqual(facetas['condicoes'], {'novo': 1, 'usado': 2})
+        self.assertEqual(facetas['total'], 1)
+
+    def test_faixa_de_preco_com_maximo_exclusivo(self):
+        faixas = {f['chave']: f['total'] for f in BuscaCatalogo({}).facetas()['faixas_preco']}
+        self.assertEqual(faixas, {'ate_5m': 1, '5m_10m': 1, '10m_20m': 2})
+
+        # O link da faixa filtra exatamente os carros contados nela
+        for chave, total in faixas.items():
+            with self.subTest(faixa=chave):
+                self.assertEqual(BuscaCatalogo({'faixa': chave}).resultados().count(), total)
+        # e uma faixa escolhida não esconde as restantes
+        faixas = BuscaCatalogo({'faixa': '5m_10m'}).facetas()['faixas_preco']
+        self.assertEqual(len(faixas), 3)
+
+    def test_links_das_faixas_mantem_os_filtros(self):
+        resposta = self.client.get(reverse('website:loja'), {
+            'marca': self.toyota.pk, 'condicao': 'usado', 'ordem': 'preco_asc', 'preco_min': '1',
+        })
+        faixa = resposta.context['facetas']['faixas_preco'][0]
+        parametros = parse_qs(faixa['url'].lstrip('?'))
+        self.assertEqual(parametros, {
+            'marca': [str(self.toyota.pk)], 'condicao': ['usado'], 'ordem': ['preco_asc'], 'faixa': [faixa['chave']],
+        })
+        self.assertContains(resposta, f'href="{faixa["url"].replace("&", "&amp;")}"')
+
+
+    def test_ids_fora_do_alcance_do_banco_sao_ignorados(self):
+        enorme = '9' * 20
+        for parametro in ('marca', 'cor', 'ano_min'):
+            with self.subTest(parametro=parametro):
+                self.assertNotIn(parametro, BuscaCatalogo({parametro: enorme}).filtros)
+                resposta = self.client.get(reverse('website:loja'), {parametro: enorme})
+                self.assertEqual(resposta.status_code, 200)
+                self.assertEqual(resposta.context['facetas']['total'], Carro.objects.filter(disponivel_venda=True).count())
+
+class HomeCacheTests(TestCase):
+    """Blocos da página inicial em cache, refeitos quando o estoque muda"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.marca = Marca.objects.create(nome='Toyota')
+        cls.modelo = Modelo.objects.create(marca=cls.marca, nome='Hilux', categoria='pickup')
+        cls.cor = Cor.objects.create(nome='Branco')
+        cls.carro = cls.criar_carro(1)
+
+    @classmethod
+    def criar_carro(cls, numero):
+        return Carro.objects.create(
+            modelo=cls.modelo, cor=cls.cor, ano_fabricacao=2020, ano_modelo=2020, condicao='novo',
+            combustivel='diesel', transmissao='manual', disponivel_venda=True,
+            chassi=f'{numero:017d}', matricula=f'LD-{numero:05d}',
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def pagina(self):
+        resposta = self.client.get(reverse('website:home'))
+        self.assertEqual(resposta['X-Cache'], 'MISS')
+        return resposta.context
+
+    def assertInvalida(self, alteracao):
+        antes = versao(ESTOQUE)
+        alteracao()
+        self.assertGreater(versao(ESTOQUE), antes)
+
+    def test_alteracoes_no_estoque_refazem_os_blocos(self):
+        contexto = self.pagina()
+        self.assertEqual(contexto['total_carros'], 1)
+        self.assertEqual(self.client.get(reverse('website:home'))['X-Cache'], 'HIT')
+
+        self.assertInvalida(lambda: self.criar_carro(2))
+        contexto = self.pagina()
+        self.assertEqual(contexto['total_carros'], 2)
+        self.assertEqual(contexto['marcas_populares'][0]['total_carros'], 2)
+
+        def renomear_marca():
+            self.marca.nome = 'Lexus'
+            self.marca.save()
+        self.assertInvalida(renomear_marca)
+        self.assertEqual(self.pagina()['marcas_populares'][0]['nome'], 'Lexus')
+
+        foto = FotoCarro.objects.create(carro=self.carro, foto='carros/fotos/h.jpg', foto_principal=True)
+        destaque = {carro.pk: carro for carro in self.pagina()['carros_destaque']}
+        self.assertEqual(destaque[self.carro.pk].foto_capa_id, foto.pk)
+        self.assertInvalida(foto.delete)
+        destaque = {carro.pk: carro for carro in self.pagina()['carros_destaque']}
+        self.assertIsNone(destaque[self.carro.pk].foto_capa_id)
+
+        self.assertInvalida(self.carro.delete)
+        contexto = self.pagina()
+        self.assertEqual(contexto['total_carros'], 1)
+        self.assertNotIn(self.carro.pk, [carro.pk for carro in contexto['carros_destaque']])
 
-# Create your tests here.
+        outra = Marca.objects.create(nome='Kia')
+        self.pagina()
+        self.assertInvalida(outra.delete)
@@ -1,21 +1,20 @@
 #apps/core/urls-py
 from django.urls import path
+from apps.core.cache import ALUGUEIS, ESTOQUE, cache_pagina_anonima
 from . import views
 
 app_name = 'website'
 
 urlpatterns = [
    # path('', views.home_view, name='home'),
-    path('sobre/', views.sobre_view, name='sobre'),
-    path('contato/', views.contacto_view, name='contato'),
+    path('sobre/', cache_pagina_anonima(namespaces=())(views.sobre_view), name='sobre'),
+    path('contato/', cache_pagina_anonima(namespaces=())(views.contacto_view), name='contato'),
     path('login/', views.login_website_view, name='login'),
     path('cadastro/', views.cadastro_view, name='cadastro'),
     
-    path('', views.HomeView.as_view(), name='home'),
+    path('', cache_pagina_anonima()(views.HomeView.as_view()), name='home'),
     
-    path('loja/', views.CarroListView.as_view(), name='loja'),
-    path('carro/<int:pk>/', views.CarroDetailView.as_view(), name='carro_detailhe'),
+    # A loja filtra também por datas de aluguel: os aluguéis entram na chave
+    path('loja/', cache_pagina_anonima(namespaces=(ESTOQUE, ALUGUEIS))(views.CarroListView.as_view()), name='loja'),
+    path('carro/<int:pk>/', cache_pagina_anonima()(views.CarroDetailView.as_view()), name='carro_detailhe'),
 ]
-
-    
-  
\ No newline at end of file
@@ -1,11 +1,20 @@
 from django.shortcuts import render
 from django.views.generic import ListView, DetailView, TemplateView
-from django.db.models import Q
-from django.core.paginator import Paginator
-from apps.veiculos.models import Carro, Marca, Cor, Modelo, FotoCarro
-from django.shortcuts import get_object_or_404
+from apps.veiculos.models import Carro, CarroSemelhante, FotoCarro
 from django.http import Http404
-from django.db.models import Q, Count
+from django.db.models import Q, Count, Prefetch
+
+from copy import copy
+
+from django.core.cache import cache
+
+from apps.core.cache import ESTOQUE, chave_versionada
+from apps.core.paginacao import PaginacaoCursorMixin
+from apps.veiculos.referencias import cores_ativas, marcas_ativas
+from .catalogo import BuscaCatalogo
+
+# Tempo máximo (s) dos blocos da página inicial em cache; mudanças no estoque invalidam antes
+HOME_CACHE_TIMEOUT = 60 * 15
 
 def home_view(request):
     return render(request, 'website/home.html')
@@ -34,131 +43,104 @@ class HomeView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Carros em destaque (mais recentes disponíveis para venda)
-        carros_destaque = Carro.objects.select_related(
-            'modelo__marca', 'cor'
-        ).prefetch_related('fotos').filter(
-            disponivel_venda=True
-        ).order_by('-data_entrada')[:6]
-        
-        # Estatísticas gerais
-        context['total_carros'] = Carro.objects.filter(disponivel_venda=True).count()
-        context['total_marcas'] = Marca.objects.filter(ativo=True).count()
-        context['carros_novos'] = Carro.objects.filter(
-            disponivel_venda=True, 
-            condicao='novo'
-        ).count()
-        context['carros_usados'] = Carro.objects.filter(
-            disponivel_venda=True, 
-            condicao='usado'
-        ).count()
-        
-        # Carros em destaque
-        context['carros_destaque'] = carros_destaque
-        
-        # Marcas mais populares (com mais carros disponíveis)
-        marcas_populares = Marca.objects.filter(
-            ativo=True,
-            modelos__carros__disponivel_venda=True
-        ).distinct().annotate(
-            total_carros=Count('modelos__carros', 
-                                    filter=Q(modelos__carros__disponivel_venda=True))
-        ).order_by('-total_carros')[:8]
-        
-        context['marcas_populares'] = marcas_populares
+        # Estatísticas, destaques e marcas vêm de cache, invalidado quando o estoque muda
+        chave = chave_versionada(ESTOQUE, 'website:home')
+        dados = cache.get(chave)
+        if dados is None:
+            dados = self.get_dados_home()
+            cache.set(chave, dados, HOME_CACHE_TIMEOUT)
+        context.update(dados)
         
         return context
+    
+    def get_dados_home(self):
+        """Calcula os blocos da página inicial com o mínimo de consultas"""
+        # Estatísticas gerais (uma única agregação sobre os carros disponíveis)
+        estatisticas = Carro.objects.filter(disponivel_venda=True).aggregate(
+            total_carros=Count('id'),
+            carros_novos=Count('id', filter=Q(condicao='novo')),
+            carros_usados=Count('id', filter=Q(condicao='usado')),
+        )
+        
+        # Carros em destaque (mais recentes disponíveis para venda)
+        carros_destaque = list(Carro.objects.select_related(
+            'modelo__marca', 'cor', 'foto_capa'
+        ).filter(
+            disponivel_venda=True
+        ).order_by('-data_entrada')[:6])
+        
+        # Marcas mais populares (com mais carros disponíveis), agrupando direto nos carros
+        marcas_populares = [
+            {
+                'id': linha['modelo__marca_id'],
+                'nome': linha['modelo__marca__nome'],
+                'total_carros': linha['total_carros'],
+            }
+            for linha in Carro.objects.filter(
+                disponivel_venda=True,
+                modelo__marca__ativo=True
+            ).values(
+                'modelo__marca_id', 'modelo__marca__nome'
+            ).annotate(
+                total_carros=Count('id')
+            ).order_by('-total_carros', 'modelo__marca__nome')[:8]
+        ]
+        
+        return {
+            **estatisticas,
+            'total_marcas': len(marcas_ativas()),
+            'carros_destaque': carros_destaque,
+            'marcas_populares': marcas_populares,
+        }
 
-class CarroListView(ListView):
+class CarroListView(PaginacaoCursorMixin, ListView):
     model = Carro
     template_name = 'website/loja.html'
     context_object_name = 'carros'
     paginate_by = 12
     
     def get_queryset(self):
-        queryset = Carro.objects.select_related(
-            'modelo__marca', 'cor'
-        ).prefetch_related('fotos', 'opcionais').filter(
-            disponivel_venda=True
-        )
-        
-        # Filtros de busca
-        search = self.request.GET.get('search')
-        if search:
-            queryset = queryset.filter(
-                Q(modelo__nome__icontains=search) |
-                Q(modelo__marca__nome__icontains=search) |
-                Q(descricao__icontains=search)
-            )
-        
-        # Filtro por marca
-        marca = self.request.GET.get('marca')
-        if marca:
-            queryset = queryset.filter(modelo__marca__id=marca)
-        
-        # Filtro por cor
-        cor = self.request.GET.get('cor')
-        if cor:
-            queryset = queryset.filter(cor__id=cor)
-        
-        # Filtro por condição
-        condicao = self.request.GET.get('condicao')
-        if condicao:
-            queryset = queryset.filter(condicao=condicao)
-        
-        # Filtro por combustível
-        combustivel = self.request.GET.get('combustivel')
-        if combustivel:
-            queryset = queryset.filter(combustivel=combustivel)
-        
-        # Filtro por transmissão
-        transmissao = self.request.GET.get('transmissao')
-        if transmissao:
-            queryset = queryset.filter(transmissao=transmissao)
-        
-        # Filtro por ano
-        ano_min = self.request.GET.get('ano_min')
-        ano_max = self.request.GET.get('ano_max')
-        if ano_min:
-            queryset = queryset.filter(ano_modelo__gte=ano_min)
-        if ano_max:
-            queryset = queryset.filter(ano_modelo__lte=ano_max)
-        
-        # Filtro por preço
-        preco_min = self.request.GET.get('preco_min')
-        preco_max = self.request.GET.get('preco_max')
-        if preco_min:
-            queryset = queryset.filter(preco_venda__gte=preco_min)
-        if preco_max:
-            queryset = queryset.filter(preco_venda__lte=preco_max)
-        
-        # Ordenação
-        ordenacao = self.request.GET.get('ordem', '-data_entrada')
-        ordenacao_opcoes = {
-            'preco_asc': 'preco_venda',
-            'preco_desc': '-preco_venda',
-            'ano_asc': 'ano_modelo',
-            'ano_desc': '-ano_modelo',
-            'km_asc': 'quilometragem',
-            'km_desc': '-quilometragem',
-            'recente': '-data_entrada',
-            'antigo': 'data_entrada',
-        }
-        
-        if ordenacao in ordenacao_opcoes:
-            queryset = queryset.order_by(ordenacao_opcoes[ordenacao])
-        
-        return queryset
+        # Toda a filtragem e ordenação fica a cargo do motor de busca do catálogo
+        self.busca = BuscaCatalogo(self.request.GET)
+        return self.busca.resultados()
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        
-        # Adicionar dados para os filtros
-        context['marcas'] = Marca.objects.filter(ativo=True).order_by('nome')
-        context['cores'] = Cor.objects.filter(ativo=True).order_by('nome')
-        context['condicoes'] = Carro.CONDICAO_CHOICES
-        context['combustiveis'] = Carro.COMBUSTIVEL_CHOICES
-        context['transmissoes'] = Carro.TRANSMISSAO_CHOICES
+        facetas = self.busca.facetas()
+        
+        # Adicionar dados para os filtros (com as contagens das facetas)
+        totais_marca = facetas['marcas']
+        totais_cor = facetas['cores']
+        # Cópias: os objetos das listas de referência são partilhados entre pedidos
+        marcas = [copy(marca) for marca in marcas_ativas()]
+        for marca in marcas:
+            marca.total_carros = totais_marca.get(marca.id, 0)
+        cores = [copy(cor) for cor in cores_ativas()]
+        for cor in cores:
+            cor.total_carros = totais_cor.get(cor.id, 0)
+        
+        context['marcas'] = marcas
+        context['cores'] = cores
+        context['condicoes'] = [
+            (valor, rotulo, facetas['condicoes'].get(valor, 0))
+            for valor, rotulo in Carro.CONDICAO_CHOICES
+        ]
+        context['combustiveis'] = [
+            (valor, rotulo, facetas['combustiveis'].get(valor, 0))
+            for valor, rotulo in Carro.COMBUSTIVEL_CHOICES
+        ]
+        context['transmissoes'] = [
+            (valor, rotulo, facetas['transmissoes'].get(valor, 0))
+            for valor, rotulo in Carro.TRANSMISSAO_CHOICES
+        ]
+        # Links das faixas de preço: mantêm os outros filtros e trocam só a faixa
+        for faixa in facetas['faixas_preco']:
+            parametros = self.request.GET.copy()
+            for chave in ('preco_min', 'preco_max', 'faixa', 'page', 'cursor'):
+                parametros.pop(chave, None)
+            parametros['faixa'] = faixa['chave']
+            faixa['url'] = f'?{parametros.urlencode()}'
+        context['facetas'] = facetas
         
         # Manter valores dos filtros no contexto
         context['filtros_ativos'] = {
@@ -172,12 +154,18 @@ class CarroListView(ListView):
             'ano_max': self.request.GET.get('ano_max', ''),
             'preco_min': self.request.GET.get('preco_min', ''),
             'preco_max': self.request.GET.get('preco_max', ''),
-            'ordem': self.request.GET.get('ordem', 'recente'),
+            'faixa': self.busca.filtros.get('faixa', ''),
+            'aluguel_inicio': self.request.GET.get('aluguel_inicio', ''),
+            'aluguel_fim': self.request.GET.get('aluguel_fim', ''),
+            'ordem': self.busca.ordem,
         }
         
-        # Estatísticas para exibição
-        total_carros = self.get_queryset().count()
-        context['total_carros'] = total_carros
+        # Estatísticas para exibição: reaproveita a contagem do paginador ou, na
+        # paginação por cursor (sem COUNT), o total calculado com as facetas
+        if context['paginator'] is not None:
+            context['total_carros'] = context['paginator'].count
+        else:
+            context['total_carros'] = facetas['total']
         
         return context
     
@@ -193,7 +181,8 @@ class CarroDetailView(DetailView):
             'modelo__marca',
             'cor'
         ).prefetch_related(
-            'fotos',
+            # Mesma ordem da capa: a foto principal primeiro, depois pela ordem de exibição
+            Prefetch('fotos', queryset=FotoCarro.objects.order_by('-foto_principal', 'ordem', 'data_upload', 'id')),
             'opcionais'
         )
     
@@ -223,10 +212,10 @@ class CarroDetailView(DetailView):
         context = super().get_context_data(**kwargs)
         carro = self.object
         
-        # Fotos organizadas (principal primeiro, depois por ordem)
-        fotos = carro.fotos.all().order_by('-foto_principal', 'ordem', 'data_upload')
+        # Fotos já carregadas pelo prefetch, com a principal primeiro
+        fotos = list(carro.fotos.all())
         context['fotos'] = fotos
-        context['foto_principal'] = fotos.filter(foto_principal=True).first() or fotos.first()
+        context['foto_principal'] = fotos[0] if fotos else None
         
         # Opcionais organizados por categoria
         opcionais = carro.opcionais.filter(ativo=True).order_by('categoria', 'nome')
@@ -238,14 +227,14 @@ class CarroDetailView(DetailView):
             opcionais_por_categoria[categoria].append(opcional)
         context['opcionais_por_categoria'] = opcionais_por_categoria
         
-        # Carros relacionados (mesma marca e categoria, excluindo o atual)
-        carros_relacionados = Carro.objects.select_related(
-            'modelo__marca', 'cor'
-        ).prefetch_related('fotos').filter(
-            modelo__marca=carro.modelo.marca,
-            modelo__categoria=carro.modelo.categoria,
-            disponivel_venda=True
-        ).exclude(id=carro.id)[:4]
+        # Carros semelhantes pré-calculados (preço, ano, km, categoria, opcionais...)
+        carros_relacionados = [
+            linha.semelhante for linha in CarroSemelhante.objects.filter(
+                carro=carro
+            ).select_related(
+                'semelhante__modelo__marca', 'semelhante__cor', 'semelhante__foto_capa'
+            ).order_by('posicao')
+        ]
         context['carros_relacionados'] = carros_relacionados
         
         # Informações técnicas organizadas
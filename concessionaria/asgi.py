@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'concessionaria.settings')
 
 application = get_asgi_application()
+
+# O varredor de aluguéis atrasados corre só no processo que serve pedidos
+from apps.alugueis.atrasos import iniciar_no_servidor  # noqa: E402
+
+iniciar_no_servidor()
@@ -1,9 +1,7 @@
 from pathlib import Path
 from decouple import config
 import os
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -15,28 +13,41 @@ DEBUG = config('DEBUG', default=True, cast=bool)
 
 ALLOWED_HOSTS = ['.onrender.com', '127.0.0.1']
 
-# Configuração do Cloudinary 
-
-# Para compatibilidade com versões anteriores (opcional)
-cloudinary.config(
-    cloud_name=config('CLOUDINARY_CLOUD_NAME'),
-    api_key=config('CLOUDINARY_API_KEY'),
-    api_secret=config('CLOUDINARY_API_SECRET'),
-    secure=True
+# Armazenamento de ficheiros enviados (fotos, documentos):
+#   cloudinary - Cloudinary (padrão quando as credenciais estão definidas)
+#   local      - disco local, com nomes pelo hash do conteúdo e deduplicação (sem rede)
+ARMAZENAMENTO = config(
+    'ARMAZENAMENTO',
+    default='cloudinary' if config('CLOUDINARY_CLOUD_NAME', default='') else 'local'
 )
-CLOUDINARY_STORAGE = {
-    'CLOUD_NAME': config('CLOUDINARY_CLOUD_NAME'),
-    'API_KEY': config('CLOUDINARY_API_KEY'),
-    'API_SECRET': config('CLOUDINARY_API_SECRET'),
-    'SECURE': True,
-}
+
+if ARMAZENAMENTO == 'cloudinary':
+    # Configuração do Cloudinary
+    import cloudinary
+
+    # Para compatibilidade com versões anteriores (opcional)
+    cloudinary.config(
+        cloud_name=config('CLOUDINARY_CLOUD_NAME'),
+        api_key=config('CLOUDINARY_API_KEY'),
+        api_secret=config('CLOUDINARY_API_SECRET'),
+        secure=True
+    )
+    CLOUDINARY_STORAGE = {
+        'CLOUD_NAME': config('CLOUDINARY_CLOUD_NAME'),
+        'API_KEY': config('CLOUDINARY_API_KEY'),
+        'API_SECRET': config('CLOUDINARY_API_SECRET'),
+        'SECURE': True,
+    }
+    ARMAZENAMENTO_BACKEND = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+else:
+    ARMAZENAMENTO_BACKEND = 'apps.core.storage.ArmazenamentoConteudo'
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedStaticFilesStorage'
 
 # Configuração do storage padrão
 STORAGES = {
     "default": {
-        "BACKEND": "cloudinary_storage.storage.MediaCloudinaryStorage",
+        "BACKEND": ARMAZENAMENTO_BACKEND,
     },
     "staticfiles": {
         "BACKEND": "whitenoise.storage.CompressedStaticFilesStorage",
@@ -47,6 +58,13 @@ STORAGES = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Variantes das fotos: geradas numa pool de threads após o upload (síncrono útil em testes/depuração)
+IMAGENS_PROCESSAMENTO_SINCRONO = config('IMAGENS_PROCESSAMENTO_SINCRONO', default=False, cast=bool)
+IMAGENS_WORKERS = config('IMAGENS_WORKERS', default=2, cast=int)
+
+# Carros semelhantes: recalculados numa thread à parte após o commit (síncrono útil em testes/depuração)
+SEMELHANTES_PROCESSAMENTO_SINCRONO = config('SEMELHANTES_PROCESSAMENTO_SINCRONO', default=False, cast=bool)
+
 
 # Application definition
 INSTALLED_APPS = [
@@ -57,9 +75,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     
     # Apps de terceiros
-    'cloudinary_storage',
     'django.contrib.staticfiles',
-    'cloudinary',
 
     'crispy_forms',
     'crispy_bootstrap5',
@@ -73,7 +89,14 @@ INSTALLED_APPS = [
     'apps.website',
 ]
 
+if ARMAZENAMENTO == 'cloudinary':
+    # cloudinary_storage tem de vir antes de staticfiles (substitui o collectstatic)
+    INSTALLED_APPS.insert(INSTALLED_APPS.index('django.contrib.staticfiles'), 'cloudinary_storage')
+    INSTALLED_APPS.insert(INSTALLED_APPS.index('django.contrib.staticfiles') + 1, 'cloudinary')
+
 MIDDLEWARE = [
+    # Primeiro da cadeia para medir o pedido inteiro; inativo sem PERFILAMENTO
+    'apps.core.middleware.PerfilamentoMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -115,6 +138,43 @@ DATABASES = {
 }
 
 
+# Cache
+# Memória local por padrão; CACHE_BACKEND=arquivo partilha o cache entre processos (ex.: workers do gunicorn)
+CACHE_BACKEND = config('CACHE_BACKEND', default='memoria')
+
+if CACHE_BACKEND == 'arquivo':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': config('CACHE_LOCATION', default=os.path.join(tempfile.gettempdir(), 'concessionaria_cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'concessionaria',
+        }
+    }
+
+# Tempo máximo (s) das páginas públicas em cache para visitantes anónimos
+PAGINA_CACHE_TIMEOUT = config('PAGINA_CACHE_TIMEOUT', default=300, cast=int)
+
+# Tempo máximo (s) das listas de referência (marcas, modelos, cores, opcionais) na memória de cada processo
+REFERENCIAS_VALIDADE = config('REFERENCIAS_VALIDADE', default=60, cast=int)
+
+# Tempo máximo (s) do calendário de aluguéis (disponibilidade por datas) na memória de cada processo
+DISPONIBILIDADE_VALIDADE = config('DISPONIBILIDADE_VALIDADE', default=60, cast=int)
+
+# Intervalo (s) do varredor que marca aluguéis atrasados; 0 desliga. Arranca só no
+# processo do servidor (wsgi.py/asgi.py), nunca nos comandos de gestão. Com vários
+# workers, ligar em um só ou usar antes o comando marcar_atrasados num cron.
+VARREDURA_ATRASOS_INTERVALO = config('VARREDURA_ATRASOS_INTERVALO', default=0, cast=int)
+
+# Perfilamento por pedido (Server-Timing e core:perfilamento); desligado não custa nada
+PERFILAMENTO = config('PERFILAMENTO', default=False, cast=bool)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 